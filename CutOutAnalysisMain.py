@@ -5,13 +5,14 @@ Created on Sun Apr 25 11:51:36 2021
 @author: Greg
 """
 #%% Imports etc.
+# Only the GUI is imported here so that the window appears quickly.  The
+# DICOM, table and image analysis modules are imported by the stage that
+# first uses them.
+import threading
+import time
 from pathlib import Path
 
 import PySimpleGUI as sg
-import pandas as pd
-from load_dicom_e_plan import get_plan_data
-from load_dicom_e_plan import get_block_coord
-from Cutout_Analysis import show_cutout_info, add_block_info, save_data
 
 
 #%% File Selection
@@ -25,21 +26,78 @@ def set_file_paths(default_file_paths, parameters):
 
 
 #%% Field Selection
-def load_dicom_plans(selected_file_paths):
+def load_dicom_plans(selected_file_paths, window=None, refresh_interval=0.5):
+    from plan_index import PlanIndex, PlanFolderWatcher
     dicom_folder = selected_file_paths['dicom_folder']
-    plan_df = get_plan_data(dicom_folder)
-    block_coords = get_block_coord(plan_df)
-    field_options = build_field_options(plan_df, block_coords)
-    return block_coords, plan_df, field_options
-
-
-def build_field_options(plan_df, block_coords):
-    field_options = block_coords.columns.to_frame(index=True)
-    field_options = field_options.droplevel('Axis')
-    field_options.drop(columns='Axis', inplace=True)
-    field_options.drop_duplicates(inplace=True)
-    patient_info = plan_df.T[['PatientId','PatientName', 'PatientBirthDate']]
-    field_options = pd.concat([field_options, patient_info], axis='columns')
+    plan_fields = dict()
+    fields = list()
+    last_refresh = time.monotonic()
+    plan_index = PlanIndex(dicom_folder)
+    for path, path_fields in plan_index.iter_plan_records(parallel=True):
+        plan_fields[path] = path_fields
+        fields.extend(path_fields)
+        if (window is not None and
+                time.monotonic() - last_refresh > refresh_interval):
+            extend_field_selection(window, build_field_options(fields))
+            last_refresh = time.monotonic()
+    plan_watcher = PlanFolderWatcher(plan_index, plan_fields)
+    block_coords, field_table, field_options = build_plan_tables(fields)
+    return block_coords, field_table, field_options, plan_watcher
+
+
+def build_plan_tables(fields):
+    from load_dicom_e_plan import get_block_coord, FieldTable
+    field_table = FieldTable.from_records(fields)
+    block_coords = get_block_coord(field_table)
+    field_options = build_field_options(fields)
+    return block_coords, field_table, field_options
+
+
+def apply_plan_changes(block_coords, field_table, field_options, changes):
+    # Remove the previous records of the changed plan files and add the new
+    # ones, without rebuilding the tables for the unchanged plans.
+    import pandas as pd
+    from load_dicom_e_plan import get_block_coord, FieldTable, FIELD_INDEX
+    removed_fields = [tuple(field.get(column) for column in FIELD_INDEX)
+                      for field in changes.removed_fields]
+    added_table = FieldTable.from_records(changes.added_fields)
+    field_table = field_table.update(removed_fields, changes.added_fields)
+    block_coords = block_coords.update(removed_fields,
+                                       get_block_coord(added_table))
+    added_options = build_field_options(changes.added_fields)
+    dropped = (field_options.index.isin(removed_fields) |
+               field_options.index.isin(added_options.index))
+    field_options = pd.concat([field_options[~dropped], added_options])
+    return block_coords, field_table, field_options
+
+
+def start_plan_poll(window, plan_watcher):
+    # Scan the DICOM folder in a thread, so that a slow folder does not
+    # freeze the window.  The changes are returned as the 'PlanChanges'
+    # event, with None if nothing changed.
+    def poll_plans():
+        changes = None
+        try:
+            changes = plan_watcher.poll()
+        finally:
+            window.write_event_value('PlanChanges', changes)
+    poll_thread = threading.Thread(target=poll_plans, daemon=True)
+    poll_thread.start()
+    return poll_thread
+
+
+def build_field_options(fields):
+    import pandas as pd
+    index_columns = ['PatientReference', 'PlanId', 'FieldId']
+    option_columns = index_columns + ['PatientId', 'PatientName',
+                                      'PatientBirthDate']
+    field_options = pd.DataFrame(
+        [{column: field.get(column) for column in option_columns}
+         for field in fields if field.get('Coordinates') is not None],
+        columns=option_columns)
+    field_options.index = pd.MultiIndex.from_frame(
+        field_options[index_columns])
+    field_options = field_options[~field_options.index.duplicated()]
     return field_options
 
 
@@ -66,8 +124,11 @@ def make_window(**file_paths):
                 key = 'Cancel'
                 )
             }
-        actions_list = [[sg.Button(**btn)
-                        for btn in action_buttons.values()]]
+        actions_list = [
+            [sg.Checkbox('Draw the plan over the scan as a single picture',
+                         key='overlay', default=False)],
+            [sg.Button(**btn) for btn in action_buttons.values()]
+            ]
         return actions_list
 
     def set_field_selection():
@@ -84,11 +145,12 @@ def make_window(**file_paths):
                       enable_events=True, disabled=True)]
             ]
         v_bar = sg.HorizontalSeparator(key='V_Bar')
-        field_selection_frame = [[
-            sg.Column(patient_text, key='Patient Info'),
+        field_selection_frame = [
+            [sg.Column(patient_text, key='Patient Info'),
              v_bar,
-             sg.Column(selector_set, key='Selectors')
-             ]]
+             sg.Column(selector_set, key='Selectors')],
+            [sg.Text(key='ScanStatus', size=(50,2))]
+            ]
         return field_selection_frame
 
     def file_selection_frame(**default_file_paths):
@@ -230,6 +292,116 @@ def update_field_selection(window, selection_options, selector=None, selection=N
     return selection_options
 
 
+def extend_field_selection(window, field_options):
+    # Add fields loaded since the last update while keeping the current
+    # patient selection.
+    if field_options.empty:
+        return
+    current_patient = window['PatientSelector'].get()
+    if not current_patient:
+        update_field_selection(window, field_options)
+        return
+    patient_list = list(set(field_options['PatientReference']))
+    window['PatientSelector'].update(values=patient_list,
+                                     value=current_patient)
+    update_field_selection(window, field_options,
+                           selector='PatientSelector',
+                           selection=current_patient)
+
+
+def refresh_field_selection(window, field_options):
+    # Rebuild the patient, plan and field lists after the plans in the DICOM
+    # folder change, keeping the current selections where they still exist.
+    patient = window['PatientSelector'].get()
+    plan = window['PlanSelector'].get()
+    field = window['FieldSelector'].get()
+    if field_options.empty:
+        for selector in ['PatientSelector', 'PlanSelector', 'FieldSelector']:
+            window[selector].update(values=[], value='', disabled=True)
+        window['PatientText'].update(value='')
+        return field_options
+    patient_list = list(set(field_options['PatientReference']))
+    if patient not in patient_list:
+        selection_options = update_field_selection(window, field_options)
+        if patient:
+            sg.popup_ok(f'The plans for {patient} are no longer in the '
+                        'DICOM folder.', title='Plans Removed')
+        return selection_options
+    window['PatientSelector'].update(values=patient_list, value=patient)
+    selection_options = update_field_selection(
+        window, field_options, selector='PatientSelector', selection=patient)
+    plan_options = selection_options[selection_options['PlanId'] == plan]
+    if plan_options.empty:
+        sg.popup_ok(f'Plan {plan} is no longer in the DICOM folder.',
+                    title='Plan Removed')
+        return selection_options
+    field_list = list(set(plan_options['FieldId']))
+    if field not in field_list:
+        field = plan_options['FieldId'].iloc[0]
+    window['PlanSelector'].update(value=plan)
+    window['FieldSelector'].update(values=field_list, value=field)
+    window.refresh()
+    return selection_options
+
+
+def start_scan_field_search(window, field_table, image_file):
+    # Read the insert code from the scanned cutout in a thread, so that the
+    # field selectors can be used while the scan is analyzed.  The result is
+    # returned as the 'ScanFields' event.
+    from Cutout_Analysis import find_scan_fields
+    def search_fields():
+        try:
+            search_result = find_scan_fields(image_file, field_table)
+        except (OSError, ValueError) as err:
+            search_result = err
+        window.write_event_value('ScanFields', search_result)
+    window['ScanStatus'].update(
+        value=f'Reading the insert code from {Path(image_file).name} ...')
+    search_thread = threading.Thread(target=search_fields, daemon=True)
+    search_thread.start()
+    return search_thread
+
+
+def select_scanned_field(window, field_options, selection_options,
+                         search_result, field_chosen=False):
+    # Preselect the field whose insert code matches the encoder strip on the
+    # scanned cutout, if only one field matches and the user has not already
+    # chosen one.  Otherwise leave the selection and say why.
+    if isinstance(search_result, Exception):
+        window['ScanStatus'].update(
+            value=f'The insert code could not be read: {search_result}.\n'
+                  'Select the field.')
+        return selection_options
+    insert_code, matching_fields = search_result
+    matching_fields = [field for field in matching_fields
+                       if field in field_options.index]
+    if not matching_fields:
+        window['ScanStatus'].update(
+            value=f'No field uses insert code {insert_code}. '
+                  'Select the field.')
+        return selection_options
+    if len(matching_fields) > 1:
+        window['ScanStatus'].update(
+            value=f'Insert code {insert_code} is used by '
+                  f'{len(matching_fields)} fields. Select the field.')
+        return selection_options
+    patient, plan, field = matching_fields[0]
+    if field_chosen:
+        window['ScanStatus'].update(
+            value=f'Insert code {insert_code} matches {patient}, {plan}, '
+                  f'{field}.')
+        return selection_options
+    window['PatientSelector'].update(value=patient)
+    selection_options = update_field_selection(
+        window, field_options, selector='PatientSelector', selection=patient)
+    window['PlanSelector'].update(value=plan)
+    window['FieldSelector'].update(value=field)
+    window['ScanStatus'].update(
+        value=f'Insert code {insert_code} selected {patient}, {plan}, '
+              f'{field}.')
+    return selection_options
+
+
 def main_actions(window, default_file_paths):
     """Contour Analysis steps:
 
@@ -253,7 +425,7 @@ def main_actions(window, default_file_paths):
     # Use status element to indicate where in work flow
     #if selected_file_paths:
 
-    block_coords, plan_df, field_options = load_dicom_plans(selected_file_paths)
+    block_coords, field_table, field_options = load_dicom_plans(selected_file_paths)
     selected_field = test_select_field(window, field_options)
 
     Args:
@@ -276,6 +448,7 @@ def main_actions(window, default_file_paths):
         'PatientSelector': dict(disabled=True, values=[], value=''),
         'PlanSelector': dict(disabled=True, values=[], value=''),
         'FieldSelector': dict(disabled=True, values=[], value=''),
+        'ScanStatus': dict(value=''),
         'Back': dict(disabled = True),
         'Next': dict(disabled = False, text = 'Next')
         }
@@ -297,8 +470,8 @@ def main_actions(window, default_file_paths):
 
     ########################
     #%% Load DICOM Plans
-    block_coords, plan_df, field_options = load_dicom_plans(selected_file_paths)
-
+    (block_coords, field_table, field_options,
+     plan_watcher) = load_dicom_plans(selected_file_paths, window)
 
     #%% 2) Select the field for Aperture from list of available fields.
     #    Choose from Patient -> Plan -> Field
@@ -325,11 +498,33 @@ def main_actions(window, default_file_paths):
     parameters = None
     selected_field = None
     selection_options = field_options
+    field_chosen = False
+    poll_thread = None
+    start_scan_field_search(window, field_table,
+                            selected_file_paths['image_file'])
     while not(done):
         event, parameters = window.read(timeout=200)
+        if event == 'ScanFields':
+            selection_options = select_scanned_field(
+                window, field_options, selection_options, parameters[event],
+                field_chosen)
+            continue
         if event == sg.TIMEOUT_KEY:
+            # Look for plans exported to the DICOM folder since loading.
+            if poll_thread is None and plan_watcher.poll_due():
+                poll_thread = start_plan_poll(window, plan_watcher)
+            continue
+        if event == 'PlanChanges':
+            poll_thread = None
+            changes = parameters[event]
+            if changes is not None:
+                block_coords, field_table, field_options = apply_plan_changes(
+                    block_coords, field_table, field_options, changes)
+                selection_options = refresh_field_selection(window,
+                                                            field_options)
             continue
         if event in ['PatientSelector', 'PlanSelector', 'FieldSelector']:
+            field_chosen = True
             if event in 'PatientSelector':
                 selection_options = field_options  # Reset selections
             selection_options = update_field_selection(
@@ -341,7 +536,15 @@ def main_actions(window, default_file_paths):
             selected_field = (parameters['PatientSelector'],
                               parameters['PlanSelector'],
                               parameters['FieldSelector'])
+            if selected_field not in field_options.index:
+                sg.popup_error('The selected field is no longer in the '
+                               'DICOM folder. Select another field.')
+                selected_field = None
+                continue
             done = True
+    if poll_thread is not None:
+        poll_thread.join()
+    plan_watcher.plan_index.close()
     if not selected_field:
         return None
 
@@ -350,11 +553,40 @@ def main_actions(window, default_file_paths):
     save_data_file= selected_file_paths['save_data_file']
     template_path= selected_file_paths['template_path']
 
+    #%% Check Cutout Image
+    # Flag poor scans before the report is built.
+    from Cutout_Analysis import analyze_scan
+    from cutout_image import estimate_skew, SKEW_CONFIDENCE_LIMIT
+    image_file = selected_file_paths['image_file']
+    scan_outline = analyze_scan(image_file)
+    angle, confidence = estimate_skew(scan_outline.insert_outline)
+    if confidence < SKEW_CONFIDENCE_LIMIT:
+        answer = sg.popup_yes_no(
+            f'The insert outline in {image_file.name} is not rectangular '
+            f'(confidence {confidence:.2f}, rotation {angle:.1f} degrees).\n'
+            'The scan may be poor. Continue with the report?',
+            title='Poor Cutout Scan')
+        if answer != 'Yes':
+            return None
+    from Cutout_Analysis import check_applicator
+    insert_size = field_table.value(selected_field, 'ApplicatorOpening')
+    applicator_check = check_applicator(image_file, insert_size)
+    if applicator_check.matches is None:
+        window['ScanStatus'].update(value=applicator_check.message)
+        window.refresh()
+    elif not applicator_check.matches:
+        answer = sg.popup_yes_no(
+            f'{applicator_check.message}\nContinue with the report?',
+            title='Applicator Mismatch')
+        if answer != 'Yes':
+            return None
+
     #%% Save Cutout Info
-    insert_size = plan_df.at['ApplicatorOpening', selected_field]
-    selected_field_df = plan_df.loc[:, selected_field[0]]
+    from Cutout_Analysis import show_cutout_info, show_cutout_overlay
+    from Cutout_Analysis import add_block_info, save_data
+    selected_field_df = field_table.plan_view(selected_field[0])
     workbook = save_data(selected_field_df, save_data_file, template_path)
-    add_block_info(plan_df, block_coords, selected_field, workbook)
+    add_block_info(field_table, block_coords, selected_field, workbook)
 
 
     #%% 3) Select Cutout Image
@@ -362,7 +594,11 @@ def main_actions(window, default_file_paths):
     image_file = selected_file_paths['image_file']
 
     #%% 5) Generate Analysis Report
-    show_cutout_info(image_file, insert_size, workbook)
+    if parameters.get('overlay'):
+        show_cutout_overlay(image_file, insert_size, workbook, block_coords,
+                            selected_field)
+    else:
+        show_cutout_info(image_file, insert_size, workbook)
     return None
 
 
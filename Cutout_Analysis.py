@@ -5,42 +5,41 @@ Created on Wed Feb 10 21:24:34 2021
 @author: Greg
 """
 #%%  Imports
-import math
 from pathlib import Path
-from statistics import mean
-from typing import Tuple, List
-import imageio
+from typing import Tuple, List, NamedTuple, Optional
 import numpy as np
 import pandas as pd
 import xlwings as xw
-from scipy import ndimage
-from skimage import measure
-from shapely.geometry import Polygon
-from load_dicom_e_plan import get_plan_data
-from load_dicom_e_plan import get_block_coord
+# cutout_image (which uses scipy, skimage and Pillow) and shapely are
+# imported by the image functions that use them, to keep start-up fast.
+from load_dicom_e_plan import get_field_table, FieldTable
+from load_dicom_e_plan import get_block_coord, BlockCoordinates
+from load_dicom_e_plan import FIELD_INDEX
 
 
 #%%  Scale Factors; Used as global variables.
 in_scale = 72.0  # inches to Pixels conversion
 cm_scale = in_scale / 2.54  # cm to Pixels conversion
+# The encoder strip reads the same at half resolution, in a third of the time.
+ENCODER_REDUCTION = 2
+# The applicator frame templates are matched at about 20 dpi, so the scan is
+# decoded at reduced resolution.
+FRAME_REDUCTION = 8
 
 
 #%% This section contains functions that enter data into the spreadsheet.
-def select_field(block_coords: pd.DataFrame) -> Tuple[str]:
+def select_field(block_coords: BlockCoordinates) -> Tuple[str]:
     """Select field for Aperture from list of available fields.
 
     Currently selects first field.  The aperture coordinates in the Selected
         field are used for the cutout dimensions.
     Args:
-        block_coords (pd.DataFrame): Table with all fields containing
-            apertures Column levels expected are: ['PlanId', 'FieldId', 'Axis'].
+        block_coords (BlockCoordinates): The apertures for all fields.
     Returns:
-        selected_field (Tuple[str]): The PlanId and FieldId of the selected
-            field as a tuple.
+        selected_field (Tuple[str]): The PatientReference, PlanId and FieldId
+            of the selected field as a tuple.
     """
-    field_groups = block_coords.groupby(level=['PlanId', 'FieldId'],
-                                        axis='columns')
-    selected_field = list(field_groups.groups)[0]
+    selected_field = block_coords.fields[0]
     return selected_field
 
 
@@ -105,12 +104,13 @@ def save_data(plan_df: pd.DataFrame,
     return workbook
 
 
-def add_block_info(plan_df, block_coords: pd.DataFrame,
+def add_block_info(field_table: FieldTable, block_coords: BlockCoordinates,
                    selected_field: Tuple[str], workbook: xw.Book):
     """Store aperture and SSD data in the spreadsheet.
 
     Args:
-        block_coords (pd.DataFrame): Table with apertures for all fields.
+        field_table (FieldTable): Plan Parameters obtained from DICOM File.
+        block_coords (BlockCoordinates): The apertures for all fields.
         selected_field (Tuple[str]): The PlanId and FieldId index of the
             selected field.
         workbook (xw.Book): Excel workbook containing the data.
@@ -118,48 +118,47 @@ def add_block_info(plan_df, block_coords: pd.DataFrame,
         None.
     """
 
-    def add_block_coordinates(block_coords: pd.DataFrame,
+    def add_block_coordinates(block_coords: BlockCoordinates,
                               selected_field: Tuple[str], workbook: xw.Book):
         """Store aperture coordinates.
 
         Add aperture coordinates for the selected field to the CutOut
             Coordinates table for plotting.
         Args:
-            block_coords (pd.DataFrame): Table with apertures for all fields.
+            block_coords (BlockCoordinates): The apertures for all fields.
             selected_field (Tuple[str]): The PlanId and FieldId index of the
                 selected field.
             workbook (xw.Book): Excel workbook containing the data.
         Returns:
             coords (pd.DataFrame): The x,y coordinates for the aperture.
         """
-        coords = block_coords.loc[:, selected_field]
-        coords.dropna(inplace=True)
+        coords = block_coords.get_frame(selected_field)
         coords_sheet = workbook.sheets['CutOut Coordinates']
         coords_sheet.range('A3').options(pd.DataFrame, header=False,
                                          index=False).value = coords
         return coords
 
-    def insert_ssd(plan_df: pd.DataFrame, selected_field: Tuple[str],
+    def insert_ssd(field_table: FieldTable, selected_field: Tuple[str],
                    workbook: xw.Book):
         """Store SSD from selected_field in the spreadsheet.
 
         Args:
-            plan_df (pd.DataFrame): Plan Parameters obtained from DICOM File.
+            field_table (FieldTable): Plan Parameters obtained from DICOM File.
             selected_field (Tuple[str]): The PlanId and FieldId index of the
                 selected field.
             workbook (xw.Book): Excel workbook containing the data.
         Returns:
             None.
         """
-        ssd = plan_df.at['Actual SSD', selected_field]
+        ssd = field_table.value(selected_field, 'Actual SSD')
         ssd_range = workbook.names['SSD'].refers_to_range
         ssd_range.value = ssd
 
-    def insert_applicator_size(plan_df, selected_field, workbook):
+    def insert_applicator_size(field_table, selected_field, workbook):
         """Store applicator size from selected_field in the spreadsheet.
 
         Args:
-            plan_df (pd.DataFrame): Plan Parameters obtained from DICOM File.
+            field_table (FieldTable): Plan Parameters obtained from DICOM File.
             selected_field (Tuple[str]): The PlanId and FieldId index of the
                 selected field.
             workbook (xw.Book): Excel workbook containing the data.
@@ -167,25 +166,28 @@ def add_block_info(plan_df, block_coords: pd.DataFrame,
             None.
         """
         insert_size_range = workbook.names['Insert_Size'].refers_to_range
-        insert_size = plan_df.at['ApplicatorOpening', selected_field]
+        insert_size = field_table.value(selected_field, 'ApplicatorOpening')
         insert_size_range.value = insert_size
 
-    def add_cutout_dimensions(coords: pd.DataFrame, workbook: xw.Book):
-        """Calculate and store applicator shape parameters in the spreadsheet.
+    def add_cutout_dimensions(block_coords: BlockCoordinates,
+                              selected_field: Tuple[str], workbook: xw.Book):
+        """Store applicator shape parameters in the spreadsheet.
 
-        Calculates Equivalent Square for aperture and x, y extent of
-            aperture.
+        Uses the Equivalent Square and x, y extent of the aperture calculated
+            for all blocks in the field.
         Args:
-            coords (pd.DataFrame): The x,y coordinates for the aperture.
+            block_coords (BlockCoordinates): The apertures for all fields.
+            selected_field (Tuple[str]): The PlanId and FieldId index of the
+                selected field.
             workbook (xw.Book): Excel workbook containing the data.
         Returns:
             None.
         """
-        apperature = Polygon(np.array(coords))
-        cutout_area = apperature.area
-        cutout_perim = apperature.length
-        cutout_eq_sq = 4 * cutout_area / cutout_perim
-        cutout_extent = max([abs(x) for x in apperature.bounds])
+        apperature = block_coords.field_geometry.loc[selected_field]
+        cutout_area = apperature['Area']
+        cutout_perim = apperature['Perimeter']
+        cutout_eq_sq = apperature['EquivalentSquare']
+        cutout_extent = apperature['Extent']
 
         cutout_area_range = workbook.names['Cutout_Area'].refers_to_range
         cutout_area_range.value = cutout_area
@@ -196,10 +198,10 @@ def add_block_info(plan_df, block_coords: pd.DataFrame,
         cutout_extent_range = workbook.names['Cutout_Extent'].refers_to_range
         cutout_extent_range.value = cutout_extent
 
-    coords = add_block_coordinates(block_coords, selected_field, workbook)
-    insert_ssd(plan_df, selected_field, workbook)
-    insert_applicator_size(plan_df, selected_field, workbook)
-    add_cutout_dimensions(coords, workbook)
+    add_block_coordinates(block_coords, selected_field, workbook)
+    insert_ssd(field_table, selected_field, workbook)
+    insert_applicator_size(field_table, selected_field, workbook)
+    add_cutout_dimensions(block_coords, selected_field, workbook)
 
 
 def scale_cutout_graph(insert_size: int, image_sheet: xw.Sheet) -> xw.Chart:
@@ -237,13 +239,14 @@ def get_image_size(cutout_image):
         dpi (int): The resolution of the image in dots per inch.
     """
     dpi = np.array(cutout_image.meta['dpi'])
-    image_size = cutout_image.shape / dpi
+    image_size = cutout_image.shape[:2] / dpi
     height = image_size[0] * in_scale
     width = image_size[1] * in_scale
     return height, width, dpi
 
 
-def find_outline(cutout_image, dpi):
+def find_outline(cutout_image, dpi, pyramid=False, denoise=None,
+                 workers=None, strips=False, template=False):
     """Identify the external outline of the insert.
 
     The external outline is the metal frame around the insert.
@@ -251,6 +254,23 @@ def find_outline(cutout_image, dpi):
         cutout_image (imageio image): The image and meta-data for the scanned
             cutout image.
         dpi (int): The resolution of the image in dots per inch.
+        pyramid (bool, optional): If True, locate the outline on a
+            downsampled image and only apply the full resolution median
+            filter in a narrow band around it.  The insert limits agree with
+            the full resolution search to within
+            cutout_image.PYRAMID_TOLERANCE (0.5 mm). Default is False.
+        denoise (str, optional): The median filter backend, one of 'scipy'
+            (the reference), 'histogram' or 'separable'. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+        strips (bool, optional): If True, process the image in strips of
+            rows so that only a few strips are held in memory at once.  The
+            result is identical to the full resolution search.  Default is
+            False.
+        template (bool, optional): If True, locate the insert frame by FFT
+            matching of the applicator frame templates and only search the
+            region around it for the outline.  Default is False.
     Returns:
         insert_outline (np.array): x,y coordinates approximating the outside
             extent of the Cerrobend.
@@ -260,21 +280,377 @@ def find_outline(cutout_image, dpi):
                     [x_min (image top), y_min (image left),
                      x_max (image bottom), y_max (image right)]
     """
-    # apply a median filter to reduce the noise, but keep the edge locations.
-    med_denoise = ndimage.median_filter(cutout_image, 10)
-    # Generate contours at a threshold just above black (20)
-    # The largest contour will be the page size
-    # The second largest will be the insert outline including encoding strip
-    contours = measure.find_contours(med_denoise, 20)
-    contours = sorted(contours, key=len, reverse=True)  # Sort by size
-    insert_outline = contours[1] / dpi  # Select the second largest contour.
-    insert_shape = Polygon(insert_outline)
-    # Removed encoder tab at the top to get just insert
-    encoder = [9 / 25.4, 0, 0, 0]  # Encoder strip is 9 mm height
-    insert_limits = np.array(insert_shape.bounds) + encoder
+    import cutout_image as image_tools
+    if denoise is None:
+        denoise = image_tools.DEFAULT_DENOISE
+    insert_contour, _ = image_tools.find_insert_contour(
+        cutout_image, dpi, pyramid, denoise, workers, strips, template)
+    return contour_limits(insert_contour, dpi)
+
+
+def contour_limits(insert_contour, dpi):
+    """Convert the insert contour to inches and find the insert limits.
+
+    The limits are found after squaring the outline by its minimum area
+        rectangle, the same rotation that is applied to the scan in the
+        report, so a skewed insert is not reported as larger than it is.
+    Args:
+        insert_contour (np.array): The row, column coordinates of the insert
+            outline in pixels.
+        dpi (int): The resolution of the image in dots per inch.
+    Raises:
+        ValueError: If the limits are not those of an insert frame.
+    Returns:
+        insert_outline (np.array): x,y coordinates approximating the outside
+            extent of the Cerrobend.
+        insert_limits (np.array of size 4): the maximum and minimum extent of
+            the squared Cerrobend in the x and Y directions.
+    """
+    from shapely.geometry import Polygon
+    import cutout_image as image_tools
+    insert_outline = insert_contour / dpi
+    angle, _ = image_tools.estimate_skew(insert_outline)
+    square_outline = image_tools.deskew_outline(insert_outline, angle)
+    insert_shape = Polygon(square_outline)
+    insert_limits = np.array(insert_shape.bounds)
+    # Removed encoder tab at the top to get just insert.  The strip is not
+    # part of the outline if it is separated from the frame in the scan.
+    insert_limits[0] += image_tools.top_edge_offset(square_outline)
+    if image_tools.has_encoder_strip(square_outline):
+        insert_limits[0] += image_tools.ENCODER_HEIGHT
+    insert_size = insert_limits[2:] - insert_limits[:2]
+    if any(insert_size < image_tools.MIN_INSERT_SIZE):
+        raise ValueError(
+            f'The insert found is {insert_size[0]:.2f} x '
+            f'{insert_size[1]:.2f} inches, too small for an insert frame')
     return insert_outline, insert_limits
 
 
+def analyze_scan(image_file: Path, pyramid: bool = True, denoise: str = None,
+                 workers: int = None, cache=None, strips: bool = False):
+    """Find the size and insert outline of a scanned cutout image.
+
+    The results are looked up in the scan cache first, so a scan that has
+        already been analyzed with the same settings is not decoded or
+        filtered again.
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        pyramid (bool, optional): Use the coarse-to-fine outline search.
+            Default is True.
+        denoise (str, optional): The median filter backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+        cache (ScanCache, optional): The cache of scan results. Default is a
+            ScanCache in scan_cache.DEFAULT_CACHE_FOLDER.
+        strips (bool, optional): Process the scan in strips of rows, memory
+            mapping uncompressed TIFF scans.  Use for very large scans.
+            Default is False.
+    Returns:
+        scan_outline (ScanOutline): The image size, resolution, insert
+            outline, insert limits and, for a full resolution search, the
+            denoised image.
+    """
+    import cutout_image as image_tools
+    from scan_cache import ScanCache, ScanOutline
+    if denoise is None:
+        denoise = image_tools.DEFAULT_DENOISE
+    if cache is None:
+        cache = ScanCache()
+    # Strip processing always gives the full resolution results.
+    key = cache.cache_key(image_file, pyramid=pyramid and not strips,
+                          denoise=denoise,
+                          median_size=image_tools.MEDIAN_SIZE,
+                          contour_level=image_tools.CONTOUR_LEVEL)
+    scan_outline = cache.get(key)
+    if scan_outline is not None:
+        return scan_outline
+    if strips:
+        cutout_image = image_tools.open_scan(image_file)
+    else:
+        cutout_image = image_tools.read_scan(image_file)
+    height, width, dpi = get_image_size(cutout_image)
+    insert_contour, denoised = image_tools.find_insert_contour(
+        cutout_image, dpi, pyramid, denoise, workers, strips)
+    insert_outline, insert_limits = contour_limits(insert_contour, dpi)
+    scan_outline = ScanOutline(height, width, dpi, insert_outline,
+                               insert_limits, denoised)
+    cache.put(key, scan_outline)
+    return scan_outline
+
+
+def analyze_batch_scan(image_file: Path, pyramid: bool = True,
+                       denoise: str = None, workers: int = None) -> List:
+    """Find the outline of every insert on a scan holding several inserts.
+
+    Each insert is located and analyzed independently, in parallel, so that
+        it can be matched to its own field.
+    Args:
+        image_file (Path): Full path to the scanned image file.
+        pyramid (bool, optional): Use the coarse-to-fine outline search.
+            Default is True.
+        denoise (str, optional): The median filter backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of inserts analyzed at once.
+            Default is the number of CPU cores.
+    Returns:
+        scan_outlines (List[ScanOutline]): The results for each insert,
+            ordered top to bottom and then left to right on the scan.  The
+            image size is that of the whole scan and the outlines and limits
+            are relative to its top left corner.  The denoised image is not
+            kept.
+    """
+    import cutout_image as image_tools
+    from scan_cache import ScanOutline
+    if denoise is None:
+        denoise = image_tools.DEFAULT_DENOISE
+    cutout_image = image_tools.read_scan(image_file)
+    height, width, dpi = get_image_size(cutout_image)
+    insert_contours = image_tools.find_insert_contours(
+        cutout_image, dpi, pyramid, denoise, workers)
+    scan_outlines = list()
+    for insert_contour in insert_contours:
+        insert_outline, insert_limits = contour_limits(insert_contour, dpi)
+        scan_outlines.append(ScanOutline(height, width, dpi, insert_outline,
+                                         insert_limits))
+    return scan_outlines
+
+
+def find_scan_aperture(image_file: Path, scan_outline, denoise: str = None,
+                       workers: int = None) -> np.array:
+    """Trace the edge of the aperture in a scanned insert.
+
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        scan_outline (ScanOutline): The results of analyze_scan for the
+            image.
+        denoise (str, optional): The median filter backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+    Returns:
+        aperture_contour (np.array): The row, column coordinates of the
+            aperture edge in pixels.
+    """
+    import cutout_image as image_tools
+    if denoise is None:
+        denoise = image_tools.DEFAULT_DENOISE
+    cutout_image = image_tools.read_scan(image_file)
+    return image_tools.find_aperture_contour(
+        cutout_image, scan_outline.insert_outline * scan_outline.dpi,
+        scan_outline.denoised, denoise, workers)
+
+
+def compare_aperture(image_file: Path, block_coords: BlockCoordinates,
+                     selected_field: Tuple[str], scan_outline=None,
+                     denoise: str = None, workers: int = None,
+                     register: bool = False, scan_face: str = None):
+    """Compare the aperture cut in the scanned insert with the plan.
+
+    The aperture edge is traced within the insert found by analyze_scan,
+        centred on the insert, as in the report's aperture graph, and
+        projected to the isocentre plane of the plan's block outlines.  If
+        register is True, the planned aperture is first moved onto the
+        scanned edge, so that a shift or rotation of the insert on the
+        scanner is not reported as a cutting error.
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        block_coords (BlockCoordinates): The apertures for all fields.
+        selected_field (Tuple[str]): The PatientReference, PlanId and FieldId
+            index of the selected field.
+        scan_outline (ScanOutline, optional): The results of analyze_scan
+            for the image. Default is to look them up with analyze_scan.
+        denoise (str, optional): The median filter backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+        register (bool, optional): Register the planned aperture onto the
+            scanned aperture before comparing. Default is False.
+        scan_face (str, optional): The face of the insert on the scanner
+            glass, 'source' or 'patient'. Default is aperture_check.SCAN_FACE.
+    Returns:
+        aperture_comparison (ApertureComparison): The area difference,
+            Hausdorff distance and maximum edge deviation in cm, with the
+            registration if one was applied.
+    """
+    import cutout_image as image_tools
+    from aperture_check import compare_apertures, scan_to_plan
+    from aperture_check import register_aperture, SCAN_FACE
+    if scan_face is None:
+        scan_face = SCAN_FACE
+    if scan_outline is None:
+        scan_outline = analyze_scan(image_file, denoise=denoise,
+                                    workers=workers)
+    aperture_contour = find_scan_aperture(image_file, scan_outline, denoise,
+                                          workers)
+    scan_aperture = scan_to_plan(aperture_contour / scan_outline.dpi,
+                                 scan_outline.insert_limits,
+                                 scan_face=scan_face)
+    block_types = block_coords.block_geometry['BlockType'].xs(
+        selected_field, level=FIELD_INDEX)
+    plan_outlines = [outline for outline, block_type
+                     in zip(block_coords.blocks(selected_field), block_types)
+                     if block_type != 'SHIELDING']
+    registration = None
+    if register:
+        # Start from the skew of the insert frame on the scan.
+        insert_outline = scan_to_plan(
+            scan_outline.insert_outline / scan_outline.dpi,
+            scan_outline.insert_limits, scan_face=scan_face)
+        skew, _ = image_tools.estimate_skew(insert_outline)
+        registration = register_aperture(plan_outlines, scan_aperture,
+                                         initial_rotation=skew)
+    return compare_apertures(scan_aperture, plan_outlines,
+                             registration=registration)
+
+
+def map_cutout_discrepancy(image_file: Path, block_coords: BlockCoordinates,
+                           selected_field: Tuple[str], scan_outline=None,
+                           registration=None, denoise: str = None,
+                           workers: int = None, scan_face: str = None):
+    """Map where the insert was cut too large or too small.
+
+    The planned blocks are reduced from the isocentre plane to the insert
+        and placed on the scan centred on the insert, as in the report's
+        aperture graph, or moved by a registration.  Shielding blocks are
+        holes in the aperture.
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        block_coords (BlockCoordinates): The apertures for all fields.
+        selected_field (Tuple[str]): The PatientReference, PlanId and FieldId
+            index of the selected field.
+        scan_outline (ScanOutline, optional): The results of analyze_scan
+            for the image. Default is to look them up with analyze_scan.
+        registration (Registration, optional): The registration of the
+            planned aperture onto the scan from compare_aperture. Default is
+            no registration.
+        denoise (str, optional): The median filter backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+        scan_face (str, optional): The face of the insert on the scanner
+            glass, 'source' or 'patient'. Default is aperture_check.SCAN_FACE.
+    Returns:
+        discrepancy (Discrepancy): The over-cut and under-cut map of the
+            insert's bounding box and their areas on the insert in cm^2.
+    """
+    from aperture_check import map_discrepancy, plan_to_scan
+    from aperture_check import transform_outline, SCAN_FACE
+    if scan_face is None:
+        scan_face = SCAN_FACE
+    if scan_outline is None:
+        scan_outline = analyze_scan(image_file, denoise=denoise,
+                                    workers=workers)
+    dpi = scan_outline.dpi
+    aperture_contour = find_scan_aperture(image_file, scan_outline, denoise,
+                                          workers)
+    plan_contours = list()
+    for outline in block_coords.blocks(selected_field):
+        if registration is not None:
+            outline = transform_outline(outline, registration)
+        plan_outline = plan_to_scan(outline, scan_outline.insert_limits,
+                                    scan_face=scan_face)
+        plan_contours.append(plan_outline * dpi)
+    return map_discrepancy(aperture_contour, plan_contours,
+                           scan_outline.insert_outline * dpi, dpi)
+
+
+def find_scan_fields(image_file: Path, field_table: FieldTable,
+                     scan_outline=None) -> Tuple[int, List[Tuple[str]]]:
+    """Find the fields whose insert matches the scanned encoder strip.
+
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        field_table (FieldTable): Plan Parameters obtained from DICOM File.
+        scan_outline (ScanOutline, optional): The results of analyze_scan
+            for the image. Default is to look them up with analyze_scan.
+    Raises:
+        ValueError: If the encoder strip cannot be read, or no holes in it
+            are open.
+    Returns:
+        insert_code (int): The code read from the encoder strip.
+        matching_fields (List[Tuple[str]]): The PatientReference, PlanId and
+            FieldId index of each field with an InsertCode or AccessoryCode
+            equal to the insert code.
+    """
+    import cutout_image as image_tools
+    if scan_outline is None:
+        scan_outline = analyze_scan(image_file)
+    cutout_image = image_tools.read_scan(image_file, ENCODER_REDUCTION)
+    dpi = np.array(cutout_image.meta['dpi'])
+    angle, _ = image_tools.estimate_skew(scan_outline.insert_outline)
+    _, insert_code = image_tools.decode_encoder(
+        cutout_image, scan_outline.insert_outline * dpi, dpi, angle)
+    # An insert without a code has every hole plugged.
+    if insert_code == 0:
+        raise ValueError('The encoder strip has no open holes')
+    fields = field_table.fields
+    matches = pd.Series(False, index=fields.index)
+    for code_column in ['InsertCode', 'AccessoryCode']:
+        if code_column in fields.columns:
+            codes = fields[code_column].astype(str).str.strip()
+            matches |= codes == str(insert_code)
+    return insert_code, list(fields.index[matches])
+
+
+class ApplicatorCheck(NamedTuple):
+    """The result of checking a scanned insert against the planned applicator.
+
+    Attributes:
+        matches (bool): True if the scanned insert frame best matches the
+            template for the planned applicator size.  None if the size was
+            not checked.
+        frame_match (FrameMatch): The best matching applicator frame.  None
+            if the size was not checked.
+        message (str): A description of the result for the user.
+    """
+    matches: Optional[bool]
+    frame_match: Optional['FrameMatch']
+    message: str
+
+
+def check_applicator(image_file: Path, insert_size: float) -> ApplicatorCheck:
+    """Check that the scanned insert fits the planned applicator.
+
+    Only applicator sizes with measured frame widths are checked, and only
+        those templates are matched, so that an estimated frame width cannot
+        raise a false mismatch.  Other sizes are reported as not checked.
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        insert_size (float): The size of the applicator used.
+            Can be one of {6, 10, 15, 20, 25}, or NaN if the plan does not
+            give one.
+    Returns:
+        applicator_check (ApplicatorCheck): Whether the insert frame matches
+            the planned applicator, with a message describing the result.
+    """
+    import cutout_image as image_tools
+    image_file = Path(image_file)
+    measured_sizes = image_tools.MEASURED_FRAME_SIZES
+    if pd.isna(insert_size):
+        return ApplicatorCheck(
+            None, None, 'The plan does not give an applicator size, so the '
+            'insert frame was not checked.')
+    if int(insert_size) not in measured_sizes:
+        size_list = ' and '.join(str(size) for size in measured_sizes)
+        return ApplicatorCheck(
+            None, None, f'The insert frame was not checked against the '
+            f'{insert_size:g} cm applicator; only the {size_list} cm frames '
+            'have been measured.')
+    cutout_image = image_tools.read_scan(image_file, FRAME_REDUCTION)
+    dpi = np.array(cutout_image.meta['dpi'])
+    frame_match = image_tools.match_applicator_frame(
+        cutout_image, dpi, applicator_sizes=measured_sizes)
+    if frame_match.applicator_size == int(insert_size):
+        return ApplicatorCheck(
+            True, frame_match, f'The insert frame matches the '
+            f'{insert_size:g} cm applicator.')
+    return ApplicatorCheck(
+        False, frame_match, f'The insert in {image_file.name} looks like a '
+        f'{frame_match.applicator_size} cm applicator insert, but the plan '
+        f'uses a {insert_size:g} cm applicator.')
+
+
 def add_cutout_image(image_file: Path, image_sheet: xw.Sheet,
                      height: float, width: float) -> xw.Picture:
     """Insert the scanned cutout image into the spreadsheet.
@@ -363,7 +739,8 @@ def set_arrows(insert_size: int, mid_point: np.array, image_sheet: xw.Sheet):
     # Group the arrows
     image_sheet.shapes.api.Range(['UpArrow', 'HorzArrow']).Group()
 
-def align_graph(insert_size: int, mid_point: np.array, outline_graph: xw.Chart):
+def align_graph(insert_size: int, mid_point: np.array, outline_graph: xw.Chart,
+                plan_offset: np.array = None):
     """Center Graph over top cutout image.
 
     Args:
@@ -372,67 +749,49 @@ def align_graph(insert_size: int, mid_point: np.array, outline_graph: xw.Chart):
         mid_point (np.array of size 2): The center point of the cropped cutout
             image. Has the form [height, width]
         outline_graph (xw.Chart): The cutout shape graph.
+        plan_offset (np.array of size 2, optional): The X,Y shift in cm of
+            the aperture from the center of the insert, such as the
+            translation found by registering the aperture. Default is no
+            shift.
     Returns:
         None.
     """
-    outline_graph.top = mid_point[0] - cm_scale * insert_size / 2
-    outline_graph.left = mid_point[1] - cm_scale * insert_size / 2
+    if plan_offset is None:
+        plan_offset = np.zeros(2)
+    # Plan Y is up the page.
+    outline_graph.top = (mid_point[0] - cm_scale * insert_size / 2 -
+                         cm_scale * plan_offset[1])
+    outline_graph.left = (mid_point[1] - cm_scale * insert_size / 2 +
+                          cm_scale * plan_offset[0])
 
 
-def rotate_image(insert_outline: np.array, insert_limits, cutout_shape):
+def rotate_image(insert_outline: np.array,
+                 cutout_shape) -> Tuple[float, float]:
     """Rotate the cutout image so that the insert is square on the page.
 
+    The angle is taken from the minimum area rectangle enclosing the insert
+        outline, so all four edges of the insert are used.
     Args:
         insert_outline (np.array): x,y coordinates approximating the outside
             extent of the Cerrobend.
-        insert_limits (np.array of size 4): the maximum and minimum extent of
-            the Cerrobend in the x and Y directions. The order of the values is
-            as follows:
-                    [x_min (image top), y_min (image left),
-                     x_max (image bottom), y_max (image right)]
         cutout_shape (xw.Picture): The Picture object in the spreadsheet.
     Returns:
-        None.
+        angle (float): The rotation applied to the image in degrees.
+        confidence (float): The fraction of the enclosing rectangle covered
+            by the insert outline.  Values below
+            cutout_image.SKEW_CONFIDENCE_LIMIT indicate a poor scan.
     """
-    def find_angle(x_selection: List[bool], y_selection: List[bool]) -> float:
-        """Determine the angle from the slope of one of the insert edges.
-
-        Args:
-            x_selection (List[bool]): A boolean index to the desired x range of
-                the insert contour.
-            y_selectionw (List[bool]): A boolean index to the desired y range of
-                the insert contour.
-        Returns:
-            angle (float): The angle of the slope in degrees.
-        """
-        # Extract the edge from the insert contour.
-        fit_selection = x_selection * y_selection
-        selected_outline = insert_outline[fit_selection, :]
-        # apply a linear fit to the line of the edge.
-        fit_x = selected_outline[:, 0]
-        fit_y = selected_outline[:, 1]
-        p_fit = np.polyfit(fit_x, fit_y, deg=1)
-        # Calculate the angle of the slope from the fit.
-        angle = math.degrees(math.atan(p_fit[0]))
-        return angle
-
-    # Set a margin around the insert contour to avoid corner effects
-    margin = np.array([-1, -1, 1, 1]) * 0.5  # 1/2" margin
-    lim_x_low, lim_y_low, lim_x_hi, lim_y_hi = (insert_limits - margin)
-    # Identify the different edges
-    outline_x = insert_outline[:, 0]
-    x_selection = (outline_x > lim_x_low) * (outline_x < lim_x_hi)
-    outline_y = insert_outline[:, 1]
-    y_low = (outline_y < lim_y_low)
-    y_hi = (outline_y > lim_y_hi)
-    #Get the average angle
-    angle = mean([find_angle(x_selection, y_low),
-                  find_angle(x_selection, y_hi)])
+    from cutout_image import estimate_skew
+    angle, confidence = estimate_skew(insert_outline)
     #Rotate the image
     cutout_shape.api.ShapeRange.Rotation = angle
+    return angle, confidence
 
 
-def show_cutout_info(image_file: Path, insert_size: int, workbook: xw.Book):
+def show_cutout_info(image_file: Path, insert_size: int, workbook: xw.Book,
+                     pyramid: bool = True, denoise: str = None,
+                     workers: int = None, cache=None, strips: bool = False,
+                     registration=None):
     """Compare the insert image with the cutout shape.
 
     Args:
@@ -440,40 +799,136 @@ def show_cutout_info(image_file: Path, insert_size: int, workbook: xw.Book):
         insert_size (int): The size of the applicator used.
             Can be one of {6, 10, 15, 20, 25}
         workbook (xw.Book): Excel workbook containing the data.
+        pyramid (bool, optional): Use the coarse-to-fine outline search.
+            Default is True.
+        denoise (str, optional): The median filter backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+        cache (ScanCache, optional): The cache of scan results. Default is a
+            ScanCache in scan_cache.DEFAULT_CACHE_FOLDER.
+        strips (bool, optional): Process the scan in strips of rows to limit
+            the memory used. Default is False.
+        registration (Registration, optional): The registration of the
+            planned aperture onto the scan from compare_aperture.  The
+            aperture graph is shifted by its translation if it converged
+            without rotating. Default is to center the graph on the insert.
     Returns:
         None.
     """
+    from aperture_check import shift_only_offset
     image_sheet = workbook.sheets['CutOut Image']
     image_sheet.activate()
     # Set the location for the cutout image.
     pic_location = [0, 0]  # Top, Left in pixels
     outline_graph = scale_cutout_graph(insert_size, image_sheet)
-    cutout_image = imageio.imread(image_file)
-    height, width, dpi = get_image_size(cutout_image)
-    insert_outline, insert_limits = find_outline(cutout_image, dpi)
+    scan_outline = analyze_scan(image_file, pyramid, denoise, workers, cache,
+                                strips)
+    height, width = scan_outline.height, scan_outline.width
+    insert_outline = scan_outline.insert_outline
+    insert_limits = scan_outline.insert_limits
     cutout_shape = add_cutout_image(image_file, image_sheet, height, width)
     crop_cutout_image(insert_limits, cutout_shape, height, width, pic_location)
-    rotate_image(insert_outline, insert_limits, cutout_shape)
+    rotate_image(insert_outline, cutout_shape)
     mid_point = np.array([cutout_shape.height,
                           cutout_shape.width]) / 2 + pic_location
     set_arrows(insert_size, mid_point, image_sheet)
-    align_graph(insert_size, mid_point, outline_graph)
+    plan_offset = shift_only_offset(registration)
+    align_graph(insert_size, mid_point, outline_graph, plan_offset)
     # TODO center the graph over the cutout image
     # TODO Move the arrows to the top of the shape layers
 
+def show_cutout_overlay(image_file: Path, insert_size: int, workbook: xw.Book,
+                        block_coords: BlockCoordinates,
+                        selected_field: Tuple[str], registration=None,
+                        overlay_file: Path = None, pyramid: bool = True,
+                        denoise: str = None, workers: int = None, cache=None,
+                        scan_face: str = None):
+    """Place a rendered overlay of the cutout and plan in the spreadsheet.
+
+    An alternative to show_cutout_info that renders the cropped, deskewed
+        scan with the planned aperture and cross-hair in one image, so that
+        only a single picture is added to the workbook.
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        insert_size (int): The size of the applicator used.
+            Can be one of {6, 10, 15, 20, 25}
+        workbook (xw.Book): Excel workbook containing the data.
+        block_coords (BlockCoordinates): The apertures for all fields.
+        selected_field (Tuple[str]): The PatientReference, PlanId and FieldId
+            index of the selected field.
+        registration (Registration, optional): The registration of the
+            planned aperture onto the scan from compare_aperture.  The
+            aperture is rotated and shifted by it if it converged. Default
+            is to center the aperture on the insert.
+        overlay_file (Path, optional): Full path for the overlay PNG file.
+            Default is '<image name> overlay.png' in the temporary folder.
+        pyramid (bool, optional): Use the coarse-to-fine outline search.
+            Default is True.
+        denoise (str, optional): The median filter backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+        cache (ScanCache, optional): The cache of scan results. Default is a
+            ScanCache in scan_cache.DEFAULT_CACHE_FOLDER.
+        scan_face (str, optional): The face of the insert on the scanner
+            glass, 'source' or 'patient'. Must match the face used for the
+            registration. Default is aperture_check.SCAN_FACE.
+    Returns:
+        overlay_file (Path): Full path to the overlay PNG file.
+    """
+    import tempfile
+    import cutout_image as image_tools
+    from aperture_check import rotation_matrix, transform_outline
+    from aperture_check import SCAN_FACE
+    from cutout_overlay import RENDER_DPI, render_overlay, save_overlay
+    image_file = Path(image_file)
+    if scan_face is None:
+        scan_face = SCAN_FACE
+    if overlay_file is None:
+        overlay_file = (Path(tempfile.gettempdir()) /
+                        f'{image_file.stem} overlay.png')
+    scan_outline = analyze_scan(image_file, pyramid, denoise, workers, cache)
+    angle, _ = image_tools.estimate_skew(scan_outline.insert_outline)
+    plan_outlines = block_coords.blocks(selected_field)
+    if registration is not None and registration.converged:
+        # The overlay is squared, so remove the skew of the insert.
+        squaring = rotation_matrix(-registration.initial_rotation)
+        plan_outlines = [transform_outline(outline, registration) @ squaring.T
+                         for outline in plan_outlines]
+    cutout_image = image_tools.read_scan(image_file)
+    overlay = render_overlay(cutout_image, scan_outline.dpi,
+                             scan_outline.insert_limits, angle,
+                             plan_outlines, insert_size,
+                             scan_face=scan_face)
+    save_overlay(overlay, overlay_file)
+    image_sheet = workbook.sheets['CutOut Image']
+    image_sheet.activate()
+    overlay_shape = image_sheet.pictures.add(overlay_file, name='Overlay',
+                                             top=0, left=0)
+    # Set the picture to 100% scale
+    overlay_shape.width = overlay.width * in_scale / RENDER_DPI
+    overlay_shape.height = overlay.height * in_scale / RENDER_DPI
+    return overlay_file
+
+
 def analyze_cutout(dicom_folder=Path.cwd(),
                    template_path='CutOut Size Check.xlsx',
                    save_data_file='CutOut Size Check Test.xlsx',
-                   image_file='Cutout scan.jpg'):
+                   image_file='Cutout scan.jpg', overlay=False):
     #plan_files = [file for file in dicom_folder.glob('**/RP*.dcm')]
 
-    plan_df = get_plan_data(dicom_folder)
-    block_coords = get_block_coord(plan_df)
+    field_table = get_field_table(dicom_folder)
+    block_coords = get_block_coord(field_table)
     selected_field = select_field(block_coords)
-    insert_size = plan_df.at['ApplicatorOpening', selected_field]
-    workbook = save_data(plan_df, save_data_file, template_path)
-    add_block_info(plan_df, block_coords, selected_field, workbook)
-    show_cutout_info(image_file, insert_size, workbook)
+    insert_size = field_table.value(selected_field, 'ApplicatorOpening')
+    workbook = save_data(field_table.plan_df, save_data_file, template_path)
+    add_block_info(field_table, block_coords, selected_field, workbook)
+    if overlay:
+        show_cutout_overlay(image_file, insert_size, workbook, block_coords,
+                            selected_field)
+    else:
+        show_cutout_info(image_file, insert_size, workbook)
 
 #%% Main
 def main():
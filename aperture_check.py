@@ -0,0 +1,529 @@
+"""Compare the aperture cut in an insert with the planned aperture.
+
+The aperture edge traced from the scan is converted to the plan's beam's eye
+view coordinates in cm, centred on the insert, and compared with the DICOM
+block outlines.  The block outlines are defined in the isocentre plane, so
+scan distances are divided by INSERT_MAGNIFICATION, and scans taken with the
+patient side of the insert on the scanner are mirrored (see SCAN_FACE).  Distances between the outlines are found with KD-tree
+nearest neighbour searches, so dense contours are compared quickly.  The
+outlines can also be rasterized at the scan resolution to map where the
+insert was cut too large or too small.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+from scipy.spatial import cKDTree
+from cutout_image import polygon_area
+
+
+#%% Comparison Settings
+# The size of the cut aperture relative to the DICOM block outline, which is
+# projected to the isocentre plane.  Measured from the scan and plan pairs in
+# 'Test Files' (0.869 to 0.894).  SourceToBlockTrayDistance /
+# SourceAxisDistance in those plans is 0.95, which does not match the inserts,
+# so a calibrated value is used.
+INSERT_MAGNIFICATION = 0.88
+# The face of the insert placed on the scanner glass.  A scan of the 'source'
+# (upstream) face is the beam's eye view.  A scan of the 'patient' face is
+# the beam's eye view mirrored left to right.
+SCAN_FACES = ('source', 'patient')
+SCAN_FACE = 'source'
+# Spacing of the points sampled along the outlines.  The distances are
+# accurate to half of this spacing.
+SAMPLE_SPACING = 0.01  # cm
+# Coarser spacing used to register the outlines.
+REGISTRATION_SPACING = 0.02  # cm
+# The registration stops when the points move less than this, a quarter of a
+# pixel at 600 dpi.  Smaller steps only swap the nearest point pairs back and
+# forth.
+REGISTRATION_TOLERANCE = 0.001  # cm
+MAX_REGISTRATION_ITERATIONS = 100
+# The registered rotation is kept within this of the insert's skew on the
+# scan.  Larger rotations fit the wrong part of the outline, or a scan of the
+# wrong insert face.
+MAX_REGISTRATION_ROTATION = 3.0  # degrees
+# The report graph can only be shifted, so a registration is only shown there
+# if its rotation differs from the insert's skew by less than this.
+MAX_SHIFT_ONLY_ROTATION = 0.5  # degrees
+# Length of the scanned edge used to find the edge direction at each point,
+# to smooth out the pixel steps in the traced edge.
+NORMAL_SPAN = 0.2  # cm
+
+
+class Registration(NamedTuple):
+    """The rigid transformation mapping the plan aperture onto the scan.
+
+    Points are rotated about the plan origin and then translated.
+    Attributes:
+        rotation (float): The counter-clockwise rotation in degrees.
+        translation (np.ndarray): The X,Y shift in cm.
+        rms_residual (float): The RMS distance from the transformed plan
+            edge to the scanned edge in cm.
+        max_residual (float): The largest distance from the transformed plan
+            edge to the scanned edge in cm.
+        iterations (int): The number of iterations used.
+        converged (bool): True if the registration settled within the
+            tolerance, without reaching the rotation limit.
+        initial_rotation (float): The rotation the search started from, the
+            skew of the insert on the scan, in degrees.
+    """
+    rotation: float
+    translation: np.ndarray
+    rms_residual: float
+    max_residual: float
+    iterations: int
+    converged: bool
+    initial_rotation: float = 0.0
+
+
+class ApertureComparison(NamedTuple):
+    """The differences between the scanned and planned apertures.
+
+    Attributes:
+        scan_area (float): The area of the scanned aperture in cm^2.
+        plan_area (float): The area of the planned aperture in cm^2.
+        area_difference (float): scan_area - plan_area in cm^2.
+        hausdorff (float): The symmetric Hausdorff distance between the
+            aperture edges in cm.
+        max_deviation (float): The largest distance from the scanned edge to
+            the planned edge in cm.
+        registration (Registration): The transformation applied to the
+            planned aperture before comparing.  None if the apertures were
+            compared as positioned.
+    """
+    scan_area: float
+    plan_area: float
+    area_difference: float
+    hausdorff: float
+    max_deviation: float
+    registration: Optional[Registration] = None
+
+
+#%% Coordinate Conversion
+def face_direction(scan_face: str) -> int:
+    """The direction of plan X across the scan for a scanned insert face.
+
+    Args:
+        scan_face (str): The face of the insert on the scanner glass, one of
+            SCAN_FACES.
+    Raises:
+        ValueError: If scan_face is not one of SCAN_FACES.
+    Returns:
+        direction (int): 1 if plan X runs to the right on the scan, -1 if it
+            runs to the left.
+    """
+    if scan_face not in SCAN_FACES:
+        raise ValueError(f'scan_face must be one of {SCAN_FACES}, '
+                         f'not {scan_face!r}')
+    return 1 if scan_face == 'source' else -1
+
+
+def scan_to_plan(outline: np.ndarray, insert_limits: np.ndarray,
+                 magnification: float = INSERT_MAGNIFICATION,
+                 scan_face: str = SCAN_FACE) -> np.ndarray:
+    """Convert scan coordinates to plan coordinates.
+
+    The plan origin is the centre of the insert, the same point that the
+        report's aperture graph is centred on.  Plan Y runs up the scan and
+        plan X runs across it, to the right for a scan of the source face.
+    Args:
+        outline (np.ndarray): x,y coordinates in inches, where x is the
+            distance down the scan and y is the distance across the scan.
+        insert_limits (np.ndarray of size 4): The extent of the insert in
+            inches as [x_min, y_min, x_max, y_max].
+        magnification (float, optional): The size on the insert of one cm in
+            the isocentre plane. Default is INSERT_MAGNIFICATION.
+        scan_face (str, optional): The face of the insert on the scanner
+            glass, one of SCAN_FACES. Default is SCAN_FACE.
+    Returns:
+        plan_outline (np.ndarray): X,Y coordinates in cm in the isocentre
+            plane.
+    """
+    centre = (insert_limits[:2] + insert_limits[2:]) / 2
+    offset = (outline - centre) * 2.54 / magnification
+    plan_outline = np.column_stack([face_direction(scan_face) * offset[:, 1],
+                                    -offset[:, 0]])
+    return plan_outline
+
+
+def plan_to_scan(plan_outline: np.ndarray, insert_limits: np.ndarray,
+                 magnification: float = INSERT_MAGNIFICATION,
+                 scan_face: str = SCAN_FACE) -> np.ndarray:
+    """Convert plan coordinates to scan coordinates.
+
+    The inverse of scan_to_plan.
+    Args:
+        plan_outline (np.ndarray): X,Y coordinates in cm in the isocentre
+            plane.
+        insert_limits (np.ndarray of size 4): The extent of the insert in
+            inches as [x_min, y_min, x_max, y_max].
+        magnification (float, optional): The size on the insert of one cm in
+            the isocentre plane. Default is INSERT_MAGNIFICATION.
+        scan_face (str, optional): The face of the insert on the scanner
+            glass, one of SCAN_FACES. Default is SCAN_FACE.
+    Returns:
+        outline (np.ndarray): x,y coordinates in inches, where x is the
+            distance down the scan and y is the distance across the scan.
+    """
+    centre = (insert_limits[:2] + insert_limits[2:]) / 2
+    offset = np.column_stack([-plan_outline[:, 1],
+                              face_direction(scan_face) * plan_outline[:, 0]])
+    outline = offset * magnification / 2.54 + centre
+    return outline
+
+
+#%% Outline Measurements
+def densify_outline(outline: np.ndarray,
+                    spacing: float = SAMPLE_SPACING) -> np.ndarray:
+    """Sample points along a closed outline at a maximum spacing.
+
+    Each edge is divided into equal steps no longer than spacing.  All
+        edges are sampled together.
+    Args:
+        outline (np.ndarray): X,Y coordinates of the outline vertices.
+        spacing (float, optional): The largest distance between samples.
+            Default is SAMPLE_SPACING.
+    Returns:
+        samples (np.ndarray): X,Y coordinates of points along the outline.
+    """
+    starts = outline
+    ends = np.roll(outline, -1, axis=0)
+    lengths = np.hypot(*(ends - starts).T)
+    steps = np.maximum(np.ceil(lengths / spacing).astype(int), 1)
+    edge = np.repeat(np.arange(len(outline)), steps)
+    # The position of each sample along its edge, from 0 up to 1.
+    first_sample = np.cumsum(steps) - steps
+    fraction = (np.arange(steps.sum()) - first_sample[edge]) / steps[edge]
+    samples = (starts[edge] +
+               (ends[edge] - starts[edge]) * fraction[:, np.newaxis])
+    return samples
+
+
+def resample_outline(outline: np.ndarray, spacing: float) -> np.ndarray:
+    """Sample points evenly spaced along a closed outline.
+
+    Args:
+        outline (np.ndarray): X,Y coordinates of the outline vertices.
+        spacing (float): The approximate distance between samples.
+    Returns:
+        samples (np.ndarray): X,Y coordinates of the evenly spaced points.
+    """
+    closed_outline = np.vstack([outline, outline[:1]])
+    arc_length = np.concatenate([[0.0], np.cumsum(np.hypot(
+        *np.diff(closed_outline, axis=0).T))])
+    sample_count = max(3, int(np.ceil(arc_length[-1] / spacing)))
+    positions = np.arange(sample_count) * arc_length[-1] / sample_count
+    samples = np.column_stack([
+        np.interp(positions, arc_length, closed_outline[:, 0]),
+        np.interp(positions, arc_length, closed_outline[:, 1])])
+    return samples
+
+
+def compare_apertures(scan_aperture: np.ndarray,
+                      plan_outlines: List[np.ndarray],
+                      spacing: float = SAMPLE_SPACING,
+                      registration: Registration = None
+                      ) -> ApertureComparison:
+    """Measure the differences between the scanned and planned apertures.
+
+    Args:
+        scan_aperture (np.ndarray): X,Y coordinates of the scanned aperture
+            edge in cm.
+        plan_outlines (List[np.ndarray]): X,Y coordinates of each planned
+            aperture block outline in cm.
+        spacing (float, optional): The spacing of the points compared along
+            the edges. Default is SAMPLE_SPACING.
+        registration (Registration, optional): A transformation to apply to
+            the planned outlines first. Default is to compare the outlines as
+            positioned.
+    Returns:
+        aperture_comparison (ApertureComparison): The area difference,
+            Hausdorff distance and maximum edge deviation.
+    """
+    if registration is not None:
+        plan_outlines = [transform_outline(outline, registration)
+                         for outline in plan_outlines]
+    scan_points = densify_outline(scan_aperture, spacing)
+    plan_points = np.concatenate([densify_outline(outline, spacing)
+                                  for outline in plan_outlines])
+    scan_to_plan_distance, _ = cKDTree(plan_points).query(scan_points)
+    plan_to_scan_distance, _ = cKDTree(scan_points).query(plan_points)
+    max_deviation = float(scan_to_plan_distance.max())
+    hausdorff = max(max_deviation, float(plan_to_scan_distance.max()))
+    scan_area = float(polygon_area(scan_aperture))
+    plan_area = float(sum(polygon_area(outline)
+                          for outline in plan_outlines))
+    return ApertureComparison(scan_area=scan_area, plan_area=plan_area,
+                              area_difference=scan_area - plan_area,
+                              hausdorff=hausdorff,
+                              max_deviation=max_deviation,
+                              registration=registration)
+
+
+#%% Registration
+def rotation_matrix(rotation: float) -> np.ndarray:
+    """The matrix for a counter-clockwise rotation.
+
+    Args:
+        rotation (float): The rotation angle in degrees.
+    Returns:
+        matrix (np.ndarray): The 2x2 rotation matrix.
+    """
+    angle = np.radians(rotation)
+    return np.array([[np.cos(angle), -np.sin(angle)],
+                     [np.sin(angle), np.cos(angle)]])
+
+
+def transform_outline(outline: np.ndarray,
+                      registration: Registration) -> np.ndarray:
+    """Apply a registration to an outline.
+
+    Args:
+        outline (np.ndarray): X,Y coordinates in cm.
+        registration (Registration): The rigid transformation.
+    Returns:
+        transformed_outline (np.ndarray): The rotated and shifted X,Y
+            coordinates in cm.
+    """
+    matrix = rotation_matrix(registration.rotation)
+    return outline @ matrix.T + registration.translation
+
+
+def edge_normals(outline_points: np.ndarray, window: int = 1) -> np.ndarray:
+    """Unit normals to a closed outline sampled in order.
+
+    Args:
+        outline_points (np.ndarray): X,Y coordinates of evenly spaced points
+            along the outline.
+        window (int, optional): The edge direction at each point is taken
+            from the points this many places before and after it. Default
+            is 1.
+    Returns:
+        normals (np.ndarray): The X,Y unit normal at each point.
+    """
+    tangents = (np.roll(outline_points, -window, axis=0) -
+                np.roll(outline_points, window, axis=0))
+    normals = np.column_stack([tangents[:, 1], -tangents[:, 0]])
+    lengths = np.hypot(normals[:, 0], normals[:, 1])
+    return normals / np.maximum(lengths, np.finfo(float).eps)[:, np.newaxis]
+
+
+def register_aperture(plan_outlines: List[np.ndarray],
+                      scan_aperture: np.ndarray,
+                      initial_rotation: float = 0.0,
+                      spacing: float = REGISTRATION_SPACING,
+                      tolerance: float = REGISTRATION_TOLERANCE,
+                      max_iterations: int = MAX_REGISTRATION_ITERATIONS,
+                      max_rotation: float = MAX_REGISTRATION_ROTATION
+                      ) -> Registration:
+    """Register the planned aperture onto the scanned aperture edge.
+
+    Iterative closest point: each point on the planned edge is paired with
+        the nearest point on the scanned edge using a KD-tree.  The small
+        rotation and shift that minimize the distances from the planned
+        points to the lines along the scanned edge at their pairs are found
+        by linear least squares and applied.  Minimizing the distance to the
+        edge rather than to the paired point lets the outlines slide along
+        each other, so few iterations are needed.  The search starts from
+        initial_rotation with the centres of the two edges aligned.  The
+        rotation is held within max_rotation of initial_rotation; when a
+        step would pass the limit, the rotation is held at the limit and
+        only the shift is fitted.
+    Args:
+        plan_outlines (List[np.ndarray]): X,Y coordinates of each planned
+            aperture block outline in cm.
+        scan_aperture (np.ndarray): X,Y coordinates of the scanned aperture
+            edge in cm.
+        initial_rotation (float, optional): The expected counter-clockwise
+            rotation in degrees, such as the skew of the insert on the scan.
+            Default is 0.
+        spacing (float, optional): The spacing of the points sampled along
+            the edges. Default is REGISTRATION_SPACING.
+        tolerance (float, optional): Stop when the points move less than this
+            in an iteration. Default is REGISTRATION_TOLERANCE.
+        max_iterations (int, optional): The largest number of iterations.
+            Default is MAX_REGISTRATION_ITERATIONS.
+        max_rotation (float, optional): The largest difference in degrees
+            from initial_rotation. Default is MAX_REGISTRATION_ROTATION.
+    Returns:
+        registration (Registration): The rotation and translation mapping
+            the planned aperture onto the scan, with the residual distances
+            from the planned edge to the scanned edge.
+    """
+    plan_points = np.concatenate([densify_outline(outline, spacing)
+                                  for outline in plan_outlines])
+    scan_points = resample_outline(scan_aperture, spacing)
+    window = max(1, int(round(NORMAL_SPAN / spacing / 2)))
+    scan_normals = edge_normals(scan_points, window)
+    scan_tree = cKDTree(scan_points)
+    initial_angle = np.radians(initial_rotation)
+    angle_limits = initial_angle + np.radians([-max_rotation, max_rotation])
+    angle = initial_angle
+    matrix = rotation_matrix(initial_rotation)
+    shift = scan_points.mean(axis=0) - plan_points.mean(axis=0) @ matrix.T
+    # Size used to convert the rotation step to a movement of the points.
+    radius = np.ptp(plan_points, axis=0).max() / 2
+    converged = False
+    at_limit = False
+    for iteration in range(1, max_iterations + 1):
+        moved_points = plan_points @ matrix.T + shift
+        _, nearest = scan_tree.query(moved_points)
+        normals = scan_normals[nearest]
+        residuals = np.sum((moved_points - scan_points[nearest]) * normals,
+                           axis=1)
+        # Linearized change in the residuals for a rotation and X,Y shift.
+        gradients = np.column_stack([
+            moved_points[:, 0] * normals[:, 1] -
+            moved_points[:, 1] * normals[:, 0],
+            normals[:, 0], normals[:, 1]])
+        step = np.linalg.lstsq(gradients, -residuals, rcond=None)[0]
+        limited_angle = float(np.clip(angle + step[0], *angle_limits))
+        at_limit = limited_angle != angle + step[0]
+        if at_limit:
+            step[0] = limited_angle - angle
+            step[1:] = np.linalg.lstsq(
+                gradients[:, 1:], -residuals - gradients[:, 0] * step[0],
+                rcond=None)[0]
+        angle = limited_angle
+        step_matrix = rotation_matrix(np.degrees(step[0]))
+        matrix = rotation_matrix(np.degrees(angle))
+        shift = step_matrix @ shift + step[1:]
+        if max(abs(step[0]) * radius, np.hypot(*step[1:])) < tolerance:
+            converged = not at_limit
+            break
+    moved_points = plan_points @ matrix.T + shift
+    _, nearest = scan_tree.query(moved_points)
+    residuals = np.sum((moved_points - scan_points[nearest]) *
+                       scan_normals[nearest], axis=1)
+    return Registration(rotation=float(np.degrees(angle)), translation=shift,
+                        rms_residual=float(np.sqrt(np.mean(residuals ** 2))),
+                        max_residual=float(np.abs(residuals).max()),
+                        iterations=iteration, converged=converged,
+                        initial_rotation=initial_rotation)
+
+
+def shift_only_offset(registration: Optional[Registration]
+                      ) -> Optional[np.ndarray]:
+    """The shift to show for a registration when the plan cannot be rotated.
+
+    The report squares the scan by rotating it by the skew of the insert, so
+        the translation is rotated the same way.  The translation only places
+        the plan correctly together with its rotation, so it is only used if
+        the registration converged and its rotation differs from the skew by
+        a negligible amount.
+    Args:
+        registration (Registration): The registration of the planned
+            aperture onto the scan, or None.
+    Returns:
+        plan_offset (np.ndarray): The X,Y shift in cm of the aperture from
+            the centre of the squared insert, or None if the registration
+            should not be shown as a shift.
+    """
+    if registration is None or not registration.converged:
+        return None
+    skew = registration.initial_rotation
+    if abs(registration.rotation - skew) > MAX_SHIFT_ONLY_ROTATION:
+        return None
+    return rotation_matrix(-skew) @ registration.translation
+
+
+#%% Discrepancy Map
+class Discrepancy(NamedTuple):
+    """Where the scanned aperture differs from the planned aperture.
+
+    Attributes:
+        discrepancy_map (np.ndarray): For each scan pixel in the insert's
+            bounding box, 1 where the insert was cut beyond the plan, -1
+            where the plan extends beyond the cut and 0 where they agree.
+        origin (np.ndarray): The row and column of the map's top left pixel
+            in the scan.
+        over_cut_area (float): The area cut beyond the plan in cm^2.
+        under_cut_area (float): The area of the plan not cut in cm^2.
+    """
+    discrepancy_map: np.ndarray
+    origin: np.ndarray
+    over_cut_area: float
+    under_cut_area: float
+
+
+def fill_polygons(outlines: List[np.ndarray],
+                  shape: Tuple[int, int]) -> np.ndarray:
+    """Rasterize closed outlines with a scanline fill.
+
+    A pixel is inside if its centre is inside the outlines by the even-odd
+        rule, so outlines inside other outlines are holes.  The crossings of
+        every edge with every pixel row are calculated together, sorted
+        along each row and paired into spans, and the spans are filled with
+        a cumulative sum.
+    Args:
+        outlines (List[np.ndarray]): The row, column coordinates of each
+            outline in pixels.
+        shape (Tuple[int, int]): The number of rows and columns in the mask.
+    Returns:
+        mask (np.ndarray): A boolean image, True inside the outlines.
+    """
+    starts = np.concatenate(outlines)
+    ends = np.concatenate([np.roll(outline, -1, axis=0)
+                           for outline in outlines])
+    low_row = np.minimum(starts[:, 0], ends[:, 0])
+    high_row = np.maximum(starts[:, 0], ends[:, 0])
+    # Each edge crosses the rows from ceil(low_row) up to, but not including,
+    # high_row, so a vertex shared by two edges is counted once.
+    first_row = np.clip(np.ceil(low_row), 0, shape[0]).astype(int)
+    last_row = np.clip(np.ceil(high_row), 0, shape[0]).astype(int)
+    row_counts = last_row - first_row
+    edge = np.repeat(np.arange(len(starts)), row_counts)
+    rows = (np.arange(row_counts.sum()) -
+            np.repeat(np.cumsum(row_counts) - row_counts, row_counts) +
+            first_row[edge])
+    slope = ((ends[edge, 1] - starts[edge, 1]) /
+             (ends[edge, 0] - starts[edge, 0]))
+    columns = starts[edge, 1] + (rows - starts[edge, 0]) * slope
+    order = np.lexsort((columns, rows))
+    rows = rows[order].reshape(-1, 2)[:, 0]
+    columns = columns[order].reshape(-1, 2)
+    span_starts = np.clip(np.ceil(columns[:, 0]), 0, shape[1]).astype(int)
+    span_ends = np.clip(np.ceil(columns[:, 1]), 0, shape[1]).astype(int)
+    spans = np.zeros((shape[0], shape[1] + 1), dtype=np.int32)
+    np.add.at(spans, (rows, span_starts), 1)
+    np.add.at(spans, (rows, span_ends), -1)
+    mask = np.cumsum(spans[:, :-1], axis=1) > 0
+    return mask
+
+
+def map_discrepancy(aperture_contour: np.ndarray,
+                    plan_contours: List[np.ndarray],
+                    insert_contour: np.ndarray,
+                    dpi: np.ndarray) -> Discrepancy:
+    """Map where the cut aperture differs from the planned aperture.
+
+    Both apertures are rasterized at the scan resolution, only within the
+        bounding box of the insert, and compared pixel by pixel.
+    Args:
+        aperture_contour (np.ndarray): The row, column coordinates of the
+            scanned aperture edge in pixels.
+        plan_contours (List[np.ndarray]): The row, column coordinates of each
+            planned aperture block outline in scan pixels.
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+        dpi (np.ndarray): The resolution of the scan in dots per inch.
+    Returns:
+        discrepancy (Discrepancy): The over-cut and under-cut map and areas.
+    """
+    origin = np.floor(insert_contour.min(axis=0)).astype(int)
+    shape = tuple(np.ceil(insert_contour.max(axis=0)).astype(int) + 1 -
+                  origin)
+    scan_mask = fill_polygons([aperture_contour - origin], shape)
+    plan_mask = fill_polygons([contour - origin for contour in plan_contours],
+                              shape)
+    over_cut = scan_mask & ~plan_mask
+    under_cut = plan_mask & ~scan_mask
+    discrepancy_map = over_cut.astype(np.int8) - under_cut.astype(np.int8)
+    pixel_area = (2.54 / dpi[0]) * (2.54 / dpi[1])
+    return Discrepancy(discrepancy_map=discrepancy_map, origin=origin,
+                       over_cut_area=float(over_cut.sum() * pixel_area),
+                       under_cut_area=float(under_cut.sum() * pixel_area))
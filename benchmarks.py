@@ -0,0 +1,239 @@
+"""Performance checks for the Electron Cutout analysis.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+#%% Start-up Time
+# The GUI window should appear in well under a second.
+STARTUP_BUDGET = 0.5  # seconds
+STARTUP_MODULES = ['CutOutAnalysisMain']
+
+
+def import_time(module_name: str, repeats: int = 3) -> float:
+    """Measure the time taken to import a module in a fresh interpreter.
+
+    The interpreter start-up time is subtracted, so the value is the cost of
+        importing the module and its dependencies.
+    Args:
+        module_name (str): The name of the module to import.
+        repeats (int, optional): The number of measurements to take.  The
+            fastest is used. Default is 3.
+    Returns:
+        seconds (float): The import time in seconds.
+    """
+    timer = ('import time; start = time.perf_counter(); import {}; '
+             'print(time.perf_counter() - start)')
+    code = timer.format(module_name)
+    times = list()
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', code],
+                                capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).parent)
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def check_startup_time(budget: float = STARTUP_BUDGET) -> dict:
+    """Check that the GUI entry point imports within the time budget.
+
+    Args:
+        budget (float, optional): The maximum import time in seconds.
+            Default is STARTUP_BUDGET.
+    Returns:
+        startup_times (dict): The import time in seconds for each module in
+            STARTUP_MODULES.
+    Raises:
+        AssertionError: If any module takes longer than budget to import.
+    """
+    startup_times = {module_name: import_time(module_name)
+                     for module_name in STARTUP_MODULES}
+    for module_name, seconds in startup_times.items():
+        assert seconds < budget, (
+            f'{module_name} took {seconds:.3f} s to import; '
+            f'the budget is {budget:.3f} s')
+    return startup_times
+
+
+#%% Denoise Backend Selection
+TEST_FILES_FOLDER = Path(__file__).parent / 'Test Files'
+# Largest difference in insert_limits accepted as reproducing the reference.
+DENOISE_TOLERANCE = 0.1 / 25.4  # 0.1 mm in inches
+
+
+def load_test_image(image_file: Path):
+    """Read a scanned cutout image as 8 bit grayscale.
+
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+    Returns:
+        cutout_image (np.ndarray): The grayscale image.
+        dpi (np.ndarray): The image resolution in dots per inch.
+    """
+    import numpy as np
+    from cutout_image import read_scan
+    cutout_image = read_scan(image_file)
+    dpi = np.array(cutout_image.meta['dpi'])
+    return cutout_image, dpi
+
+
+def time_outline(cutout_image, dpi, denoise: str,
+                 pyramid: bool = False) -> tuple:
+    """Time find_outline using one denoise backend.
+
+    Args:
+        cutout_image (np.ndarray): The grayscale image.
+        dpi (np.ndarray): The image resolution in dots per inch.
+        denoise (str): The name of the denoise backend.
+        pyramid (bool, optional): Use the coarse-to-fine outline search.
+            Default is False.
+    Returns:
+        seconds (float): The time taken by find_outline.
+        insert_limits (np.ndarray): The insert limits found.
+    """
+    from Cutout_Analysis import find_outline
+    start = time.perf_counter()
+    insert_limits = find_outline(cutout_image, dpi, pyramid, denoise)[1]
+    seconds = time.perf_counter() - start
+    return seconds, insert_limits
+
+
+def select_denoise_backend(image_files: List[Path] = None,
+                           pyramid: bool = False,
+                           tolerance: float = DENOISE_TOLERANCE
+                           ) -> Tuple[str, Dict[str, Dict[str, float]]]:
+    """Find the fastest denoise backend that reproduces the reference.
+
+    Each backend is timed on each image.  A backend reproduces the reference
+        if its insert_limits are within tolerance of those from the 'scipy'
+        backend on every image.  Images where the reference outline search
+        fails are skipped.
+    Args:
+        image_files (List[Path], optional): The scanned cutout images to use.
+            Default is all of the jpg files in TEST_FILES_FOLDER.
+        pyramid (bool, optional): Use the coarse-to-fine outline search.
+            Default is False.
+        tolerance (float, optional): The largest accepted difference in
+            insert_limits in inches. Default is DENOISE_TOLERANCE.
+    Returns:
+        fastest (str): The name of the selected backend.
+        timings (Dict[str, Dict[str, float]]): The time in seconds for each
+            backend on each image.  Backends that did not reproduce the
+            reference on an image have a time of None for that image.
+    """
+    import numpy as np
+    from cutout_image import DENOISE_BACKENDS
+    if image_files is None:
+        image_files = sorted(TEST_FILES_FOLDER.glob('*.jpg'))
+    timings = {backend: dict() for backend in DENOISE_BACKENDS}
+    for image_file in image_files:
+        cutout_image, dpi = load_test_image(image_file)
+        try:
+            reference_time, reference_limits = time_outline(
+                cutout_image, dpi, 'scipy', pyramid)
+        except (IndexError, ValueError):
+            continue
+        timings['scipy'][image_file.name] = reference_time
+        for backend in DENOISE_BACKENDS:
+            if backend == 'scipy':
+                continue
+            try:
+                seconds, insert_limits = time_outline(cutout_image, dpi,
+                                                      backend, pyramid)
+            except (IndexError, ValueError):
+                seconds = None
+            else:
+                difference = np.abs(insert_limits - reference_limits).max()
+                if difference > tolerance:
+                    seconds = None
+            timings[backend][image_file.name] = seconds
+    reproduced = {backend: sum(times.values())
+                  for backend, times in timings.items()
+                  if None not in times.values()}
+    fastest = min(reproduced, key=reproduced.get)
+    return fastest, timings
+
+
+#%% Tiled Denoise Speed-up
+TILE_TEST_FILES = ['CutoutTest2.jpg', 'CutoutTest4.jpg']
+
+
+def tile_speedup(image_names: List[str] = None, workers: int = None,
+                 denoise: str = None) -> Dict[str, Dict[str, float]]:
+    """Compare the single threaded and tiled denoise times.
+
+    Args:
+        image_names (List[str], optional): The names of the images in
+            TEST_FILES_FOLDER to use. Default is TILE_TEST_FILES.
+        workers (int, optional): The number of threads for the tiled
+            denoise. Default is the number of CPU cores.
+        denoise (str, optional): The name of the denoise backend. Default is
+            cutout_image.DEFAULT_DENOISE.
+    Raises:
+        AssertionError: If the tiled result is not identical to the single
+            threaded result.
+    Returns:
+        speedup_report (Dict[str, Dict[str, float]]): For each image, the
+            single threaded time, the tiled time, the number of workers and
+            the speed-up.
+    """
+    import numpy as np
+    from cutout_image import (DEFAULT_DENOISE, default_workers,
+                              denoise_image, denoise_tiled)
+    if image_names is None:
+        image_names = TILE_TEST_FILES
+    if workers is None:
+        workers = default_workers()
+    if denoise is None:
+        denoise = DEFAULT_DENOISE
+    speedup_report = dict()
+    for image_name in image_names:
+        cutout_image, _ = load_test_image(TEST_FILES_FOLDER / image_name)
+        start = time.perf_counter()
+        single = denoise_image(cutout_image, denoise)
+        single_time = time.perf_counter() - start
+        start = time.perf_counter()
+        tiled = denoise_tiled(cutout_image, denoise, workers=workers)
+        tiled_time = time.perf_counter() - start
+        assert np.array_equal(single, tiled), (
+            f'Tiled denoise of {image_name} differs from single threaded')
+        speedup_report[image_name] = {
+            'single': single_time,
+            'tiled': tiled_time,
+            'workers': workers,
+            'speedup': single_time / tiled_time
+            }
+    return speedup_report
+
+
+#%% Main
+def main():
+    """Run the performance checks and print the results.
+
+    Returns:
+        None.
+    """
+    for module_name, seconds in check_startup_time().items():
+        print(f'{module_name} import time: {seconds:.3f} s')
+    fastest, timings = select_denoise_backend()
+    for backend, times in timings.items():
+        for image_name, seconds in times.items():
+            result = 'differs' if seconds is None else f'{seconds:.2f} s'
+            print(f'{backend} denoise on {image_name}: {result}')
+    print(f'Fastest denoise backend: {fastest}')
+    for image_name, report in tile_speedup().items():
+        print(f'{image_name} denoise: {report["single"]:.2f} s single, '
+              f'{report["tiled"]:.2f} s with {report["workers"]} threads, '
+              f'{report["speedup"]:.1f}x speed-up')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1483 @@
+"""Image processing for scanned electron cutout inserts.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%%  Imports
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import numpy as np
+from imageio.core import Array
+from PIL import Image
+from scipy import fft, ndimage
+from scipy.spatial import ConvexHull
+from skimage import measure
+from skimage.filters import rank
+
+
+#%% Outline Detection Settings
+MEDIAN_SIZE = 10  # Median filter size in pixels at full resolution.
+CONTOUR_LEVEL = 20  # Threshold just above black.
+PYRAMID_DPI = 75  # Approximate resolution of the coarse outline search.
+BAND_BLOCK_SIZE = 32  # Size of the full resolution refinement blocks.
+# The coarse outline is accurate to within one coarse pixel, so the
+# refinement band is BAND_MARGIN coarse pixels plus the median filter size
+# on each side of the coarse outline.
+BAND_MARGIN = 2
+# Maximum difference between the pyramid and full resolution insert limits,
+# measured on the scans in 'Test Files'.
+PYRAMID_TOLERANCE = 0.5 / 25.4  # 0.5 mm in inches
+TILE_ROWS = 512  # Number of image rows denoised by each thread.
+STRIP_ROWS = 256  # Number of image rows in memory for each strip mode thread.
+TIFF_SUFFIXES = ('.tif', '.tiff')
+# Skew estimates with a lower confidence indicate that the outline is not a
+# clean rectangular insert frame.
+SKEW_CONFIDENCE_LIMIT = 0.85
+# Bright regions narrower than this are dust or markings, not insert frames.
+MIN_INSERT_SIZE = 2.0  # inches
+# A bright region touching the edge of the scan is the page margin, unless it
+# fills at least this fraction of its bounding box.  Then it is an insert in
+# a scan cropped to the insert.
+CROPPED_INSERT_FILL = 0.5
+# Background kept around each insert when a page holds several inserts.
+REGION_MARGIN = 0.25  # inches
+# The encoder strip along the top of the insert holds a row of holes that
+# are either open or plugged.  The first hole is always plugged.
+ENCODER_HEIGHT = 9 / 25.4  # inches
+ENCODER_HOLE_PITCH = 0.2  # inches between hole centres
+ENCODER_HOLE_DEPTH = 6 / 25.4  # inches from the top of the strip, nominal
+ENCODER_HOLE_SEARCH = 2.5 / 25.4  # inches either side of the nominal depth
+ENCODER_PATCH = 1.5 / 25.4  # inches; size of the area sampled in each hole
+ENCODER_VARIANTS = {
+    # variant: (strip width, distance to first hole centre, number of holes)
+    'wide': (90 / 25.4, 14 / 25.4, 13),
+    'narrow': (52 / 25.4, 8 / 25.4, 8)
+    }
+# Fractional difference from the nominal width accepted for a strip.  The
+# strips on the test scans are within 2% of nominal; the tab that holds the
+# strip on a 10 cm frame is 15% wider than the wide strip.
+ENCODER_WIDTH_TOLERANCE = 0.10
+# The strips are at most 0.71 of the frame width.  A 6 cm frame without its
+# strip is close to the wide strip width, but as wide as the frame.
+ENCODER_WIDTH_RATIO = 0.85
+# The strips are at least 0.6 of the frame width.  Narrower parts of the
+# outline above the strip or frame are dust or the seam of a detached strip.
+TOP_EDGE_FRACTION = 0.5
+# Outer width of the insert frame, below the encoder strip, for each
+# applicator size in cm.  The 6 and 10 cm sizes are measured from scans; the
+# others assume the same 26 mm frame border.
+FRAME_SIZES = {6: 86 / 25.4, 10: 126 / 25.4, 15: 176 / 25.4,
+               20: 226 / 25.4, 25: 276 / 25.4}  # inches
+# Applicator sizes whose frame width has been measured.  Only these are
+# trusted to check a scan against the plan.
+MEASURED_FRAME_SIZES = (6, 10)
+TEMPLATE_DPI = 20  # Approximate resolution of the template search.
+TEMPLATE_ROTATIONS = (-6, -4, -2, 0, 2, 4, 6)  # degrees
+# Width of the dark border around the frame in the templates.
+TEMPLATE_MARGIN = 5 / 25.4  # inches
+
+
+#%% Image Loading
+def read_scan(image_file: Path, reduction: int = 1) -> Array:
+    """Decode a scanned cutout image as single channel 8 bit grayscale.
+
+    JPEG scans are decoded directly to grayscale (Pillow draft mode), so the
+        colour channels are never built.  If reduction is 2, 4 or 8, the JPEG
+        decoder also scales the image in the DCT domain, which is much
+        faster and uses less memory than decoding at full resolution.  Other
+        formats are converted to grayscale and reduced by block averaging.
+        The dpi in the meta data is adjusted to the decoded size, so that the
+        image size in inches is unchanged.
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+        reduction (int, optional): The factor to reduce the resolution by.
+            Default is 1 (full resolution).
+    Returns:
+        cutout_image (Array): The grayscale image as uint8, with the dpi in
+            cutout_image.meta['dpi'].
+    """
+    with Image.open(image_file) as scan:
+        scan_size = scan.size
+        dpi = [float(resolution)
+               for resolution in scan.info.get('dpi', (72, 72))]
+        meta = {'dpi': dpi}
+        if scan.format == 'JPEG':
+            scan.draft('L', (scan.width // reduction,
+                             scan.height // reduction))
+        image = np.asarray(scan.convert('L'))
+    if image.shape[::-1] == scan_size and reduction > 1:
+        image = np.round(downsample_image(image, reduction)).astype(np.uint8)
+    # The decoded size is (rows, columns); dpi is (x, y).
+    meta['dpi'] = tuple(resolution * decoded / original
+                        for resolution, decoded, original
+                        in zip(dpi, image.shape[::-1], scan_size))
+    cutout_image = Array(image, meta)
+    return cutout_image
+
+
+def grayscale(pixels: np.ndarray) -> np.ndarray:
+    """Convert pixels to single channel 8 bit grayscale.
+
+    Colour pixels are converted with the same ITU-R 601-2 weights as Pillow,
+        so the result matches read_scan.  16 bit pixels are reduced to their
+        high byte.
+    Args:
+        pixels (np.ndarray): Image rows, either 2D grayscale or 3D with RGB
+            or RGBA in the last axis.
+    Returns:
+        gray (np.ndarray): The pixels as 2D uint8.
+    """
+    if pixels.dtype == np.uint16:
+        pixels = pixels >> 8
+    if pixels.ndim == 2:
+        return pixels.astype(np.uint8, copy=False)
+    rgb = pixels[..., :3].astype(np.uint32)
+    gray = (rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471
+            + 0x8000) >> 16
+    return gray.astype(np.uint8)
+
+
+def tiff_resolution(tiff_page) -> Tuple[float, float]:
+    """Read the resolution of a TIFF image in dots per inch.
+
+    Args:
+        tiff_page (tifffile.TiffPage): The first page of the TIFF file.
+    Returns:
+        dpi (Tuple[float, float]): The x and y resolution.  (72, 72) if the
+            file does not record its resolution.
+    """
+    tags = tiff_page.tags
+    if 'XResolution' not in tags or 'YResolution' not in tags:
+        return (72.0, 72.0)
+    dpi = [numerator / denominator for numerator, denominator
+           in (tags['XResolution'].value, tags['YResolution'].value)]
+    if 'ResolutionUnit' in tags and int(tags['ResolutionUnit'].value) == 3:
+        dpi = [resolution * 2.54 for resolution in dpi]  # Pixels per cm
+    return tuple(dpi)
+
+
+def open_scan(image_file: Path) -> Array:
+    """Open a scan for strip-wise processing without decoding it all at once.
+
+    Uncompressed TIFF scans are memory mapped, so rows are only read from
+        disk as each strip is processed.  Other scans can not be decoded in
+        parts, so they are decoded to grayscale with read_scan.
+    Args:
+        image_file (Path): Full path to the scanned cutout image file.
+    Returns:
+        scan (Array): The image pixels, as a memory map for TIFF scans, with
+            the dpi in scan.meta['dpi'].  TIFF scans may have colour
+            channels; use grayscale to convert each strip.
+    """
+    if Path(image_file).suffix.lower() in TIFF_SUFFIXES:
+        import tifffile
+        with tifffile.TiffFile(image_file) as tiff:
+            dpi = tiff_resolution(tiff.pages[0])
+        try:
+            pixels = tifffile.memmap(image_file, mode='r')
+        except ValueError:
+            # Compressed or fragmented TIFF files can not be memory mapped.
+            pass
+        else:
+            return Array(pixels, {'dpi': dpi})
+    return read_scan(image_file)
+
+
+#%% Denoise Backends
+def median_scipy(image: np.ndarray, size: int = MEDIAN_SIZE) -> np.ndarray:
+    """Apply a square median filter using scipy.
+
+    This is the reference denoise backend.
+    Args:
+        image (np.ndarray): A 2D grayscale image.
+        size (int, optional): The width of the square filter in pixels.
+    Returns:
+        denoised (np.ndarray): The filtered image.
+    """
+    return ndimage.median_filter(image, size)
+
+
+def median_histogram(image: np.ndarray,
+                     size: int = MEDIAN_SIZE) -> np.ndarray:
+    """Apply a square median filter using a sliding histogram.
+
+    skimage's rank filters keep a 256 bin histogram that is updated as the
+        window moves, so the cost per pixel does not depend on the window
+        area.  The image is padded by reflection so that the result is
+        identical to median_scipy.  Only uint8 images can use this backend;
+        other images are passed to median_scipy.
+    Args:
+        image (np.ndarray): A 2D grayscale image.
+        size (int, optional): The width of the square filter in pixels.
+    Returns:
+        denoised (np.ndarray): The filtered image.
+    """
+    if image.dtype != np.uint8:
+        return median_scipy(image, size)
+    before, after = filter_halo(size)
+    padded = np.pad(image, ((before, after), (before, after)),
+                    mode='symmetric')
+    denoised = rank.median(padded, np.ones((size, size), dtype=bool))
+    return denoised[before:before + image.shape[0],
+                    before:before + image.shape[1]]
+
+
+def median_separable(image: np.ndarray,
+                     size: int = MEDIAN_SIZE) -> np.ndarray:
+    """Approximate a square median filter with a row and a column median.
+
+    Args:
+        image (np.ndarray): A 2D grayscale image.
+        size (int, optional): The width of the square filter in pixels.
+    Returns:
+        denoised (np.ndarray): The filtered image.
+    """
+    row_denoise = ndimage.median_filter(image, size=(1, size))
+    return ndimage.median_filter(row_denoise, size=(size, 1))
+
+
+DenoiseFunction = Callable[[np.ndarray, int], np.ndarray]
+DENOISE_BACKENDS: Dict[str, DenoiseFunction] = {
+    'scipy': median_scipy,
+    'histogram': median_histogram,
+    'separable': median_separable
+    }
+# Selected with benchmarks.select_denoise_backend on the 'Test Files' scans.
+DEFAULT_DENOISE = 'histogram'
+
+
+def denoise_image(image: np.ndarray, backend: str = DEFAULT_DENOISE,
+                  size: int = MEDIAN_SIZE) -> np.ndarray:
+    """Reduce the noise in an image while keeping the edge locations.
+
+    Args:
+        image (np.ndarray): A 2D grayscale image.
+        backend (str, optional): The name of the denoise backend. One of
+            the keys in DENOISE_BACKENDS. Default is DEFAULT_DENOISE.
+        size (int, optional): The width of the square filter in pixels.
+    Raises:
+        ValueError: If backend is not a known denoise backend.
+    Returns:
+        denoised (np.ndarray): The filtered image.
+    """
+    try:
+        denoise_function = DENOISE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f'{backend} is not a valid denoise backend')
+    return denoise_function(image, size)
+
+
+#%% Tiled Denoise
+def default_workers() -> int:
+    """The number of threads to use for image processing.
+
+    Returns:
+        workers (int): The number of CPU cores.
+    """
+    return os.cpu_count() or 1
+
+
+def filter_halo(size: int) -> Tuple[int, int]:
+    """The number of pixels a median filter reads either side of a pixel.
+
+    Args:
+        size (int): The width of the square filter in pixels.
+    Returns:
+        before (int): The number of pixels read before (above or left of)
+            each pixel.
+        after (int): The number of pixels read after (below or right of)
+            each pixel.
+    """
+    before = size // 2
+    after = size - before - 1
+    return before, after
+
+
+def image_tiles(image_rows: int, tile_rows: int,
+                size: int) -> Iterator[Tuple[int, int, int, int]]:
+    """Divide the image rows into tiles with an overlapping halo.
+
+    Args:
+        image_rows (int): The number of rows in the image.
+        tile_rows (int): The number of rows in each tile, excluding the halo.
+        size (int): The width of the square filter in pixels.
+    Yields:
+        Tuple[int, int, int, int]: The first and last + 1 rows of the tile
+            and of the tile including its halo.
+    """
+    before, after = filter_halo(size)
+    for top in range(0, image_rows, tile_rows):
+        bottom = min(top + tile_rows, image_rows)
+        yield top, bottom, max(top - before, 0), min(bottom + after,
+                                                     image_rows)
+
+
+def denoise_tiled(image: np.ndarray, backend: str = DEFAULT_DENOISE,
+                  size: int = MEDIAN_SIZE, workers: int = None,
+                  tile_rows: int = TILE_ROWS) -> np.ndarray:
+    """Reduce the noise in an image using several threads.
+
+    The image is split into strips of tile_rows rows.  Each strip is
+        filtered together with a halo of the rows the filter footprint reads
+        from the neighbouring strips, so the result is identical to
+        denoise_image on the whole image.  The filters release the GIL, so
+        the strips are processed in parallel.
+    Args:
+        image (np.ndarray): A 2D grayscale image.
+        backend (str, optional): The name of the denoise backend. Default is
+            DEFAULT_DENOISE.
+        size (int, optional): The width of the square filter in pixels.
+        workers (int, optional): The number of threads. Default is the
+            number of CPU cores.
+        tile_rows (int, optional): The number of rows in each strip. Default
+            is TILE_ROWS.
+    Returns:
+        denoised (np.ndarray): The filtered image.
+    """
+    if workers is None:
+        workers = default_workers()
+    image_rows = image.shape[0]
+    if workers <= 1 or image_rows <= tile_rows:
+        return denoise_image(image, backend, size)
+    denoised = np.empty_like(image)
+
+    def denoise_tile(tile: Tuple[int, int, int, int]):
+        top, bottom, pad_top, pad_bottom = tile
+        tile_denoise = denoise_image(image[pad_top:pad_bottom], backend,
+                                     size)
+        denoised[top:bottom] = tile_denoise[top - pad_top:bottom - pad_top]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() raises any exception from the threads.
+        list(executor.map(denoise_tile,
+                          image_tiles(image_rows, tile_rows, size)))
+    return denoised
+
+
+#%% Insert Extraction
+def find_insert_component(bright: np.ndarray, min_pixels: float = 0
+                          ) -> Tuple[np.ndarray, int, Tuple[slice, slice]]:
+    """Identify the insert frame among the bright regions of a scan.
+
+    The thresholded scan is labeled into 8-connected regions.  Regions that
+        touch the edge of the scan are the page margin and regions smaller
+        than min_pixels are dust.  The insert frame is the remaining region
+        with the largest bounding box; the others are markings.  If no
+        region remains, the scan may be cropped to the insert, so the
+        largest region that touches some, but not all, of the edges and
+        fills at least CROPPED_INSERT_FILL of its bounding box is used.
+    Args:
+        bright (np.ndarray): A boolean image, True where the scan is above
+            the contour threshold.
+        min_pixels (float, optional): The smallest width and height of an
+            insert frame in pixels. Default is 0.
+    Raises:
+        ValueError: If no region is the size of an insert frame.
+    Returns:
+        labels (np.ndarray): The region number of each pixel.
+        insert_label (int): The region number of the insert frame.
+        insert_box (Tuple[slice, slice]): The row and column extent of the
+            insert frame.
+    """
+    labels, _ = ndimage.label(bright, structure=np.ones((3, 3), dtype=bool))
+    boxes = ndimage.find_objects(labels)
+    image_rows, image_columns = bright.shape
+    inside_areas = dict()
+    cropped_areas = dict()
+    for label, (row_slice, column_slice) in enumerate(boxes, start=1):
+        box_rows = row_slice.stop - row_slice.start
+        box_columns = column_slice.stop - column_slice.start
+        if box_rows < min_pixels or box_columns < min_pixels:
+            continue
+        box_area = box_rows * box_columns
+        edges = (row_slice.start == 0, column_slice.start == 0,
+                 row_slice.stop == image_rows,
+                 column_slice.stop == image_columns)
+        if not any(edges):
+            inside_areas[label] = box_area
+        elif not all(edges):
+            region_area = np.count_nonzero(
+                labels[row_slice, column_slice] == label)
+            if region_area >= CROPPED_INSERT_FILL * box_area:
+                cropped_areas[label] = box_area
+    candidates = inside_areas or cropped_areas
+    if not candidates:
+        raise ValueError('No insert frame was found in the scan')
+    insert_label = max(candidates, key=candidates.get)
+    return labels, insert_label, boxes[insert_label - 1]
+
+
+def trace_insert(denoised: np.ndarray, level: float = CONTOUR_LEVEL,
+                 min_pixels: float = 0) -> np.ndarray:
+    """Trace the outside boundary of the insert frame.
+
+    The image is thresholded and labeled once.  Contours are only traced in
+        the bounding box of the insert frame, after removing the other bright
+        regions.  The outside boundary is the contour spanning the bounding
+        box; any others are openings in the frame.  The box is padded with
+        background where the insert is cut off by the edge of the scan, so
+        that the contour closes along the edge.
+    Args:
+        denoised (np.ndarray): A 2D grayscale image after noise reduction.
+        level (float, optional): The contour threshold.
+        min_pixels (float, optional): The smallest width and height of an
+            insert frame in pixels. Default is 0.
+    Raises:
+        ValueError: If no region is the size of an insert frame.
+    Returns:
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+    """
+    bright = denoised > level
+    labels, insert_label, (row_slice, column_slice) = find_insert_component(
+        bright, min_pixels)
+    image_rows, image_columns = bright.shape
+    # Include one background pixel on each side so that the contour closes.
+    top = row_slice.start - 1
+    bottom = row_slice.stop + 1
+    left = column_slice.start - 1
+    right = column_slice.stop + 1
+    box = (slice(max(top, 0), bottom), slice(max(left, 0), right))
+    padding = ((max(-top, 0), max(bottom - image_rows, 0)),
+               (max(-left, 0), max(right - image_columns, 0)))
+    insert_image = np.pad(np.array(denoised[box]), padding)
+    other_regions = np.pad((labels[box] != insert_label) & bright[box],
+                           padding)
+    insert_image[other_regions] = 0
+    contours = measure.find_contours(insert_image, level)
+    insert_contour = max(contours, key=lambda contour: np.ptp(
+        contour, axis=0).sum())
+    insert_contour = insert_contour + [top, left]
+    return insert_contour
+
+
+#%% Coarse Outline
+def downsample_image(image: np.ndarray, factor: int) -> np.ndarray:
+    """Reduce the image resolution by averaging blocks of pixels.
+
+    Rows and columns that do not fill a complete block are dropped.
+    Args:
+        image (np.ndarray): A 2D grayscale image.
+        factor (int): The size of the square blocks to average.
+    Returns:
+        coarse_image (np.ndarray): The reduced image as float values.
+    """
+    height = (image.shape[0] // factor) * factor
+    width = (image.shape[1] // factor) * factor
+    blocks = image[:height, :width].reshape(
+        height // factor, factor, width // factor, factor)
+    coarse_image = blocks.mean(axis=(1, 3))
+    return coarse_image
+
+
+def find_coarse_outline(cutout_image: np.ndarray, factor: int,
+                        level: float = CONTOUR_LEVEL,
+                        min_pixels: float = 0) -> np.ndarray:
+    """Locate the insert outline on a downsampled copy of the image.
+
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        factor (int): The downsampling factor.
+        level (float, optional): The contour threshold.
+        min_pixels (float, optional): The smallest width and height of an
+            insert frame in full resolution pixels. Default is 0.
+    Returns:
+        coarse_outline (np.ndarray): The row, column coordinates of the
+            insert outline in full resolution pixels.
+    """
+    coarse_image = downsample_image(cutout_image, factor)
+    coarse_size = max(3, int(round(MEDIAN_SIZE / factor)))
+    coarse_denoise = ndimage.median_filter(coarse_image, coarse_size)
+    coarse_outline = trace_insert(coarse_denoise, level, min_pixels / factor)
+    # Coarse pixel centres are in the middle of each block.
+    coarse_outline = coarse_outline * factor + (factor - 1) / 2
+    return coarse_outline
+
+
+#%% Band Refinement
+def outline_band_blocks(outline: np.ndarray, image_shape: Tuple[int, int],
+                        half_width: int,
+                        block_size: int = BAND_BLOCK_SIZE) -> np.ndarray:
+    """Find the image blocks within a distance of an outline.
+
+    Args:
+        outline (np.ndarray): Row, column coordinates of the outline in
+            pixels.  Consecutive points must be less than block_size apart.
+        image_shape (Tuple[int, int]): The number of rows and columns in the
+            image.
+        half_width (int): The distance in pixels either side of the outline
+            to include.
+        block_size (int, optional): The size of the square blocks.
+    Returns:
+        band_blocks (np.ndarray): A boolean grid with one value per block,
+            True for blocks in the band.
+    """
+    grid_shape = (-(-image_shape[0] // block_size),
+                  -(-image_shape[1] // block_size))
+    band_blocks = np.zeros(grid_shape, dtype=bool)
+    block_index = np.floor(outline / block_size).astype(int)
+    block_index = np.clip(block_index, 0, np.array(grid_shape) - 1)
+    band_blocks[block_index[:, 0], block_index[:, 1]] = True
+    iterations = -(-half_width // block_size)
+    band_blocks = ndimage.binary_dilation(
+        band_blocks, structure=np.ones((3, 3), dtype=bool),
+        iterations=iterations)
+    return band_blocks
+
+
+def band_runs(band_blocks: np.ndarray) -> Iterator[Tuple[int, int, int]]:
+    """Group the band blocks into horizontal runs.
+
+    Args:
+        band_blocks (np.ndarray): A boolean grid with one value per block.
+    Yields:
+        Tuple[int, int, int]: The block row and the first and last block
+            columns of each run of consecutive band blocks.
+    """
+    for row, block_row in enumerate(band_blocks):
+        columns = np.flatnonzero(block_row)
+        if len(columns) == 0:
+            continue
+        breaks = np.flatnonzero(np.diff(columns) > 1)
+        for first, last in zip(np.r_[0, breaks + 1], np.r_[breaks, -1]):
+            yield row, columns[first], columns[last]
+
+
+def closest_contour(contours: List[np.ndarray],
+                    outline: np.ndarray) -> np.ndarray:
+    """Select the contour with extents closest to those of an outline.
+
+    Args:
+        contours (List[np.ndarray]): Row, column contours to select from.
+        outline (np.ndarray): The row, column coordinates of the approximate
+            outline.
+    Returns:
+        contour (np.ndarray): The contour closest in size and position to
+            outline.
+    """
+    extent = np.r_[outline.min(axis=0), outline.max(axis=0)]
+    differences = [np.abs(np.r_[contour.min(axis=0), contour.max(axis=0)]
+                          - extent).sum()
+                   for contour in contours]
+    return contours[int(np.argmin(differences))]
+
+
+def refine_outline(cutout_image: np.ndarray, coarse_outline: np.ndarray,
+                   half_width: int, level: float = CONTOUR_LEVEL,
+                   block_size: int = BAND_BLOCK_SIZE,
+                   denoise: str = DEFAULT_DENOISE,
+                   workers: int = None) -> np.ndarray:
+    """Recalculate the outline at full resolution near the coarse outline.
+
+    The median filter is only applied to the blocks within half_width of the
+        coarse outline.  Outside of those blocks each block is set to black
+        or white according to its mean value.  Any edges this creates are
+        away from the outline and form separate contours.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        coarse_outline (np.ndarray): The row, column coordinates of the
+            approximate outline in full resolution pixels.
+        half_width (int): The distance in pixels either side of the coarse
+            outline to refine.
+        level (float, optional): The contour threshold.
+        block_size (int, optional): The size of the refinement blocks.
+        denoise (str, optional): The name of the denoise backend.
+        workers (int, optional): The number of threads used to denoise the
+            band. Default is the number of CPU cores.
+    Returns:
+        insert_contour (np.ndarray): The row, column coordinates of the
+            refined outline in full resolution pixels.
+    """
+    image_rows, image_columns = cutout_image.shape
+    band_blocks = outline_band_blocks(coarse_outline, cutout_image.shape,
+                                      half_width, block_size)
+    # Fill with the thresholded block means.
+    block_means = downsample_image(
+        np.pad(cutout_image,
+               ((0, band_blocks.shape[0] * block_size - image_rows),
+                (0, band_blocks.shape[1] * block_size - image_columns)),
+               mode='edge'),
+        block_size)
+    block_fill = np.where(block_means < level, 0, 255).astype(
+        cutout_image.dtype)
+    refined = np.repeat(np.repeat(block_fill, block_size, axis=0),
+                        block_size, axis=1)[:image_rows, :image_columns]
+    before, after = filter_halo(MEDIAN_SIZE)
+
+    def denoise_run(run: Tuple[int, int, int]):
+        row, first, last = run
+        top = row * block_size
+        left = first * block_size
+        bottom = min(top + block_size, image_rows)
+        right = min((last + 1) * block_size, image_columns)
+        pad_top = max(top - before, 0)
+        pad_left = max(left - before, 0)
+        run_denoise = denoise_image(
+            cutout_image[pad_top:min(bottom + after, image_rows),
+                         pad_left:min(right + after, image_columns)],
+            denoise)
+        refined[top:bottom, left:right] = run_denoise[
+            top - pad_top:bottom - pad_top, left - pad_left:right - pad_left]
+
+    if workers is None:
+        workers = default_workers()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(denoise_run, band_runs(band_blocks)))
+    # Only search the bounding box of the band.
+    block_rows, block_columns = np.nonzero(band_blocks)
+    top = block_rows.min() * block_size
+    left = block_columns.min() * block_size
+    bottom = (block_rows.max() + 1) * block_size
+    right = (block_columns.max() + 1) * block_size
+    # Pad with background so that an insert cut off by the edge of the scan
+    # still has a closed contour.
+    top -= 1
+    left -= 1
+    search_image = np.pad(refined[top + 1:bottom, left + 1:right], 1)
+    contours = measure.find_contours(search_image, level)
+    insert_contour = closest_contour(contours,
+                                     coarse_outline - [top, left])
+    insert_contour = insert_contour + [top, left]
+    return insert_contour
+
+
+def find_outline_pyramid(cutout_image: np.ndarray, dpi: np.ndarray,
+                         denoise: str = DEFAULT_DENOISE,
+                         workers: int = None) -> np.ndarray:
+    """Identify the insert outline using a coarse-to-fine search.
+
+    The outline is located on a downsampled image and then refined at full
+        resolution in a narrow band around the coarse outline.  The result is
+        within PYRAMID_TOLERANCE of the full resolution search.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        dpi (np.ndarray): The resolution of the image in dots per inch.
+        denoise (str, optional): The name of the full resolution denoise
+            backend.
+        workers (int, optional): The number of threads used to denoise the
+            band. Default is the number of CPU cores.
+    Returns:
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+    """
+    factor = max(1, int(np.min(dpi) // PYRAMID_DPI))
+    min_pixels = MIN_INSERT_SIZE * np.min(dpi)
+    coarse_outline = find_coarse_outline(cutout_image, factor,
+                                         min_pixels=min_pixels)
+    if factor == 1:
+        half_width = MEDIAN_SIZE
+    else:
+        half_width = BAND_MARGIN * factor + MEDIAN_SIZE
+    insert_contour = refine_outline(cutout_image, coarse_outline, half_width,
+                                    denoise=denoise, workers=workers)
+    return insert_contour
+
+
+#%% Strip Processing
+def read_rows(scan: np.ndarray, first: int, last: int) -> np.ndarray:
+    """Copy a range of rows from a scan.
+
+    If the scan is memory mapped, only the requested rows are mapped, and
+        they are unmapped again once copied.  Rows read through the full
+        memory map would stay resident until the whole map is released.
+    Args:
+        scan (np.ndarray): The scan pixels, possibly a memory map.
+        first (int): The first row to copy.
+        last (int): One past the last row to copy.
+    Returns:
+        rows (np.ndarray): A copy of scan[first:last].
+    """
+    mapped = scan if isinstance(scan, np.memmap) else scan.base
+    is_mapped_file = (isinstance(mapped, np.memmap) and
+                      mapped.filename is not None and
+                      mapped.shape == scan.shape and
+                      mapped.flags.c_contiguous)
+    if not is_mapped_file:
+        return np.array(scan[first:last])
+    rows = np.memmap(mapped.filename, dtype=mapped.dtype, mode='r',
+                     offset=mapped.offset + first * mapped.strides[0],
+                     shape=(last - first,) + mapped.shape[1:])
+    return np.array(rows)
+
+
+def find_outline_strips(scan: np.ndarray, dpi: np.ndarray,
+                        denoise: str = DEFAULT_DENOISE, workers: int = None,
+                        strip_rows: int = STRIP_ROWS,
+                        output: np.ndarray = None
+                        ) -> Tuple[np.ndarray, np.ndarray]:
+    """Identify the insert outline while holding only a few strips in memory.
+
+    The scan is read in strips of rows, with a halo for the median filter.
+        Each strip is converted to grayscale, denoised and written into a
+        preallocated output, by default a temporary file.  Block means of
+        each denoised strip are collected into a coarse image, which is
+        thresholded to locate the insert.  The outline is then traced at full
+        resolution in the insert's bounding box only.  The memory used is
+        a few strips plus the insert's bounding box, rather than the whole
+        scan.  The result is identical to the full resolution search.
+    Args:
+        scan (np.ndarray): The scan pixels, such as a memory map from
+            open_scan.  Colour pixels are converted to grayscale.
+        dpi (np.ndarray): The resolution of the image in dots per inch.
+        denoise (str, optional): The name of the denoise backend.
+        workers (int, optional): The number of strips processed at the same
+            time. Default is the number of CPU cores.
+        strip_rows (int, optional): The number of rows in each strip.
+            Default is STRIP_ROWS.
+        output (np.ndarray, optional): A uint8 array with the same rows and
+            columns as scan to receive the denoised image.
+    Returns:
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+        denoised (np.ndarray): The median filtered image; output if given,
+            otherwise a read-only memory map of the temporary file.
+    """
+    image_rows, image_columns = scan.shape[:2]
+    output_file = None
+    if output is None:
+        output_file = tempfile.TemporaryFile()
+        output_file.truncate(image_rows * image_columns)
+        write_lock = threading.Lock()
+    if workers is None:
+        workers = default_workers()
+    factor = max(1, int(np.min(dpi) // PYRAMID_DPI))
+    # Strips are a whole number of coarse blocks so the block means align.
+    strip_rows = max(factor, strip_rows // factor * factor)
+
+    def denoise_strip(strip: Tuple[int, int, int, int]) -> np.ndarray:
+        top, bottom, pad_top, pad_bottom = strip
+        strip_image = grayscale(read_rows(scan, pad_top, pad_bottom))
+        strip_denoise = denoise_image(strip_image, denoise)
+        strip_denoise = np.ascontiguousarray(
+            strip_denoise[top - pad_top:bottom - pad_top])
+        if output_file is None:
+            output[top:bottom] = strip_denoise
+        else:
+            with write_lock:
+                output_file.seek(top * image_columns)
+                output_file.write(strip_denoise.tobytes())
+        return downsample_image(strip_denoise, factor)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        coarse_strips = list(executor.map(
+            denoise_strip, image_tiles(image_rows, strip_rows, MEDIAN_SIZE)))
+    coarse_image = np.vstack(coarse_strips)
+    min_pixels = MIN_INSERT_SIZE * np.min(dpi)
+    coarse_outline = trace_insert(coarse_image, min_pixels=min_pixels / factor)
+    coarse_outline = coarse_outline * factor + (factor - 1) / 2
+    # Trace the full resolution outline in the insert's bounding box.
+    margin = BAND_MARGIN * factor + MEDIAN_SIZE
+    top, left = np.maximum(
+        np.floor(coarse_outline.min(axis=0)).astype(int) - margin, 0)
+    bottom, right = np.minimum(
+        np.ceil(coarse_outline.max(axis=0)).astype(int) + margin + 1,
+        [image_rows, image_columns])
+    if output_file is None:
+        insert_image = read_rows(output, top, bottom)[:, left:right]
+    else:
+        output_file.seek(top * image_columns)
+        insert_rows = np.frombuffer(
+            output_file.read((bottom - top) * image_columns), dtype=np.uint8)
+        insert_image = insert_rows.reshape(bottom - top, image_columns)[
+            :, left:right]
+        output = np.memmap(output_file, dtype=np.uint8, mode='r',
+                           shape=(image_rows, image_columns))
+    insert_contour = trace_insert(insert_image, min_pixels=min_pixels)
+    insert_contour = insert_contour + [top, left]
+    return insert_contour, output
+
+
+#%% Outline Detection
+def find_insert_contour(cutout_image: np.ndarray, dpi: np.ndarray,
+                        pyramid: bool = False,
+                        denoise: str = DEFAULT_DENOISE,
+                        workers: int = None, strips: bool = False,
+                        template: bool = False
+                        ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Locate the insert outline in a scan.
+
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image, or any scan from
+            open_scan if strips is True.
+        dpi (np.ndarray): The resolution of the image in dots per inch.
+        pyramid (bool, optional): Use the coarse-to-fine search.  Default is
+            False.  Ignored if strips is True.
+        denoise (str, optional): The name of the denoise backend.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+        strips (bool, optional): Process the scan in strips of rows, to
+            limit the memory used for large scans.  Default is False.
+        template (bool, optional): Locate the insert frame by template
+            matching and only search the region around it.  This is faster
+            than the full-image search on large scans, but not faster than
+            the pyramid search, and the region is only sized for the
+            MEASURED_FRAME_SIZES, so it is not used by default.  Default is
+            False.  Ignored if strips is True.
+    Returns:
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+        denoised (np.ndarray): The median filtered image.  None for the
+            pyramid and template searches, which only filter part of the
+            image.
+    """
+    if template and not strips:
+        insert_contour = find_outline_template(cutout_image, dpi, pyramid,
+                                               denoise, workers)
+        return insert_contour, None
+    if strips:
+        return find_outline_strips(cutout_image, dpi, denoise, workers)
+    if pyramid:
+        insert_contour = find_outline_pyramid(cutout_image, dpi, denoise,
+                                              workers)
+        return insert_contour, None
+    denoised = denoise_tiled(cutout_image, denoise, workers=workers)
+    insert_contour = trace_insert(denoised,
+                                  min_pixels=MIN_INSERT_SIZE * np.min(dpi))
+    return insert_contour, denoised
+
+
+#%% Aperture Extraction
+def trace_aperture(denoised: np.ndarray,
+                   level: float = CONTOUR_LEVEL) -> np.ndarray:
+    """Trace the edge of the aperture cut through the insert.
+
+    The aperture is the largest dark region enclosed by the insert; dark
+        regions that touch the edge of the image are outside of the insert.
+        Dark regions are 4-connected, so that they cannot leak through the
+        corners of the 8-connected bright regions.
+    Args:
+        denoised (np.ndarray): A 2D grayscale image of the insert after
+            noise reduction.
+        level (float, optional): The contour threshold.
+    Raises:
+        ValueError: If there is no dark region enclosed by the insert.
+    Returns:
+        aperture_contour (np.ndarray): The row, column coordinates of the
+            aperture edge in pixels.
+    """
+    dark = denoised <= level
+    labels, _ = ndimage.label(dark)
+    edge_labels = np.unique(np.concatenate([labels[0], labels[-1],
+                                            labels[:, 0], labels[:, -1]]))
+    region_sizes = np.bincount(labels.ravel())
+    region_sizes[0] = 0
+    region_sizes[edge_labels] = 0
+    aperture_label = int(np.argmax(region_sizes))
+    if region_sizes[aperture_label] == 0:
+        raise ValueError('No aperture was found in the insert')
+    row_slice, column_slice = ndimage.find_objects(labels)[
+        aperture_label - 1]
+    # The aperture does not touch the image edge, so a one pixel border of
+    # the insert is always available.
+    top = row_slice.start - 1
+    bottom = row_slice.stop + 1
+    left = column_slice.start - 1
+    right = column_slice.stop + 1
+    aperture_image = np.array(denoised[top:bottom, left:right])
+    other_regions = labels[top:bottom, left:right] != aperture_label
+    other_regions &= dark[top:bottom, left:right]
+    aperture_image[other_regions] = np.iinfo(np.uint8).max
+    contours = measure.find_contours(aperture_image, level)
+    aperture_contour = max(contours, key=lambda contour: np.ptp(
+        contour, axis=0).sum())
+    aperture_contour = aperture_contour + [top, left]
+    return aperture_contour
+
+
+def find_aperture_contour(cutout_image: np.ndarray,
+                          insert_contour: np.ndarray,
+                          denoised: np.ndarray = None,
+                          denoise: str = DEFAULT_DENOISE,
+                          workers: int = None) -> np.ndarray:
+    """Locate the aperture edge within a located insert.
+
+    Only the bounding box of the insert is searched.  If the denoised image
+        is not available, for example after the pyramid search, the box is
+        filtered with enough surrounding pixels to give the same values as
+        filtering the whole image.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+        denoised (np.ndarray, optional): The median filtered image, if
+            available.
+        denoise (str, optional): The name of the denoise backend.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+    Raises:
+        ValueError: If there is no dark region enclosed by the insert.
+    Returns:
+        aperture_contour (np.ndarray): The row, column coordinates of the
+            aperture edge in pixels.
+    """
+    # The outline of an insert cut off by the edge of the scan runs just
+    # outside of the image.
+    top, left = np.maximum(np.floor(insert_contour.min(axis=0)).astype(int),
+                           0)
+    bottom, right = np.ceil(insert_contour.max(axis=0)).astype(int) + 1
+    if denoised is not None:
+        insert_image = np.asarray(denoised[top:bottom, left:right])
+    else:
+        halo = MEDIAN_SIZE
+        padded_top = max(0, top - halo)
+        padded_left = max(0, left - halo)
+        padded_image = np.asarray(cutout_image[
+            padded_top:bottom + halo, padded_left:right + halo])
+        padded_denoised = denoise_tiled(padded_image, denoise,
+                                        workers=workers)
+        insert_image = padded_denoised[top - padded_top:bottom - padded_top,
+                                       left - padded_left:
+                                       right - padded_left]
+    aperture_contour = trace_aperture(insert_image)
+    return aperture_contour + [top, left]
+
+
+#%% Encoder Strip
+def encoder_axes(rotation: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Unit vectors along and down the encoder strip.
+
+    Args:
+        rotation (float): The skew of the insert in degrees, as found by
+            estimate_skew.
+    Returns:
+        along (np.ndarray): The row, column direction along the strip.
+        down (np.ndarray): The row, column direction into the insert.
+    """
+    angle = np.radians(rotation)
+    down = np.array([np.cos(angle), np.sin(angle)])
+    along = np.array([-np.sin(angle), np.cos(angle)])
+    return along, down
+
+
+def has_encoder_strip(insert_outline: np.ndarray,
+                      rotation: float = 0.0) -> bool:
+    """Check whether the insert outline includes the encoder strip.
+
+    The top of an outline that includes the strip is the width of one of
+        the ENCODER_VARIANTS, and much narrower than the frame.  The strip is
+        not included when it is separated from the frame on the scan, or
+        cropped off.
+    Args:
+        insert_outline (np.ndarray): x,y coordinates of the insert outline in
+            inches, where x is the distance down the scan.
+        rotation (float, optional): The skew of the insert in degrees, as
+            found by estimate_skew. Default is 0.
+    Returns:
+        strip_found (bool): True if the top of the outline is the encoder
+            strip.
+    """
+    along, down = encoder_axes(rotation)
+    along_distance = insert_outline @ along
+    down_distance = insert_outline @ down
+    in_top = down_distance < down_distance.min() + ENCODER_HEIGHT / 2
+    top_width = np.ptp(along_distance[in_top])
+    strip_widths = np.array([strip_width for strip_width, _, _
+                             in ENCODER_VARIANTS.values()])
+    is_strip_width = np.any(np.abs(top_width - strip_widths) <=
+                            ENCODER_WIDTH_TOLERANCE * strip_widths)
+    is_narrow = top_width < ENCODER_WIDTH_RATIO * np.ptp(along_distance)
+    return bool(is_strip_width and is_narrow)
+
+
+def top_edge_offset(insert_outline: np.ndarray,
+                    rotation: float = 0.0) -> float:
+    """The distance from the top of the insert outline to its top edge.
+
+    The top edge, of the frame or of the encoder strip, is where the outline
+        first widens to TOP_EDGE_FRACTION of its full width.  Anything
+        narrower above it is dust touching the insert, or the seam left by a
+        strip that is not attached to the frame.
+    Args:
+        insert_outline (np.ndarray): x,y coordinates of the insert outline in
+            inches, where x is the distance down the scan.
+        rotation (float, optional): The skew of the insert in degrees, as
+            found by estimate_skew. Default is 0.
+    Returns:
+        offset (float): The distance in inches.
+    """
+    along, down = encoder_axes(rotation)
+    down_distance = insert_outline @ down
+    order = np.argsort(down_distance)
+    down_distance = down_distance[order]
+    along_distance = (insert_outline @ along)[order]
+    # The width of the outline above each point, from the top down.
+    widths = (np.maximum.accumulate(along_distance) -
+              np.minimum.accumulate(along_distance))
+    top_edge = np.argmax(widths >= TOP_EDGE_FRACTION * widths[-1])
+    return float(down_distance[top_edge] - down_distance[0])
+
+
+def sample_strip(image: np.ndarray, along_positions: np.ndarray,
+                 down_positions: np.ndarray, along: np.ndarray,
+                 down: np.ndarray) -> np.ndarray:
+    """Sample the image on a grid aligned with the encoder strip.
+
+    Args:
+        image (np.ndarray): A 2D grayscale image.
+        along_positions (np.ndarray): The distances along the strip in
+            pixels, of any shape.
+        down_positions (np.ndarray): The distances down the strip in pixels,
+            broadcastable with along_positions.
+        along (np.ndarray): The row, column direction along the strip.
+        down (np.ndarray): The row, column direction into the insert.
+    Returns:
+        samples (np.ndarray): The interpolated image values.
+    """
+    along_positions, down_positions = np.broadcast_arrays(along_positions,
+                                                          down_positions)
+    rows = along_positions * along[0] + down_positions * down[0]
+    columns = along_positions * along[1] + down_positions * down[1]
+    samples = ndimage.map_coordinates(np.asarray(image, dtype=np.float32),
+                                      [rows, columns], order=1,
+                                      mode='nearest')
+    return samples
+
+
+def decode_encoder(cutout_image: np.ndarray, insert_contour: np.ndarray,
+                   dpi: np.ndarray, rotation: float = 0.0,
+                   level: float = CONTOUR_LEVEL) -> Tuple[str, int]:
+    """Read the insert code from the holes in the encoder strip.
+
+    The strip variant is identified from its width.  The image is sampled
+        on a grid aligned with the strip, so all of the holes are measured
+        together.  The hole row is the darkest row of the sampled band near
+        the nominal hole depth, and a hole is open if its centre is darker
+        than the contour threshold.  Open hole n adds 2**n to the code.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+        dpi (np.ndarray): The resolution of the image in dots per inch.
+        rotation (float, optional): The skew of the insert in degrees, as
+            found by estimate_skew. Default is 0.
+        level (float, optional): The contour threshold.
+    Raises:
+        ValueError: If the top of the insert is not the width of an encoder
+            strip, or the first hole, which is always plugged, reads as
+            open.
+    Returns:
+        variant (str): The encoder variant, one of ENCODER_VARIANTS.
+        insert_code (int): The code read from the holes.
+    """
+    pixel_size = float(np.mean(dpi))
+    along, down = encoder_axes(rotation)
+    along_distance = insert_contour @ along
+    down_distance = insert_contour @ down
+    strip_top = down_distance.min()
+    in_strip = down_distance < strip_top + ENCODER_HEIGHT * pixel_size / 2
+    strip_left = along_distance[in_strip].min()
+    strip_width = (along_distance[in_strip].max() - strip_left) / pixel_size
+    variant = min(ENCODER_VARIANTS, key=lambda name: abs(
+        ENCODER_VARIANTS[name][0] - strip_width))
+    nominal_width, first_hole, hole_count = ENCODER_VARIANTS[variant]
+    if abs(strip_width - nominal_width) > (ENCODER_WIDTH_TOLERANCE *
+                                           nominal_width):
+        raise ValueError('No encoder strip was found on the insert')
+    hole_centres = (strip_left + (first_hole + ENCODER_HOLE_PITCH *
+                                  np.arange(hole_count)) * pixel_size)
+    # Sample a patch in each hole position for each row of the strip.
+    half_patch = ENCODER_PATCH * pixel_size / 2
+    patch_offsets = np.linspace(-half_patch, half_patch, 5)
+    band_rows = strip_top + np.arange(
+        int(ENCODER_HEIGHT * pixel_size) + 1, dtype=float)
+    samples = sample_strip(
+        cutout_image,
+        hole_centres[np.newaxis, :, np.newaxis] +
+        patch_offsets[np.newaxis, np.newaxis, :],
+        band_rows[:, np.newaxis, np.newaxis], along, down)
+    # Average over each patch row by row, then over the patch height.
+    patch_rows = int(round(half_patch))
+    row_means = ndimage.uniform_filter1d(samples.mean(axis=2),
+                                         2 * patch_rows + 1, axis=0)
+    # The hole row is the darkest on average within ENCODER_HOLE_SEARCH of
+    # the nominal depth, so that markings on the strip are not mistaken for
+    # holes.  Use the nominal hole row unless some holes are open.
+    nominal_row = int(round(ENCODER_HOLE_DEPTH * pixel_size))
+    search_rows = int(round(ENCODER_HOLE_SEARCH * pixel_size))
+    search = slice(max(nominal_row - search_rows, patch_rows),
+                   min(nominal_row + search_rows + 1,
+                       len(band_rows) - patch_rows))
+    hole_row = search.start + int(np.argmin(
+        row_means[search].mean(axis=1)))
+    if row_means[hole_row].min() > level:
+        hole_row = nominal_row
+    open_holes = row_means[hole_row] <= level
+    if open_holes[0]:
+        raise ValueError('The encoder strip could not be read; '
+                         'the first hole is not plugged')
+    insert_code = int(np.sum(open_holes * 2 ** np.arange(hole_count)))
+    return variant, insert_code
+
+
+#%% Applicator Templates
+class FrameMatch(NamedTuple):
+    """The applicator frame template that best matches a scan.
+
+    Attributes:
+        applicator_size (int): The applicator size in cm.
+        rotation (float): The rotation of the frame in degrees, clockwise on
+            the scan.
+        centre (np.ndarray): The row, column position of the frame centre
+            in inches.
+        score (float): The fraction of the template matched, at most 1.
+    """
+    applicator_size: int
+    rotation: float
+    centre: np.ndarray
+    score: float
+
+
+def frame_template(frame_size: float, rotation: float, template_dpi: float,
+                   template_width: int) -> np.ndarray:
+    """Build a matching template for an insert frame.
+
+    The frame is a square with a weight of 1, surrounded by a border with
+        a negative weight, so that the template sums to zero.  A uniform
+        region scores 0, and a frame of the wrong size scores less than one
+        of the right size.
+    Args:
+        frame_size (float): The outer width of the frame in inches.
+        rotation (float): The clockwise rotation of the frame in degrees.
+        template_dpi (float): The resolution of the template in dots per
+            inch.
+        template_width (int): The number of rows and columns in the
+            template.  Must be odd, so that the frame centre is a pixel.
+    Returns:
+        template (np.ndarray): The template weights.
+    """
+    half_width = template_width // 2
+    rows, columns = np.mgrid[-half_width:half_width + 1,
+                             -half_width:half_width + 1] / template_dpi
+    angle = np.radians(rotation)
+    along = columns * np.cos(angle) + rows * np.sin(angle)
+    down = rows * np.cos(angle) - columns * np.sin(angle)
+    distance = np.maximum(np.abs(along), np.abs(down))
+    frame = distance <= frame_size / 2
+    border = (distance <= frame_size / 2 + TEMPLATE_MARGIN) & ~frame
+    template = frame.astype(float)
+    template[border] = -frame.sum() / border.sum()
+    return template
+
+
+@lru_cache(maxsize=128)
+def template_spectrum(applicator_size: int, rotation: float,
+                      template_dpi: float, template_width: int,
+                      fft_shape: Tuple[int, int]) -> np.ndarray:
+    """The Fourier transform of a flipped frame template.
+
+    The transforms are cached, so scans of the same resolution and size
+        only transform the templates once.
+    Args:
+        applicator_size (int): The applicator size in cm.
+        rotation (float): The clockwise rotation of the frame in degrees.
+        template_dpi (float): The resolution of the template in dots per
+            inch.
+        template_width (int): The number of rows and columns in the
+            template.
+        fft_shape (Tuple[int, int]): The padded shape of the transform.
+    Returns:
+        spectrum (np.ndarray): The real FFT of the flipped template.
+    """
+    template = frame_template(FRAME_SIZES[applicator_size], rotation,
+                              template_dpi, template_width)
+    return fft.rfft2(template[::-1, ::-1], s=fft_shape)
+
+
+def match_applicator_frame(cutout_image: np.ndarray, dpi: np.ndarray,
+                           level: float = CONTOUR_LEVEL,
+                           applicator_sizes: Tuple[int] = None
+                           ) -> FrameMatch:
+    """Locate the insert frame by FFT cross-correlation with templates.
+
+    The scan is downsampled to about TEMPLATE_DPI and thresholded.  Its
+        transform is multiplied by the cached transform of every applicator
+        size and rotation template, giving the position, rotation and size
+        of the best match in one pass.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        dpi (np.ndarray): The (x, y) resolution of the image in dots per
+            inch.
+        level (float, optional): The contour threshold.
+        applicator_sizes (Tuple[int], optional): The applicator sizes to
+            test. Default is every size in FRAME_SIZES.
+    Returns:
+        frame_match (FrameMatch): The best matching template.
+    """
+    if applicator_sizes is None:
+        applicator_sizes = tuple(FRAME_SIZES)
+    factor = max(1, int(np.min(dpi) // TEMPLATE_DPI))
+    template_dpi = float(np.min(dpi)) / factor
+    coarse_image = ndimage.median_filter(
+        downsample_image(cutout_image, factor), 3)
+    bright = (coarse_image > level).astype(np.float32)
+    # All templates are the same size, so the scan is transformed once.
+    largest = max(FRAME_SIZES[size] for size in applicator_sizes) + (
+        2 * TEMPLATE_MARGIN)
+    template_width = 2 * int(np.ceil(largest * np.sqrt(2) *
+                                     template_dpi / 2)) + 1
+    fft_shape = tuple(fft.next_fast_len(size + template_width - 1, True)
+                      for size in bright.shape)
+    scan_spectrum = fft.rfft2(bright, s=fft_shape)
+    best = None
+    # The peak is a row, column position; dpi is (x, y).
+    pixel_dpi = np.asarray(dpi, dtype=float)[::-1]
+    for applicator_size in applicator_sizes:
+        frame_pixels = np.count_nonzero(frame_template(
+            FRAME_SIZES[applicator_size], 0, template_dpi, template_width) > 0)
+        for rotation in TEMPLATE_ROTATIONS:
+            spectrum = template_spectrum(applicator_size, rotation,
+                                         template_dpi, template_width,
+                                         fft_shape)
+            correlation = fft.irfft2(scan_spectrum * spectrum, s=fft_shape)
+            peak = np.unravel_index(np.argmax(correlation),
+                                    correlation.shape)
+            score = correlation[peak] / frame_pixels
+            if best is None or score > best.score:
+                # The full correlation is offset by half of the template.
+                centre = ((np.array(peak) - template_width // 2 + 0.5) *
+                          factor / pixel_dpi)
+                best = FrameMatch(applicator_size=applicator_size,
+                                  rotation=float(rotation), centre=centre,
+                                  score=float(score))
+    return best
+
+
+def find_outline_template(cutout_image: np.ndarray, dpi: np.ndarray,
+                          pyramid: bool = False,
+                          denoise: str = DEFAULT_DENOISE,
+                          workers: int = None) -> np.ndarray:
+    """Identify the insert outline near the best matching frame template.
+
+    Only the region around the matched frame, including the encoder strip,
+        is searched for the outline.  The region is sized from the frame
+        width, so if the best match is a frame whose width is only estimated
+        the whole image is searched instead.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        dpi (np.ndarray): The resolution of the image in dots per inch.
+        pyramid (bool, optional): Use the coarse-to-fine search within the
+            region. Default is False.
+        denoise (str, optional): The name of the denoise backend.
+        workers (int, optional): The number of threads used for the median
+            filter. Default is the number of CPU cores.
+    Returns:
+        insert_contour (np.ndarray): The row, column coordinates of the
+            insert outline in pixels.
+    """
+    frame_match = match_applicator_frame(cutout_image, dpi)
+    if frame_match.applicator_size not in MEASURED_FRAME_SIZES:
+        insert_contour, _ = find_insert_contour(cutout_image, dpi, pyramid,
+                                                denoise, workers)
+        return insert_contour
+    # Half of the rotated frame's extent, plus the encoder strip above it.
+    half_size = (FRAME_SIZES[frame_match.applicator_size] / 2 * np.sqrt(2) +
+                 ENCODER_HEIGHT + REGION_MARGIN)
+    # The region is in rows, columns; dpi is (x, y).
+    pixel_dpi = np.asarray(dpi, dtype=float)[::-1]
+    region = list()
+    for axis in range(2):
+        centre = frame_match.centre[axis] * pixel_dpi[axis]
+        margin = half_size * pixel_dpi[axis]
+        start = max(0, int(centre - margin))
+        stop = min(cutout_image.shape[axis], int(np.ceil(centre + margin)))
+        region.append(slice(start, stop))
+    region_image = np.asarray(cutout_image[tuple(region)])
+    insert_contour, _ = find_insert_contour(region_image, dpi, pyramid,
+                                            denoise, workers)
+    return insert_contour + [region[0].start, region[1].start]
+
+
+#%% Multiple Inserts
+def find_insert_boxes(bright: np.ndarray,
+                      min_pixels: float) -> List[Tuple[slice, slice]]:
+    """Identify every insert frame among the bright regions of a scan.
+
+    Regions that touch the edge of the scan are the page margin, regions
+        smaller than min_pixels are dust and regions inside another frame's
+        bounding box are markings on that insert.
+    Args:
+        bright (np.ndarray): A boolean image, True where the scan is above
+            the contour threshold.
+        min_pixels (float): The smallest width and height of an insert frame
+            in pixels.
+    Returns:
+        insert_boxes (List[Tuple[slice, slice]]): The row and column extent
+            of each insert frame, ordered top to bottom and then left to
+            right.
+    """
+    labels, _ = ndimage.label(bright, structure=np.ones((3, 3), dtype=bool))
+    image_rows, image_columns = bright.shape
+    candidates = list()
+    for row_slice, column_slice in ndimage.find_objects(labels):
+        is_page = (row_slice.start == 0 or column_slice.start == 0 or
+                   row_slice.stop == image_rows or
+                   column_slice.stop == image_columns)
+        is_dust = (row_slice.stop - row_slice.start < min_pixels or
+                   column_slice.stop - column_slice.start < min_pixels)
+        if not (is_page or is_dust):
+            candidates.append((row_slice, column_slice))
+
+    def is_inside(box, other):
+        return all(outer.start <= inner.start and inner.stop <= outer.stop
+                   for inner, outer in zip(box, other))
+
+    insert_boxes = [box for box in candidates
+                    if not any(is_inside(box, other)
+                               for other in candidates if other is not box)]
+    insert_boxes.sort(key=lambda box: (box[0].start, box[1].start))
+    return insert_boxes
+
+
+def find_insert_regions(cutout_image: np.ndarray, dpi: np.ndarray,
+                        level: float = CONTOUR_LEVEL
+                        ) -> List[Tuple[slice, slice]]:
+    """Divide a scan holding several inserts into one region per insert.
+
+    The insert frames are located on a downsampled copy of the scan.  Each
+        region is the frame's bounding box plus REGION_MARGIN of background,
+        so it can be analyzed as a scan of a single insert.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        dpi (np.ndarray): The (x, y) resolution of the image in dots per
+            inch.
+        level (float, optional): The contour threshold.
+    Raises:
+        ValueError: If no insert frame is found in the scan.
+    Returns:
+        insert_regions (List[Tuple[slice, slice]]): The full resolution row
+            and column extent of each insert region, ordered top to bottom
+            and then left to right.
+    """
+    factor = max(1, int(np.min(dpi) // PYRAMID_DPI))
+    coarse_image = downsample_image(cutout_image, factor)
+    coarse_size = max(3, int(round(MEDIAN_SIZE / factor)))
+    coarse_denoise = ndimage.median_filter(coarse_image, coarse_size)
+    min_pixels = MIN_INSERT_SIZE * np.min(dpi) / factor
+    insert_boxes = find_insert_boxes(coarse_denoise > level, min_pixels)
+    if not insert_boxes:
+        raise ValueError('No insert frame was found in the scan')
+    # The boxes are in rows, columns; dpi is (x, y).
+    pixel_dpi = np.asarray(dpi, dtype=float)[::-1]
+    insert_regions = list()
+    for box in insert_boxes:
+        region = list()
+        for axis, coarse_slice in enumerate(box):
+            margin = int(np.ceil(REGION_MARGIN * pixel_dpi[axis]))
+            start = max(0, coarse_slice.start * factor - margin)
+            stop = min(cutout_image.shape[axis],
+                       coarse_slice.stop * factor + margin)
+            region.append(slice(start, stop))
+        insert_regions.append(tuple(region))
+    return insert_regions
+
+
+def find_insert_contours(cutout_image: np.ndarray, dpi: np.ndarray,
+                         pyramid: bool = False,
+                         denoise: str = DEFAULT_DENOISE,
+                         workers: int = None) -> List[np.ndarray]:
+    """Locate the outline of every insert on a scan holding several inserts.
+
+    Each insert region is analyzed independently on its own thread, using a
+        single thread for its median filter.
+    Args:
+        cutout_image (np.ndarray): A 2D grayscale image.
+        dpi (np.ndarray): The resolution of the image in dots per inch.
+        pyramid (bool, optional): Use the coarse-to-fine search.  Default is
+            False.
+        denoise (str, optional): The name of the denoise backend.
+        workers (int, optional): The number of inserts analyzed at once.
+            Default is the number of CPU cores.
+    Raises:
+        ValueError: If no insert frame is found in the scan.
+    Returns:
+        insert_contours (List[np.ndarray]): The row, column coordinates of
+            each insert outline in pixels of the full scan, ordered top to
+            bottom and then left to right.
+    """
+    if workers is None:
+        workers = default_workers()
+    insert_regions = find_insert_regions(cutout_image, dpi)
+
+    def region_contour(region: Tuple[slice, slice]) -> np.ndarray:
+        region_image = np.asarray(cutout_image[region])
+        insert_contour, _ = find_insert_contour(region_image, dpi, pyramid,
+                                                denoise, workers=1)
+        return insert_contour + [region[0].start, region[1].start]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        insert_contours = list(executor.map(region_contour, insert_regions))
+    return insert_contours
+
+
+#%% Skew Estimation
+def polygon_area(outline: np.ndarray) -> float:
+    """Calculate the area enclosed by an outline using the shoelace formula.
+
+    Args:
+        outline (np.ndarray): x,y coordinates of the outline.
+    Returns:
+        area (float): The enclosed area.
+    """
+    x = outline[:, 0]
+    y = outline[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def estimate_skew(insert_outline: np.ndarray) -> Tuple[float, float]:
+    """Estimate the rotation of the insert from its minimum area rectangle.
+
+    The rectangle with the smallest area enclosing the outline has one side
+        along an edge of the outline's convex hull.  Every hull edge angle is
+        tested at once, so all four sides of the insert contribute to the
+        estimate.  The confidence is the fraction of the rectangle covered by
+        the outline; a clean insert frame fills most of its rectangle.
+    Args:
+        insert_outline (np.ndarray): x,y coordinates of the insert outline.
+    Returns:
+        angle (float): The rotation of the insert edges from the x axis in
+            degrees, between -45 and 45.
+        confidence (float): The ratio of the outline area to the rectangle
+            area, from 0 to 1.
+    """
+    points = np.asarray(insert_outline, dtype=float)
+    hull = points[ConvexHull(points).vertices]
+    edges = np.roll(hull, -1, axis=0) - hull
+    edge_angles = np.arctan2(edges[:, 1], edges[:, 0])
+    # A rectangle repeats every 90 degrees.
+    edge_angles = (edge_angles + np.pi / 4) % (np.pi / 2) - np.pi / 4
+    cosines = np.cos(edge_angles)[:, np.newaxis]
+    sines = np.sin(edge_angles)[:, np.newaxis]
+    # Rotate the hull by each edge angle; one row per angle.
+    rotated_x = hull[:, 0] * cosines + hull[:, 1] * sines
+    rotated_y = hull[:, 1] * cosines - hull[:, 0] * sines
+    areas = np.ptp(rotated_x, axis=1) * np.ptp(rotated_y, axis=1)
+    best = np.argmin(areas)
+    angle = float(np.degrees(edge_angles[best]))
+    confidence = float(polygon_area(points) / areas[best])
+    return angle, confidence
+
+
+def deskew_outline(insert_outline: np.ndarray,
+                   rotation: float) -> np.ndarray:
+    """Rotate the insert outline so that the insert is square on the page.
+
+    The outline is rotated about the centre of its bounding box, so the
+        centre of the insert does not move.
+    Args:
+        insert_outline (np.ndarray): x,y coordinates of the insert outline,
+            where x is the distance down the scan.
+        rotation (float): The skew of the insert in degrees, as found by
+            estimate_skew.
+    Returns:
+        square_outline (np.ndarray): x,y coordinates of the squared outline.
+    """
+    along, down = encoder_axes(rotation)
+    centre = (insert_outline.min(axis=0) + insert_outline.max(axis=0)) / 2
+    offset = insert_outline - centre
+    return np.column_stack([offset @ down, offset @ along]) + centre
@@ -0,0 +1,211 @@
+"""Render the cutout report overlay without Excel.
+
+The scanned insert is cropped, deskewed and scaled in a single affine
+resample, and the planned aperture and the applicator cross-hair are drawn
+over it.  The result is written as a PNG, which is placed in the report as
+one picture at true print scale.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+from pathlib import Path
+from typing import List, Tuple
+import numpy as np
+from PIL import Image, ImageDraw
+from aperture_check import face_direction, INSERT_MAGNIFICATION, SCAN_FACE
+
+
+#%% Overlay Settings
+RENDER_DPI = 150  # Resolution of the overlay image in dots per inch.
+CROP_MARGIN = 0.5  # inches of background kept around the insert.
+OUTLINE_COLOUR = (255, 0, 0)
+CROSS_HAIR_COLOUR = (0, 176, 240)
+LINE_WIDTH = 2  # pixels
+
+
+#%% Resampling
+def crop_box(insert_limits: np.ndarray,
+             margin: float = CROP_MARGIN) -> np.ndarray:
+    """The region of the scan shown in the overlay.
+
+    Args:
+        insert_limits (np.ndarray of size 4): The extent of the insert in
+            inches as [x_min (image top), y_min (image left),
+            x_max (image bottom), y_max (image right)].
+        margin (float, optional): The background kept around the insert in
+            inches. Default is CROP_MARGIN.
+    Returns:
+        box (np.ndarray of size 4): The [top, left, bottom, right] of the
+            region in inches.
+    """
+    return insert_limits + np.array([-1, -1, 1, 1]) * margin
+
+
+def overlay_transform(box: np.ndarray, rotation: float, dpi: np.ndarray,
+                      render_dpi: float = RENDER_DPI
+                      ) -> Tuple[float, float, float, float, float, float]:
+    """The affine map from overlay pixels to scan pixels.
+
+    The overlay shows the box rotated clockwise by rotation about its
+        centre, the same as rotating the picture in Excel.
+    Args:
+        box (np.ndarray of size 4): The [top, left, bottom, right] of the
+            region shown in inches.
+        rotation (float): The clockwise rotation in degrees.
+        dpi (np.ndarray): The (x, y) resolution of the scan in dots per
+            inch, as read by PIL.
+        render_dpi (float, optional): The resolution of the overlay in dots
+            per inch. Default is RENDER_DPI.
+    Returns:
+        coefficients (Tuple[float]): The (a, b, c, d, e, f) coefficients
+            for Image.transform, giving the scan pixel
+            (a * x + b * y + c, d * x + e * y + f) for the overlay pixel
+            (x, y).
+    """
+    top, left, bottom, right = box
+    half_height = (bottom - top) / 2
+    half_width = (right - left) / 2
+    centre_row = top + half_height
+    centre_column = left + half_width
+    cosine = np.cos(np.radians(rotation))
+    sine = np.sin(np.radians(rotation))
+    column_dpi, row_dpi = dpi
+    coefficients = (
+        cosine * column_dpi / render_dpi,
+        sine * column_dpi / render_dpi,
+        (centre_column - cosine * half_width - sine * half_height) *
+        column_dpi,
+        -sine * row_dpi / render_dpi,
+        cosine * row_dpi / render_dpi,
+        (centre_row + sine * half_width - cosine * half_height) * row_dpi)
+    return coefficients
+
+
+#%% Drawing
+def plan_to_overlay(plan_outline: np.ndarray, overlay_size: Tuple[int, int],
+                    plan_offset: np.ndarray, render_dpi: float = RENDER_DPI,
+                    magnification: float = INSERT_MAGNIFICATION,
+                    scan_face: str = SCAN_FACE) -> List[Tuple[float]]:
+    """Convert plan coordinates to overlay pixels.
+
+    The plan origin is the centre of the overlay, shifted by plan_offset.
+        The plan is reduced from the isocentre plane to the insert and
+        oriented for the scanned face, as in aperture_check.plan_to_scan.
+    Args:
+        plan_outline (np.ndarray): X,Y coordinates in cm in the isocentre
+            plane.
+        overlay_size (Tuple[int, int]): The overlay width and height in
+            pixels.
+        plan_offset (np.ndarray): The X,Y shift of the plan origin in cm.
+        render_dpi (float, optional): The resolution of the overlay in dots
+            per inch. Default is RENDER_DPI.
+        magnification (float, optional): The size on the insert of one cm in
+            the isocentre plane. Default is INSERT_MAGNIFICATION.
+        scan_face (str, optional): The face of the insert on the scanner
+            glass. Default is aperture_check.SCAN_FACE.
+    Returns:
+        points (List[Tuple[float]]): The x,y pixel coordinates of each point.
+    """
+    pixels_per_cm = render_dpi / 2.54 * magnification
+    centre = np.array(overlay_size) / 2
+    shifted = plan_outline + plan_offset
+    direction = face_direction(scan_face)
+    points = np.column_stack(
+        [centre[0] + direction * shifted[:, 0] * pixels_per_cm,
+         centre[1] - shifted[:, 1] * pixels_per_cm])
+    return [tuple(point) for point in points]
+
+
+def draw_cross_hair(draw: ImageDraw.ImageDraw, overlay_size: Tuple[int, int],
+                    insert_size: int, render_dpi: float = RENDER_DPI,
+                    magnification: float = INSERT_MAGNIFICATION):
+    """Draw the applicator cross-hair through the centre of the overlay.
+
+    The cross-hair spans the applicator opening reduced to the insert.
+    Args:
+        draw (ImageDraw.ImageDraw): The drawing context for the overlay.
+        overlay_size (Tuple[int, int]): The overlay width and height in
+            pixels.
+        insert_size (int): The size of the applicator used.
+            Can be one of {6, 10, 15, 20, 25}
+        render_dpi (float, optional): The resolution of the overlay in dots
+            per inch. Default is RENDER_DPI.
+        magnification (float, optional): The size on the insert of one cm in
+            the isocentre plane. Default is INSERT_MAGNIFICATION.
+    """
+    half_length = insert_size / 2 * render_dpi / 2.54 * magnification
+    centre_x, centre_y = np.array(overlay_size) / 2
+    draw.line([(centre_x - half_length, centre_y),
+               (centre_x + half_length, centre_y)],
+              fill=CROSS_HAIR_COLOUR, width=LINE_WIDTH)
+    draw.line([(centre_x, centre_y - half_length),
+               (centre_x, centre_y + half_length)],
+              fill=CROSS_HAIR_COLOUR, width=LINE_WIDTH)
+
+
+#%% Overlay
+def render_overlay(cutout_image: np.ndarray, dpi: np.ndarray,
+                   insert_limits: np.ndarray, rotation: float,
+                   plan_outlines: List[np.ndarray], insert_size: int,
+                   plan_offset: np.ndarray = None,
+                   render_dpi: float = RENDER_DPI,
+                   scan_face: str = SCAN_FACE) -> Image.Image:
+    """Draw the planned aperture over the cropped and deskewed insert.
+
+    Args:
+        cutout_image (np.ndarray): The 8 bit grayscale scan.
+        dpi (np.ndarray): The (x, y) resolution of the scan in dots per
+            inch.
+        insert_limits (np.ndarray of size 4): The extent of the insert in
+            inches as [x_min, y_min, x_max, y_max].
+        rotation (float): The clockwise rotation that squares the insert in
+            degrees, as found by cutout_image.estimate_skew.
+        plan_outlines (List[np.ndarray]): X,Y coordinates of each planned
+            block outline in cm in the isocentre plane.
+        insert_size (int): The size of the applicator used.
+            Can be one of {6, 10, 15, 20, 25}
+        plan_offset (np.ndarray, optional): The X,Y shift in cm of the
+            aperture from the centre of the insert. Default is no shift.
+        render_dpi (float, optional): The resolution of the overlay in dots
+            per inch. Default is RENDER_DPI.
+        scan_face (str, optional): The face of the insert on the scanner
+            glass. Default is aperture_check.SCAN_FACE.
+    Returns:
+        overlay (Image.Image): The RGB overlay image.
+    """
+    if plan_offset is None:
+        plan_offset = np.zeros(2)
+    box = crop_box(insert_limits)
+    height, width = (box[2:] - box[:2]) * render_dpi
+    overlay_size = (int(round(width)), int(round(height)))
+    coefficients = overlay_transform(box, rotation, dpi, render_dpi)
+    scan = Image.fromarray(np.asarray(cutout_image, dtype=np.uint8))
+    overlay = scan.transform(overlay_size, Image.AFFINE, coefficients,
+                             resample=Image.BILINEAR).convert('RGB')
+    draw = ImageDraw.Draw(overlay)
+    draw_cross_hair(draw, overlay_size, insert_size, render_dpi)
+    for plan_outline in plan_outlines:
+        points = plan_to_overlay(plan_outline, overlay_size, plan_offset,
+                                 render_dpi, scan_face=scan_face)
+        draw.line(points + points[:1], fill=OUTLINE_COLOUR,
+                  width=LINE_WIDTH, joint='curve')
+    return overlay
+
+
+def save_overlay(overlay: Image.Image, overlay_file: Path,
+                 render_dpi: float = RENDER_DPI) -> Path:
+    """Write the overlay as a PNG file.
+
+    Args:
+        overlay (Image.Image): The overlay image.
+        overlay_file (Path): Full path to the PNG file.
+        render_dpi (float, optional): The resolution of the overlay in dots
+            per inch, stored in the file. Default is RENDER_DPI.
+    Returns:
+        overlay_file (Path): Full path to the PNG file.
+    """
+    overlay_file = Path(overlay_file)
+    overlay.save(overlay_file, format='PNG', dpi=(render_dpi, render_dpi))
+    return overlay_file
@@ -0,0 +1,134 @@
+"""Locate DICOM files in a directory tree.
+
+Directories are listed with os.scandir, using a pool of threads so that
+several directories on a network share can be listed at the same time.
+Files can be selected by name pattern, or identified as DICOM by their
+content.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+
+#%% DICOM File Identification
+# A DICOM Part 10 file starts with a 128 byte preamble followed by 'DICM'.
+DICOM_PREAMBLE_SIZE = 128
+DICOM_PREFIX = b'DICM'
+
+
+def is_dicom_file(file_path: Path) -> bool:
+    """Check whether a file is a DICOM file from its content.
+
+    Args:
+        file_path (Path): Full path to the file.
+    Returns:
+        is_dicom (bool): True if the file has the DICOM preamble and prefix.
+    """
+    try:
+        with open(file_path, 'rb') as dicom_file:
+            header = dicom_file.read(DICOM_PREAMBLE_SIZE + len(DICOM_PREFIX))
+    except OSError:
+        return False
+    return header[DICOM_PREAMBLE_SIZE:] == DICOM_PREFIX
+
+
+def matches_any(name: str, patterns: Sequence[str]) -> bool:
+    """Check whether a file or directory name matches any of the patterns.
+
+    Args:
+        name (str): The file or directory name.
+        patterns (Sequence[str]): Shell style patterns such as 'RP*.dcm'.
+    Returns:
+        is_match (bool): True if name matches at least one pattern.
+    """
+    return any(fnmatch(name, pattern) for pattern in patterns)
+
+
+#%% Directory Scanning
+def scan_directory(folder: str, include: Sequence[str],
+                   exclude: Sequence[str],
+                   sniff: bool) -> Tuple[List[Path], List[str]]:
+    """List the matching files and the sub-directories in one directory.
+
+    Args:
+        folder (str): The directory to list.
+        include (Sequence[str]): File name patterns to select.
+        exclude (Sequence[str]): File and directory name patterns to skip.
+        sniff (bool): If True, only select files with DICOM content.
+    Returns:
+        selected_files (List[Path]): The matching files in the directory.
+        sub_folders (List[str]): The sub-directories to scan.
+    """
+    selected_files = list()
+    sub_folders = list()
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return selected_files, sub_folders
+    for entry in entries:
+        if matches_any(entry.name, exclude):
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                sub_folders.append(entry.path)
+                continue
+            if not entry.is_file():
+                continue
+        except OSError:
+            continue
+        if not matches_any(entry.name, include):
+            continue
+        if sniff and not is_dicom_file(entry.path):
+            continue
+        selected_files.append(Path(entry.path))
+    return selected_files, sub_folders
+
+
+def find_dicom_files(folder: Path, include: Sequence[str] = None,
+                     exclude: Sequence[str] = (), max_depth: int = None,
+                     sniff: bool = False, workers: int = 8) -> List[Path]:
+    """Find DICOM files in a directory and its sub-directories.
+
+    Args:
+        folder (Path): Full path to the top directory to search.
+        include (Sequence[str], optional): File name patterns to select.
+            Defaults to ['RP*.dcm'], or to all files when sniff is True.
+        exclude (Sequence[str], optional): File and directory name patterns
+            to skip. Default is no exclusions.
+        max_depth (int, optional): The number of sub-directory levels to
+            search.  0 searches only folder itself.  Default is no limit.
+        sniff (bool, optional): If True, select files by checking for the
+            DICOM preamble and 'DICM' prefix rather than relying on the file
+            name. Default is False.
+        workers (int, optional): The number of threads used to list
+            directories. Default is 8.
+    Returns:
+        dicom_files (List[Path]): Full paths to the selected files, sorted.
+    """
+    if include is None:
+        include = ['*'] if sniff else ['RP*.dcm']
+    dicom_files = list()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_directory, str(folder), include,
+                                   exclude, sniff): 0}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                depth = pending.pop(future)
+                selected_files, sub_folders = future.result()
+                dicom_files.extend(selected_files)
+                if max_depth is not None and depth >= max_depth:
+                    continue
+                for sub_folder in sub_folders:
+                    pending[executor.submit(scan_directory, sub_folder,
+                                            include, exclude,
+                                            sniff)] = depth + 1
+    dicom_files.sort()
+    return dicom_files
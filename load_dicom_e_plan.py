@@ -6,12 +6,18 @@ Created on Wed Feb 10 21:24:34 2021
 """
 #%% Imports
 import re
+import os
+import logging
+from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, Iterator, List, Any, Tuple
 import numpy as np
 import pandas as pd
-import xlwings as xw
 import pydicom
+from dicom_discovery import find_dicom_files
+
+logger = logging.getLogger(__name__)
 
 
 #%% DICOM Plan Sections
@@ -87,10 +93,33 @@ def get_mus(ds: pydicom.Dataset) -> pd.DataFrame:
 
 
 #%% DICOM Field Subsection Data
+def get_block_coordinates(block: pydicom.Dataset) -> np.ndarray:
+    """Extract the closed outline of one block.
+
+    Args:
+        block (pydicom.Dataset): A BlockSequence item.
+    Returns:
+        block_coordinates (np.ndarray): An (n, 2) array of the X & Y
+            coordinates of the block outline in cm, with the first point
+            repeated at the end to close the loop.
+    """
+    # Extract the coordinates for the cutout as an np.array
+    block_coord_data = block.get('BlockData')
+    # Convert into (x,y) parts in units of cm
+    block_coordinates = np.array(block_coord_data).reshape((-1, 2)) / 10
+    # Add the first point on the end as the last point to close the loop
+    block_coordinates = np.vstack([block_coordinates, block_coordinates[0]])
+    return block_coordinates
+
+
 def get_block_info(field_ds: pydicom.Dataset) -> Dict[str, Any]:
     """Extract insert and cutout DICOM data for a given field.
 
-    All insert related parameters are re-scaled from mm to cm.
+    All insert related parameters are re-scaled from mm to cm.  The insert
+        parameters are taken from the first block.  The outlines of all blocks
+        are combined in Coordinates, with the number of points, block type
+        and mounting position of each block given in BlockVertexCounts,
+        BlockTypes and BlockMountingPositions.
     Args:
         field_ds (pydicom.Dataset): The DICOM BeamSequence sub-dataset for a
             field within a plan DICOM dataset.
@@ -125,13 +154,13 @@ def get_block_info(field_ds: pydicom.Dataset) -> Dict[str, Any]:
                 else:
                     block_data['SourceToBlockDistance'] = (
                         (distance + thickness) / 10)
-    # Extract the coordinates for the cutout as an np.array
-    block_coord_data = block.get('BlockData')
-    # Convert into (x,y) parts in units of cm
-    block_coordinates = np.array(block_coord_data).reshape((-1, 2)) / 10
-    # Add the first point on the end as the last point to close the loop
-    block_coordinates = np.row_stack([block_coordinates, block_coordinates[0]])
-    block_data['Coordinates'] = block_coordinates
+    block_outlines = [get_block_coordinates(blk) for blk in block_seq]
+    block_data['Coordinates'] = np.concatenate(block_outlines)
+    block_data['BlockVertexCounts'] = [len(outline)
+                                       for outline in block_outlines]
+    block_data['BlockTypes'] = [blk.get('BlockType') for blk in block_seq]
+    block_data['BlockMountingPositions'] = [
+        blk.get('BlockMountingPosition') for blk in block_seq]
     return block_data
 
 
@@ -239,7 +268,8 @@ def get_field_data(ds: pydicom.Dataset) -> pd.DataFrame:
         appl_data = get_applicator_info(field_ds)
         if appl_data:
             field_data.update(appl_data)
-            # Get insert data. Assumes only one insert per field.
+            # Get insert data. Assumes only one insert per field, which may
+            # contain several blocks.
             block_data = get_block_info(field_ds)
             field_data.update(block_data)
             # Add the field dictionary to the list of fields
@@ -268,14 +298,14 @@ def combine_field_tables(field_df, plan_mus, setup_ref, tolerance_ref):
     """
     field_df['Actual SSD'] = field_df['Actual SSD'] / 10
     field_df['SAD'] = field_df['SAD'] / 10
-    field_df = field_df.merge(plan_mus, how="left", left_on='BeamNumber',
-                              right_index=True)
-    field_df = field_df.merge(setup_ref, how="left",
-                              left_on='PatientSetupNumber',
-                              right_index=True)
-    field_df = field_df.merge(tolerance_ref, how="left",
-                              left_on='ToleranceTableNumber',
-                              right_index=True)
+    # Look up the reference values for each field rather than merging tables.
+    for column in plan_mus.columns:
+        field_df[column] = field_df['BeamNumber'].map(plan_mus[column])
+    for column in setup_ref.columns:
+        field_df[column] = field_df['PatientSetupNumber'].map(
+            setup_ref[column])
+    field_df[tolerance_ref.name] = field_df['ToleranceTableNumber'].map(
+        tolerance_ref)
     field_df.drop(columns=['BeamNumber', 'ToleranceTableNumber',
                            'PatientSetupNumber'], inplace=True)
     return field_df
@@ -301,53 +331,484 @@ def get_merged_field_data(ds: pydicom.Dataset) -> pd.DataFrame:
     return field_df
 
 
+#%% Field Table
+FIELD_INDEX = ['PatientReference', 'PlanId', 'FieldId']
+# Field parameters stored as float values.
+NUMERIC_PARAMETERS = [
+    'Weight', 'SAD', 'NumberOfBlocks', 'NumberOfBoli',
+    'NumberOfControlPoints', 'NumberOfWedges', 'CollimatorAngle', 'DoseRate',
+    'GantryAngle', 'Energy', 'CouchAngle', 'Actual SSD', 'ApplicatorOpening',
+    'SourceToBlockTrayDistance', 'BlockThickness', 'SourceToBlockDistance',
+    'MUs', 'Beam Dose'
+    ]
+# Text field parameters with only a few distinct values.
+CATEGORY_PARAMETERS = [
+    'FieldType', 'RadiationType', 'Linac', 'SetupField', 'ApplicatorID',
+    'ApplicatorType', 'ApplicatorApertureShape', 'MaterialID', 'BlockType',
+    'BlockDivergence', 'BlockMountingPosition', 'SetupTechnique',
+    'PatientOrientation', 'ToleranceTable'
+    ]
+
+
+class FieldTable():
+    """Field parameters for all fields in all plans.
+
+    The parameters are stored with one row per field, so that each parameter
+        is a single typed column.  The transposed plan table, with parameters
+        as rows and fields as columns, is only built when it is requested.
+    Attributes:
+        fields (pd.DataFrame): Field parameters indexed by
+            (PatientReference, PlanId, FieldId).  The NUMERIC_PARAMETERS are
+            float columns and the CATEGORY_PARAMETERS are categorical.
+    """
+
+    def __init__(self, field_df: pd.DataFrame):
+        """Build the field table.
+
+        Args:
+            field_df (pd.DataFrame): Field parameters with one row per field,
+                including the PatientReference, PlanId and FieldId columns.
+        """
+        field_df = field_df.set_index(FIELD_INDEX)
+        for column in NUMERIC_PARAMETERS:
+            if column in field_df.columns:
+                field_df[column] = pd.to_numeric(
+                    field_df[column], errors='coerce').astype(np.float64)
+        for column in CATEGORY_PARAMETERS:
+            if column in field_df.columns:
+                field_df[column] = field_df[column].astype('category')
+        self.fields = field_df
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> 'FieldTable':
+        """Build the field table from a list of field records.
+
+        Args:
+            records (List[Dict[str, Any]]): The parameters for each field.
+        Returns:
+            field_table (FieldTable): Field parameters for all fields.  Empty
+                if there are no records.
+        """
+        if not records:
+            return cls(pd.DataFrame(columns=FIELD_INDEX))
+        return cls(pd.DataFrame(records))
+
+    def update(self, removed_fields: List[Tuple[str, str, str]],
+               records: List[Dict[str, Any]]) -> 'FieldTable':
+        """Build a field table with some fields removed and others added.
+
+        Only the added records are converted; the remaining fields are
+            copied from this table.  An added field replaces any existing
+            field with the same index.
+        Args:
+            removed_fields (List[Tuple[str, str, str]]): The
+                (PatientReference, PlanId, FieldId) index of each field to
+                remove.
+            records (List[Dict[str, Any]]): The parameters for each field to
+                add.
+        Returns:
+            field_table (FieldTable): The updated field parameters.
+        """
+        added = FieldTable.from_records(records).fields
+        dropped = self.fields.index.isin(list(removed_fields)) | \
+            self.fields.index.isin(added.index)
+        field_df = pd.concat([self.fields[~dropped], added])
+        return FieldTable(field_df.reset_index())
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def value(self, field: Tuple[str, str, str], parameter: str) -> Any:
+        """Get one parameter value for a field.
+
+        Args:
+            field (Tuple[str, str, str]): The
+                (PatientReference, PlanId, FieldId) index of the field.
+            parameter (str): The name of the field parameter.
+        Returns:
+            value (Any): The parameter value.
+        """
+        return self.fields.at[field, parameter]
+
+    def plan_view(self, patient: str = None) -> pd.DataFrame:
+        """Build the transposed plan table.
+
+        Args:
+            patient (str, optional): If given, only include the fields for
+                this PatientReference, with the PatientReference level removed
+                from the columns.
+        Returns:
+            plan_df (pd.DataFrame): Field parameters with parameters as rows
+                and fields as columns.
+        """
+        if patient is None:
+            fields = self.fields
+        else:
+            fields = self.fields.xs(patient, level='PatientReference')
+        return fields.T
+
+    @cached_property
+    def plan_df(self) -> pd.DataFrame:
+        """The transposed plan table for all fields."""
+        return self.plan_view()
+
+
 #%% Block Coordinates Table
-def get_block_coord(plan_df: pd.DataFrame) -> pd.DataFrame:
+# Field parameters describing the blocks.
+BLOCK_COLUMNS = ['Coordinates', 'BlockVertexCounts', 'BlockTypes',
+                 'BlockMountingPositions', 'BlockType',
+                 'BlockMountingPosition']
+
+
+class BlockCoordinates():
+    """Compact storage for the cutout coordinates of many fields.
+
+    The outlines of all blocks for all fields are stored in a single array of
+        vertices.  The vertices for block i are
+        vertices[offsets[i]:offsets[i + 1]], and the blocks for field j are
+        blocks field_offsets[j] to field_offsets[j + 1] - 1.  The blocks for
+        a field are stored together, so all of the vertices for a field are a
+        single slice of vertices.
+    Attributes:
+        vertices (np.ndarray): An (N, 2) float array of the X & Y coordinates
+            for all blocks.
+        offsets (np.ndarray): The position of the first vertex for each block
+            in vertices, with the total number of vertices as the last value.
+        field_offsets (np.ndarray): The position of the first block for each
+            field, with the total number of blocks as the last value.
+        block_types (np.ndarray): The BlockType of each block.
+        mounting_positions (np.ndarray): The BlockMountingPosition of each
+            block.
+        fields (pd.MultiIndex): The (PatientReference, PlanId, FieldId) index
+            for each field.
+    """
+
+    def __init__(self, fields: List[Tuple[str, str, str]],
+                 coordinates: List[np.ndarray],
+                 vertex_counts: List[List[int]] = None,
+                 block_types: List[List[str]] = None,
+                 mounting_positions: List[List[str]] = None):
+        """Build the coordinate store.
+
+        Args:
+            fields (List[Tuple[str, str, str]]): The
+                (PatientReference, PlanId, FieldId) index for each field.
+            coordinates (List[np.ndarray]): An (n, 2) array of X & Y
+                coordinates for each field, containing the outlines of all
+                blocks in the field.
+            vertex_counts (List[List[int]], optional): The number of points in
+                each block outline for each field.  Defaults to a single block
+                per field.
+            block_types (List[List[str]], optional): The BlockType of each
+                block for each field.
+            mounting_positions (List[List[str]], optional): The
+                BlockMountingPosition of each block for each field.
+        """
+        if vertex_counts is None:
+            vertex_counts = [[len(coords)] for coords in coordinates]
+        if block_types is None:
+            block_types = [[None] * len(counts) for counts in vertex_counts]
+        if mounting_positions is None:
+            mounting_positions = [[None] * len(counts)
+                                  for counts in vertex_counts]
+        block_counts = [len(counts) for counts in vertex_counts]
+        self.field_offsets = np.zeros(len(fields) + 1, dtype=np.int64)
+        np.cumsum(block_counts, out=self.field_offsets[1:])
+        all_counts = [count for counts in vertex_counts for count in counts]
+        self.offsets = np.zeros(len(all_counts) + 1, dtype=np.int64)
+        np.cumsum(all_counts, out=self.offsets[1:])
+        if coordinates:
+            self.vertices = np.concatenate(coordinates).astype(np.float64)
+        else:
+            self.vertices = np.empty((0, 2), dtype=np.float64)
+        self.block_types = np.array(
+            [blk for types in block_types for blk in types], dtype=object)
+        self.mounting_positions = np.array(
+            [pos for positions in mounting_positions for pos in positions],
+            dtype=object)
+        self.fields = pd.MultiIndex.from_tuples(fields, names=FIELD_INDEX)
+        self.positions = {field: num for num, field in enumerate(fields)}
+
+    def update(self, removed_fields: List[Tuple[str, str, str]],
+               added: 'BlockCoordinates') -> 'BlockCoordinates':
+        """Build a coordinate store with some fields removed and others added.
+
+        The blocks of the remaining fields are copied from this store as
+            slices of the vertex array, so only the added fields need to be
+            extracted from their field records.  An added field replaces any
+            existing field with the same index.
+        Args:
+            removed_fields (List[Tuple[str, str, str]]): The
+                (PatientReference, PlanId, FieldId) index of each field to
+                remove.
+            added (BlockCoordinates): The coordinates of the fields to add.
+        Returns:
+            block_coords (BlockCoordinates): The updated coordinate store.
+        """
+        dropped = set(removed_fields) | set(added.positions)
+        fields = list()
+        coordinates = list()
+        vertex_counts = list()
+        block_types = list()
+        mounting_positions = list()
+        for store in (self, added):
+            for num, field in enumerate(store.positions):
+                if store is self and field in dropped:
+                    continue
+                first_block = store.field_offsets[num]
+                last_block = store.field_offsets[num + 1]
+                fields.append(field)
+                coordinates.append(store[field])
+                vertex_counts.append(np.diff(
+                    store.offsets[first_block:last_block + 1]).tolist())
+                block_types.append(
+                    list(store.block_types[first_block:last_block]))
+                mounting_positions.append(
+                    list(store.mounting_positions[first_block:last_block]))
+        return BlockCoordinates(fields, coordinates, vertex_counts,
+                                block_types, mounting_positions)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, field: Tuple[str, str, str]) -> bool:
+        return field in self.positions
+
+    def __getitem__(self, field: Tuple[str, str, str]) -> np.ndarray:
+        """Get the cutout coordinates for all blocks of one field.
+
+        Args:
+            field (Tuple[str, str, str]): The
+                (PatientReference, PlanId, FieldId) index of the field.
+        Returns:
+            coords (np.ndarray): An (n, 2) view of the X & Y coordinates.
+        """
+        num = self.positions[field]
+        first_block = self.field_offsets[num]
+        last_block = self.field_offsets[num + 1]
+        return self.vertices[self.offsets[first_block]:
+                             self.offsets[last_block]]
+
+    def blocks(self, field: Tuple[str, str, str]) -> List[np.ndarray]:
+        """Get the outline of each block of one field.
+
+        Args:
+            field (Tuple[str, str, str]): The
+                (PatientReference, PlanId, FieldId) index of the field.
+        Returns:
+            outlines (List[np.ndarray]): An (n, 2) view of the X & Y
+                coordinates for each block.
+        """
+        num = self.positions[field]
+        block_range = range(self.field_offsets[num],
+                            self.field_offsets[num + 1])
+        return [self.vertices[self.offsets[blk]:self.offsets[blk + 1]]
+                for blk in block_range]
+
+    def get_frame(self, field: Tuple[str, str, str]) -> pd.DataFrame:
+        """Get the cutout coordinates for one field as a table.
+
+        When a field has more than one block, the block outlines are
+            separated by a row of NaN so that they plot as separate lines.
+        Args:
+            field (Tuple[str, str, str]): The
+                (PatientReference, PlanId, FieldId) index of the field.
+        Returns:
+            coords (pd.DataFrame): The X & Y coordinate columns.
+        """
+        outlines = list()
+        for outline in self.blocks(field):
+            if outlines:
+                outlines.append(np.full((1, 2), np.nan))
+            outlines.append(outline)
+        return pd.DataFrame(np.concatenate(outlines), columns=['X', 'Y'])
+
+    def to_frame(self) -> pd.DataFrame:
+        """Build a table containing the cutout coordinates for all fields.
+
+        The returned dataFrame has a multi-level column index.  The levels
+            are PatientReference, PlanId, FieldId and Axis; X or Y, the
+            coordinate data pairs for the cutout.  Shorter cutouts are padded
+            with NaN.
+        Returns:
+            block_coords (pd.DataFrame): The X & Y coordinate pairs for each
+                insert in each plan.
+        """
+        axis_data = dict()
+        for field in self.fields:
+            coords = self.get_frame(field)
+            axis_data[(*field, 'X')] = coords['X']
+            axis_data[(*field, 'Y')] = coords['Y']
+        block_coords = pd.DataFrame(axis_data)
+        block_coords.columns.names = FIELD_INDEX + ['Axis']
+        return block_coords
+
+    @cached_property
+    def block_geometry(self) -> pd.DataFrame:
+        """The area, perimeter and extent of every block.
+
+        The values for all blocks are calculated together from the vertex
+            array.  Each block outline must be closed (last point equal to
+            the first point).  The table is indexed by
+            (PatientReference, PlanId, FieldId, BlockNumber) and contains the
+            columns: BlockType, BlockMountingPosition, Area, Perimeter,
+            Extent, XMin, YMin, XMax, YMax.
+        """
+        starts = self.offsets[:-1]
+        x_coords = self.vertices[:, 0]
+        y_coords = self.vertices[:, 1]
+        # Edge terms between consecutive points.  The terms joining the last
+        # point of one block to the first point of the next are removed.
+        cross = x_coords[:-1] * y_coords[1:] - x_coords[1:] * y_coords[:-1]
+        length = np.hypot(np.diff(x_coords), np.diff(y_coords))
+        block_ends = self.offsets[1:-1] - 1
+        cross[block_ends] = 0
+        length[block_ends] = 0
+        # Each block has at least one edge, so the last edge index of each
+        # block is offsets[i + 1] - 2.
+        edge_starts = np.minimum(starts, max(len(cross) - 1, 0))
+        area = np.abs(np.add.reduceat(cross, edge_starts)) / 2
+        perimeter = np.add.reduceat(length, edge_starts)
+        x_min = np.minimum.reduceat(x_coords, starts)
+        x_max = np.maximum.reduceat(x_coords, starts)
+        y_min = np.minimum.reduceat(y_coords, starts)
+        y_max = np.maximum.reduceat(y_coords, starts)
+        extent = np.max(np.abs([x_min, y_min, x_max, y_max]), axis=0)
+        block_counts = np.diff(self.field_offsets)
+        field_index = self.fields.repeat(block_counts).to_frame(index=False)
+        field_index['BlockNumber'] = (np.arange(len(starts)) -
+                                      np.repeat(self.field_offsets[:-1],
+                                                block_counts))
+        block_geometry = pd.DataFrame({
+            'BlockType': self.block_types,
+            'BlockMountingPosition': self.mounting_positions,
+            'Area': area,
+            'Perimeter': perimeter,
+            'Extent': extent,
+            'XMin': x_min,
+            'YMin': y_min,
+            'XMax': x_max,
+            'YMax': y_max
+            }, index=pd.MultiIndex.from_frame(field_index))
+        return block_geometry
+
+    @cached_property
+    def field_geometry(self) -> pd.DataFrame:
+        """The aperture area, perimeter, equivalent square and extent.
+
+        Shielding blocks are subtracted from the aperture area.  The table is
+            indexed by (PatientReference, PlanId, FieldId) and contains the
+            columns: Area, Perimeter, EquivalentSquare, Extent.
+        """
+        block_geometry = self.block_geometry
+        sign = np.where(block_geometry['BlockType'] == 'SHIELDING', -1, 1)
+        field_values = pd.DataFrame({
+            'Area': block_geometry['Area'] * sign,
+            'Perimeter': block_geometry['Perimeter'],
+            'Extent': block_geometry['Extent']
+            })
+        field_groups = field_values.groupby(level=FIELD_INDEX, sort=False)
+        field_geometry = field_groups.agg(
+            {'Area': 'sum', 'Perimeter': 'sum', 'Extent': 'max'})
+        field_geometry['EquivalentSquare'] = (4 * field_geometry['Area'] /
+                                              field_geometry['Perimeter'])
+        return field_geometry
+
+
+def get_block_coord(field_table: FieldTable) -> BlockCoordinates:
     """Extract the cutout coordinates for each field.
 
-    Extracts the np.array block coordinates for each field, returning them as
-        a separate DataFrame.  The returned dataFrame has a multi-level column
-        index.  The top level is the plan ID, the second level is the field ID,
-        and the lowest level is X or Y, the coordinate data pairs for the
-        cutout.
+    Extracts the np.array block coordinates for each field, returning them in
+        a compact BlockCoordinates store indexed by
+        (PatientReference, PlanId, FieldId).
     Args:
-        plan_df (pd.DataFrame): Field parameters for all fields in all plans.
+        field_table (FieldTable): Field parameters for all fields in all plans.
     Returns:
-        block_coords (pd.DataFrame): The X & Y coordinate pairs for each insert
-        in each plan.
+        block_coords (BlockCoordinates): The X & Y coordinate pairs for each
+            insert in each plan.
     """
-    block_coord_df = plan_df.loc['Coordinates', :]
-    field_groups = block_coord_df.groupby(['PatientReference', 'PlanId', 'FieldId'])
-    blk_grps = list()
-    for name, group in field_groups:
-        blk_grps.append(group.apply(
-            {'X': lambda x: x[:, 0], 'Y': lambda x: x[:, 1]}))
-    blk_grps_df = pd.concat(blk_grps)
-    block_coords = blk_grps_df.apply(pd.Series).T
-    block_coords = block_coords.reorder_levels([1, 2, 3, 0], axis='columns')
-    block_coords.columns.names = ['PatientReference', 'PlanId', 'FieldId', 'Axis']
+    block_columns = [column for column in BLOCK_COLUMNS
+                     if column in field_table.fields.columns]
+    block_data = field_table.fields[block_columns].to_dict(orient='index')
+    fields = list()
+    coordinates = list()
+    vertex_counts = list()
+    block_types = list()
+    mounting_positions = list()
+    for field, field_blocks in block_data.items():
+        coords = field_blocks.get('Coordinates')
+        if not isinstance(coords, np.ndarray):
+            continue
+        counts = field_blocks.get('BlockVertexCounts')
+        if isinstance(counts, list):
+            types = field_blocks.get('BlockTypes')
+            positions = field_blocks.get('BlockMountingPositions')
+        else:
+            # Single block fields loaded before block lists were recorded.
+            counts = [len(coords)]
+            types = [field_blocks.get('BlockType')]
+            positions = [field_blocks.get('BlockMountingPosition')]
+        fields.append(field)
+        coordinates.append(coords)
+        vertex_counts.append(counts)
+        block_types.append(types)
+        mounting_positions.append(positions)
+    block_coords = BlockCoordinates(fields, coordinates, vertex_counts,
+                                    block_types, mounting_positions)
     return block_coords
 
 
 #%% Load DICOM Files
+# Tags read to identify a plan file and its patient.
+PLAN_HEADER_TAGS = ['Modality', 'SOPInstanceUID', 'RTPlanLabel', 'PatientID',
+                    'PatientName', 'PatientBirthDate']
+# Tags containing the field data, only read from files that are plans.
+PLAN_DATA_TAGS = ['ToleranceTableSequence', 'PatientSetupSequence',
+                  'FractionGroupSequence', 'BeamSequence']
+
+
+def read_plan_header(plan_file: Path) -> pydicom.Dataset:
+    """Read the identifying tags from a DICOM file.
+
+    Only the tags in PLAN_HEADER_TAGS are parsed, so that non-plan files (CT,
+        RTDOSE etc.) can be rejected without parsing the entire file.
+    Args:
+        plan_file (Path): Full path to the DICOM file.
+    Returns:
+        header_ds (pydicom.Dataset): The header tags for the plan.  None is
+            returned if the file is not an RT Plan.
+    """
+    header_ds = pydicom.dcmread(plan_file, stop_before_pixels=True,
+                                specific_tags=PLAN_HEADER_TAGS)
+    dicom_type = header_ds.get('Modality', '')
+    if 'RTPLAN' not in dicom_type:
+        return None
+    return header_ds
+
+
 def read_dicom_plan(plan_file: Path) -> pd.DataFrame:
     """Load a DICOM plan file and extract field data from it.
 
+    The file is read in two passes.  The first pass reads only the header
+        tags and rejects files that are not plans.  The second pass reads the
+        field related sequences from the accepted files.
     Args:
         plan_file (Path): Full path to the DICOM Plan file.
     Returns:
         field_df (pd.DataFrame): Field parameters for all fields in the plan.
+            None is returned if the file is not an RT Plan.
     """
-    ds = pydicom.dcmread(plan_file)
-    dicom_type = ds.Modality
-    if 'RTPLAN' not in dicom_type:
+    header_ds = read_plan_header(plan_file)
+    if header_ds is None:
         return None
-    plan_name = ds.RTPlanLabel
-    patient_id = ds.PatientID
-    patient_name = str(ds.PatientName)
-    patient_birth_date = ds.PatientBirthDate
+    plan_name = header_ds.RTPlanLabel
+    patient_id = header_ds.PatientID
+    patient_name = str(header_ds.PatientName)
+    patient_birth_date = header_ds.PatientBirthDate
+    ds = pydicom.dcmread(plan_file, specific_tags=PLAN_DATA_TAGS)
     field_df = get_merged_field_data(ds)
     field_df['PlanId'] = plan_name
+    field_df['SOPInstanceUID'] = header_ds.get('SOPInstanceUID')
     field_df['PatientId'] = patient_id
     field_df['PatientName'] = patient_name
     field_df['PatientBirthDate'] = patient_birth_date
@@ -357,25 +818,279 @@ def read_dicom_plan(plan_file: Path) -> pd.DataFrame:
 
 
 # Read all files
-def get_plan_data(dicom_folder: Path) -> pd.DataFrame:
-    """Load field data from all DICOM plan files in a directory.
+def read_plan_files(plan_files: List[Path]) -> List[Tuple[Path, pd.DataFrame, str]]:
+    """Load field data from a group of DICOM plan files.
+
+    Each file is read independently so that a file that fails to parse does
+        not prevent the remaining files in the group from loading.
+    Args:
+        plan_files (List[Path]): Full paths to the DICOM Plan files.
+    Returns:
+        plan_results (List[Tuple[Path, pd.DataFrame, str]]): For each file;
+            the file path, the field parameters (None if the file is not a
+            plan or could not be read) and an error message (None if the file
+            was read successfully).
+    """
+    plan_results = list()
+    for plan_file in plan_files:
+        try:
+            field_df = read_dicom_plan(plan_file)
+        except Exception as err:  # pylint: disable=broad-except
+            plan_results.append((plan_file, None, repr(err)))
+        else:
+            plan_results.append((plan_file, field_df, None))
+    return plan_results
+
+
+def iter_plan_chunks(plan_files: List[Path], workers: int = None,
+                     chunk_size: int = 16
+                     ) -> Iterator[Tuple[int, List[Tuple[Path, pd.DataFrame,
+                                                         str]]]]:
+    """Load field data from DICOM plan files using a pool of processes.
+
+    The files are divided into chunks of at most chunk_size files.  No more
+        than two chunks per worker are queued at one time, so that memory use
+        remains bounded for very large folders.  The chunk results are
+        yielded as soon as they are complete, which may not be in the same
+        order as plan_files.
+    Args:
+        plan_files (List[Path]): Full paths to the DICOM Plan files.
+        workers (int, optional): The number of worker processes to use.
+            Defaults to the number of processors on the machine.
+        chunk_size (int, optional): The number of files read by a worker in
+            one task. Default is 16.
+    Yields:
+        chunk_num (int): The position of the chunk in plan_files.
+        chunk_results (List[Tuple[Path, pd.DataFrame, str]]): For each file
+            in the chunk; the file path, the field parameters and an error
+            message, as returned by read_plan_files.
+    """
+    chunks = [plan_files[start:start + chunk_size]
+              for start in range(0, len(plan_files), chunk_size)]
+    if not workers:
+        workers = os.cpu_count() or 1
+    max_pending = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = dict()
+        for chunk_num, chunk in enumerate(chunks):
+            pending[executor.submit(read_plan_files, chunk)] = chunk_num
+            if len(pending) < max_pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def read_plans_parallel(plan_files: List[Path], workers: int = None,
+                        chunk_size: int = 16
+                        ) -> List[Tuple[Path, pd.DataFrame, str]]:
+    """Load field data from DICOM plan files using a pool of processes.
+
+    The results are returned in the same order as plan_files.
+    Args:
+        plan_files (List[Path]): Full paths to the DICOM Plan files.
+        workers (int, optional): The number of worker processes to use.
+            Defaults to the number of processors on the machine.
+        chunk_size (int, optional): The number of files read by a worker in
+            one task. Default is 16.
+    Returns:
+        plan_results (List[Tuple[Path, pd.DataFrame, str]]): For each file;
+            the file path, the field parameters and an error message, as
+            returned by read_plan_files.
+    """
+    chunk_results = dict(iter_plan_chunks(plan_files, workers, chunk_size))
+    plan_results = list()
+    for chunk_num in sorted(chunk_results):
+        plan_results.extend(chunk_results[chunk_num])
+    return plan_results
+
+
+def iter_plan_results(plan_files: List[Path], parallel: bool = False,
+                      workers: int = None, chunk_size: int = 16
+                      ) -> Iterator[Tuple[Path, pd.DataFrame]]:
+    """Load field data from DICOM plan files one plan at a time.
+
+    Files that could not be read are reported and skipped.
+    Args:
+        plan_files (List[Path]): Full paths to the DICOM Plan files.
+        parallel (bool, optional): If True, read the plan files using a pool
+            of processes.  The plans are then yielded in the order that they
+            are read, rather than the order of plan_files. Default is False.
+        workers (int, optional): The number of worker processes to use when
+            parallel is True.  Defaults to the number of processors on the
+            machine.
+        chunk_size (int, optional): The number of files read by a worker in
+            one task when parallel is True. Default is 16.
+    Yields:
+        plan_file (Path): The DICOM file path.
+        field_df (pd.DataFrame): Field parameters for all fields in the plan.
+            None if the file is not a plan.
+    """
+    if parallel:
+        plan_results = (
+            result
+            for _, chunk_results in iter_plan_chunks(plan_files, workers,
+                                                     chunk_size)
+            for result in chunk_results)
+    else:
+        plan_results = (result
+                        for plan_file in plan_files
+                        for result in read_plan_files([plan_file]))
+    for plan_file, field_df, error in plan_results:
+        if error:
+            logger.warning('Unable to read plan file %s: %s',
+                           plan_file, error)
+        else:
+            yield plan_file, field_df
+
+
+def read_plans(plan_files: List[Path], parallel: bool = False,
+               workers: int = None, chunk_size: int = 16
+               ) -> List[Tuple[Path, pd.DataFrame]]:
+    """Load field data from DICOM plan files, reporting any failures.
+
+    Args:
+        plan_files (List[Path]): Full paths to the DICOM Plan files.
+        parallel (bool, optional): If True, read the plan files using a pool
+            of processes. Default is False.
+        workers (int, optional): The number of worker processes to use when
+            parallel is True.  Defaults to the number of processors on the
+            machine.
+        chunk_size (int, optional): The number of files read by a worker in
+            one task when parallel is True. Default is 16.
+    Returns:
+        plan_data (List[Tuple[Path, pd.DataFrame]]): The file path and field
+            parameters for each file that was read successfully.  The field
+            parameters are None for files that are not plans.
+    """
+    if parallel:
+        plan_results = read_plans_parallel(plan_files, workers, chunk_size)
+    else:
+        plan_results = read_plan_files(plan_files)
+    plan_data = list()
+    for plan_file, field_df, error in plan_results:
+        if error:
+            logger.warning('Unable to read plan file %s: %s',
+                           plan_file, error)
+        else:
+            plan_data.append((plan_file, field_df))
+    return plan_data
+
+
+def find_plan_files(dicom_folder: Path, **discovery_options) -> List[Path]:
+    """List all DICOM plan files in a directory and its sub-directories.
 
+    By default files are selected by the 'RP*.dcm' name pattern.
     Args:
         dicom_folder (Path): Full path to a folder containing DICOM Plan files.
+        discovery_options: Keyword arguments for
+            dicom_discovery.find_dicom_files; include, exclude, max_depth,
+            sniff and workers.
+    Returns:
+        plan_files (List[Path]): Full paths to the DICOM Plan files.
+    """
+    plan_files = find_dicom_files(dicom_folder, **discovery_options)
+    return plan_files
+
+
+def build_field_table(plan_data: List[pd.DataFrame]) -> FieldTable:
+    """Combine the field data from multiple plans into one table.
+
+    Args:
+        plan_data (List[pd.DataFrame]): Field parameters for each plan.
+    Returns:
+        field_table (FieldTable): Field parameters for all fields in all plans.
+    """
+    field_table = FieldTable(pd.concat(plan_data, ignore_index=True))
+    return field_table
+
+
+def build_plan_table(plan_data: List[pd.DataFrame]) -> pd.DataFrame:
+    """Combine the field data from multiple plans into one transposed table.
+
+    Args:
+        plan_data (List[pd.DataFrame]): Field parameters for each plan.
     Returns:
         plan_df (pd.DataFrame): Field parameters for all fields in all plans.
     """
-    plan_files = [file for file in dicom_folder.glob('**/RP*.dcm')]
-    plan_data = list()
-    for plan_file in plan_files:
-        field_df = read_dicom_plan(plan_file)
-        plan_data.append(field_df)
-    plan_df = pd.concat(plan_data)
-    plan_df.set_index(['PatientReference', 'PlanId', 'FieldId'], inplace=True)
-    plan_df = plan_df.T
+    plan_df = build_field_table(plan_data).plan_view()
     return plan_df
 
 
+def get_field_table(dicom_folder: Path, parallel: bool = False,
+                    workers: int = None, chunk_size: int = 16) -> FieldTable:
+    """Load field data from all DICOM plan files in a directory.
+
+    Args:
+        dicom_folder (Path): Full path to a folder containing DICOM Plan files.
+        parallel (bool, optional): If True, read the plan files using a pool
+            of processes. Default is False.
+        workers (int, optional): The number of worker processes to use when
+            parallel is True.  Defaults to the number of processors on the
+            machine.
+        chunk_size (int, optional): The number of files read by a worker in
+            one task when parallel is True. Default is 16.
+    Returns:
+        field_table (FieldTable): Field parameters for all fields in all plans.
+    """
+    plan_files = find_plan_files(dicom_folder)
+    plan_data = read_plans(plan_files, parallel, workers, chunk_size)
+    field_table = build_field_table([field_df for _, field_df in plan_data])
+    return field_table
+
+
+def get_plan_data(dicom_folder: Path, parallel: bool = False,
+                  workers: int = None, chunk_size: int = 16) -> pd.DataFrame:
+    """Load field data from all DICOM plan files in a directory.
+
+    Args:
+        dicom_folder (Path): Full path to a folder containing DICOM Plan files.
+        parallel (bool, optional): If True, read the plan files using a pool
+            of processes. Default is False.
+        workers (int, optional): The number of worker processes to use when
+            parallel is True.  Defaults to the number of processors on the
+            machine.
+        chunk_size (int, optional): The number of files read by a worker in
+            one task when parallel is True. Default is 16.
+    Returns:
+        plan_df (pd.DataFrame): Field parameters for all fields in all plans.
+    """
+    field_table = get_field_table(dicom_folder, parallel, workers, chunk_size)
+    return field_table.plan_df
+
+
+def iter_plan_fields(dicom_folder: Path, parallel: bool = False,
+                     workers: int = None,
+                     chunk_size: int = 16) -> Iterator[Dict[str, Any]]:
+    """Load field data from all DICOM plan files in a directory, one at a time.
+
+    Field records are yielded as each plan file is read, so that the fields
+        can be used before the whole directory has been scanned.  The complete
+        field table can be built from the collected records with
+        FieldTable.from_records(records).
+    Args:
+        dicom_folder (Path): Full path to a folder containing DICOM Plan files.
+        parallel (bool, optional): If True, read the plan files using a pool
+            of processes. Default is False.
+        workers (int, optional): The number of worker processes to use when
+            parallel is True.  Defaults to the number of processors on the
+            machine.
+        chunk_size (int, optional): The number of files read by a worker in
+            one task when parallel is True. Default is 16.
+    Yields:
+        field (Dict[str, Any]): The parameters for one field.
+    """
+    plan_files = find_plan_files(dicom_folder)
+    for _, field_df in iter_plan_results(plan_files, parallel, workers,
+                                         chunk_size):
+        if field_df is not None:
+            yield from field_df.to_dict(orient='records')
+
+
 #%% Main
 def main():
     """Run test with sample files.
@@ -383,15 +1098,16 @@ def main():
     Returns:
         None.
     """
+    import xlwings as xw
     # File Paths
     # TODO turn this into Unit Tests
     dicom_folder = Path.cwd()
     output_file_name = 'Electron Plan DICOM Info.xlsx'
     save_file = dicom_folder / output_file_name
     # Load DICOM Data
-    plan_df = get_plan_data(dicom_folder)
-    block_coords = get_block_coord(plan_df)
-    plan_df.drop(index=['Coordinates'], inplace=True)
+    field_table = get_field_table(dicom_folder)
+    block_coords = get_block_coord(field_table)
+    plan_df = field_table.plan_df.drop(index=['Coordinates'])
     # Save Data
     workbook = xw.Book()
     workbook.save(save_file)
@@ -399,7 +1115,7 @@ def main():
     plan_data_sheet.range('A1').value = plan_df
     plan_data_sheet.autofit()
     block_coords_sheet = workbook.sheets.add('Block Coordinates')
-    block_coords_sheet.range('A1').value = block_coords
+    block_coords_sheet.range('A1').value = block_coords.to_frame()
     block_coords_sheet.autofit()
     workbook.save(save_file)
 
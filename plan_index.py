@@ -0,0 +1,570 @@
+"""Persistent index of the field data extracted from DICOM plan files.
+
+The index is a SQLite database containing the field records and block
+coordinates for each plan file that has been read.  Each file entry is
+fingerprinted by its path, size, modification time and SOPInstanceUID, so a
+rescan only needs to read plan files that are new or have changed.  A file
+whose modification time has changed, but whose size and SOPInstanceUID still
+match the index, holds the same plan and is not read again.  The index is
+kept in a per-user cache folder, so the DICOM folder may be read-only.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import numpy as np
+import pandas as pd
+from load_dicom_e_plan import find_plan_files, read_plans, iter_plan_results
+from load_dicom_e_plan import FieldTable, read_plan_header
+
+
+#%% Index Settings
+if os.name == 'nt':
+    DEFAULT_INDEX_FOLDER = Path(os.environ.get(
+        'LOCALAPPDATA', Path.home() / 'AppData' / 'Local')) / 'ElectronCutout'
+else:
+    DEFAULT_INDEX_FOLDER = Path(os.environ.get(
+        'XDG_CACHE_HOME', Path.home() / '.cache')) / 'ElectronCutout'
+INDEX_FILE_NAME = 'plan_index_{folder_hash}.sqlite'
+# Increase when the stored field records change so that old indexes are
+# rebuilt.
+INDEX_VERSION = 2
+INDEX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS plan_files (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        sop_instance_uid TEXT
+        );
+    CREATE TABLE IF NOT EXISTS fields (
+        path TEXT NOT NULL,
+        field_number INTEGER NOT NULL,
+        record TEXT NOT NULL,
+        coordinates BLOB,
+        PRIMARY KEY (path, field_number)
+        );
+    '''
+
+
+#%% Record Conversion
+def to_json_value(value: Any) -> Any:
+    """Convert DICOM and numpy values into values that JSON can store.
+
+    Args:
+        value (Any): A field parameter value.
+    Returns:
+        json_value (Any): The value as a built-in Python type.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float)) or value is None:
+        return value
+    if hasattr(value, '__iter__'):
+        return [to_json_value(item) for item in value]
+    return str(value)
+
+
+def encode_field(field: Dict[str, Any]) -> Tuple[str, bytes]:
+    """Convert a field record into a form that can be stored in the index.
+
+    Args:
+        field (Dict[str, Any]): The parameters for one field.
+    Returns:
+        record (str): The field parameters, excluding the block coordinates,
+            as a JSON string.
+        coordinates (bytes): The block coordinates as float64 bytes.  None if
+            the field has no block coordinates.
+    """
+    field = dict(field)
+    coordinates = field.pop('Coordinates', None)
+    if isinstance(coordinates, np.ndarray):
+        coordinates = np.asarray(coordinates, dtype=np.float64).tobytes()
+    else:
+        coordinates = None
+    record = json.dumps(field, default=to_json_value)
+    return record, coordinates
+
+
+def decode_field(record: str, coordinates: bytes) -> Dict[str, Any]:
+    """Convert a stored field record back into field parameters.
+
+    Args:
+        record (str): The field parameters as a JSON string.
+        coordinates (bytes): The block coordinates as float64 bytes.
+    Returns:
+        field (Dict[str, Any]): The parameters for one field.
+    """
+    field = json.loads(record)
+    if coordinates is not None:
+        field['Coordinates'] = np.frombuffer(
+            coordinates, dtype=np.float64).reshape((-1, 2))
+    return field
+
+
+#%% Plan Index
+def default_index_file(dicom_folder: Path) -> Path:
+    """The index file used for a DICOM folder when none is given.
+
+    Each DICOM folder has its own index file in DEFAULT_INDEX_FOLDER, named
+        from a hash of the folder's full path.
+    Args:
+        dicom_folder (Path): Full path to a folder containing DICOM Plan
+            files.
+    Returns:
+        index_file (Path): Full path to the SQLite index file.
+    """
+    folder_name = str(Path(dicom_folder).resolve())
+    folder_hash = hashlib.sha1(folder_name.encode('utf-8')).hexdigest()[:16]
+    index_file = DEFAULT_INDEX_FOLDER / INDEX_FILE_NAME.format(
+        folder_hash=folder_hash)
+    return index_file
+
+
+class PlanIndex():
+    """An on-disk index of the field data for all plans in a directory.
+
+    Attributes:
+        dicom_folder (Path): Full path to the folder containing DICOM Plan
+            files.
+        index_file (Path): Full path to the SQLite index file.
+        discovery_options (Dict[str, Any]): Keyword arguments passed to
+            find_plan_files when scanning the folder.
+    """
+
+    def __init__(self, dicom_folder: Path, index_file: Path = None,
+                 **discovery_options):
+        """Open the index, creating it if it does not exist.
+
+        Args:
+            dicom_folder (Path): Full path to a folder containing DICOM Plan
+                files.
+            index_file (Path, optional): Full path to the SQLite index file.
+                Defaults to the file given by default_index_file.
+            discovery_options: Keyword arguments for
+                dicom_discovery.find_dicom_files; include, exclude,
+                max_depth, sniff and workers.
+        """
+        self.dicom_folder = Path(dicom_folder)
+        self.discovery_options = discovery_options
+        if index_file is None:
+            index_file = default_index_file(self.dicom_folder)
+        self.index_file = Path(index_file)
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        # The connection may be used by a background thread, such as a
+        # PlanFolderWatcher poll, as long as only one thread uses it at once.
+        self.connection = sqlite3.connect(str(self.index_file),
+                                          check_same_thread=False)
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != INDEX_VERSION:
+            self.connection.executescript(
+                'DROP TABLE IF EXISTS fields; DROP TABLE IF EXISTS plan_files;')
+            self.connection.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+        self.connection.executescript(INDEX_SCHEMA)
+
+    def close(self):
+        """Close the connection to the index file."""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def indexed_files(self) -> Dict[str, Tuple[int, int]]:
+        """Get the fingerprints of all files in the index.
+
+        Returns:
+            fingerprints (Dict[str, Tuple[int, int]]): The size and
+                modification time (ns) for each indexed file path.
+        """
+        rows = self.connection.execute(
+            'SELECT path, size, mtime FROM plan_files')
+        fingerprints = {path: (size, mtime) for path, size, mtime in rows}
+        return fingerprints
+
+    def remove_files(self, paths: List[str]):
+        """Delete the entries for the given files from the index.
+
+        Args:
+            paths (List[str]): The file paths to remove.
+        """
+        path_rows = [(path,) for path in paths]
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM fields WHERE path = ?', path_rows)
+            self.connection.executemany(
+                'DELETE FROM plan_files WHERE path = ?', path_rows)
+
+    def add_plan(self, plan_file: Path, fingerprint: Tuple[int, int],
+                 field_df: pd.DataFrame):
+        """Store the field data for a plan file, replacing any existing entry.
+
+        Args:
+            plan_file (Path): Full path to the DICOM file.
+            fingerprint (Tuple[int, int]): The size and modification time (ns)
+                of the file when it was read.
+            field_df (pd.DataFrame): Field parameters for all fields in the
+                plan.  None if the file is not a plan; the file is still
+                recorded so that it is not read again.
+        """
+        path = str(plan_file)
+        size, mtime = fingerprint
+        if field_df is None:
+            sop_instance_uid = None
+            field_rows = list()
+        else:
+            sop_instance_uid = field_df['SOPInstanceUID'].iloc[0]
+            field_rows = [
+                (path, field_number, *encode_field(field))
+                for field_number, field in enumerate(
+                    field_df.to_dict(orient='records'))
+                ]
+        with self.connection:
+            self.connection.execute('DELETE FROM fields WHERE path = ?',
+                                    (path,))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO plan_files VALUES (?, ?, ?, ?)',
+                (path, size, mtime, sop_instance_uid))
+            self.connection.executemany(
+                'INSERT INTO fields VALUES (?, ?, ?, ?)', field_rows)
+
+    def current_files(self) -> Dict[str, Tuple[Path, Tuple[int, int]]]:
+        """Get the fingerprints of the plan files currently in the folder.
+
+        Returns:
+            current (Dict[str, Tuple[Path, Tuple[int, int]]]): The file path
+                and fingerprint (size and modification time (ns)) for each
+                plan file currently in the folder.
+        """
+        current = dict()
+        for plan_file in find_plan_files(self.dicom_folder,
+                                         **self.discovery_options):
+            try:
+                stat = plan_file.stat()
+            except OSError:
+                continue
+            current[str(plan_file)] = (plan_file, (stat.st_size,
+                                                   stat.st_mtime_ns))
+        return current
+
+    def remove_unchanged(self, plan_files: List[Path],
+                         current: Dict[str, Tuple[Path, Tuple[int, int]]]
+                         ) -> List[Path]:
+        """Drop the files that still hold the plan stored in the index.
+
+        A file whose size and SOPInstanceUID match its index entry holds the
+            same plan, even if its modification time has changed (e.g. when
+            it is exported again).  Only the header of these files is read.
+            Their stored fingerprint is updated so that they are not checked
+            again.
+        Args:
+            plan_files (List[Path]): The files whose size or modification time
+                has changed.
+            current (Dict[str, Tuple[Path, Tuple[int, int]]]): The file path
+                and fingerprint for each plan file currently in the folder.
+        Returns:
+            changed_files (List[Path]): The files that must be read.
+        """
+        rows = self.connection.execute(
+            'SELECT path, size, sop_instance_uid FROM plan_files '
+            'WHERE sop_instance_uid IS NOT NULL')
+        indexed = {path: (size, uid) for path, size, uid in rows}
+        changed_files = list()
+        touched_files = list()
+        for plan_file in plan_files:
+            path = str(plan_file)
+            size, mtime = current[path][1]
+            indexed_size, indexed_uid = indexed.get(path, (None, None))
+            if indexed_size != size:
+                changed_files.append(plan_file)
+                continue
+            try:
+                header_ds = read_plan_header(plan_file)
+            except Exception:  # pylint: disable=broad-except
+                header_ds = None
+            if header_ds is None or \
+                    header_ds.get('SOPInstanceUID') != indexed_uid:
+                changed_files.append(plan_file)
+            else:
+                touched_files.append((mtime, path))
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE plan_files SET mtime = ? WHERE path = ?',
+                touched_files)
+        return changed_files
+
+    def compare_files(self) -> Tuple[Dict[str, Tuple[Path, Tuple[int, int]]],
+                                     List[Path], List[str]]:
+        """Compare the plan files in the folder with the indexed files.
+
+        Returns:
+            current (Dict[str, Tuple[Path, Tuple[int, int]]]): The file path
+                and fingerprint for each plan file currently in the folder.
+            updated_files (List[Path]): The files that are new or whose
+                content has changed.
+            removed_files (List[str]): The indexed paths that no longer exist.
+        """
+        indexed = self.indexed_files()
+        current = self.current_files()
+        removed_files = [path for path in indexed if path not in current]
+        updated_files = [plan_file
+                         for path, (plan_file, fingerprint) in current.items()
+                         if indexed.get(path) != fingerprint]
+        updated_files = self.remove_unchanged(updated_files, current)
+        return current, updated_files, removed_files
+
+    def rescan(self, parallel: bool = False, workers: int = None
+               ) -> Tuple[List[Path], List[str]]:
+        """Update the index to match the plan files currently in the folder.
+
+        Only files that are new, or whose size, modification time and
+            SOPInstanceUID show that they have changed, are read.  Entries for files that no longer exist are
+            deleted.
+        Args:
+            parallel (bool, optional): If True, read the plan files using a
+                pool of processes. Default is False.
+            workers (int, optional): The number of worker processes to use
+                when parallel is True.
+        Returns:
+            updated_files (List[Path]): The files that were read.
+            removed_files (List[str]): The paths removed from the index.
+        """
+        current, updated_files, removed_files = self.compare_files()
+        self.remove_files(removed_files)
+        plan_data = read_plans(updated_files, parallel, workers)
+        for plan_file, field_df in plan_data:
+            self.add_plan(plan_file, current[str(plan_file)][1], field_df)
+        return updated_files, removed_files
+
+    def iter_plan_records(self, parallel: bool = False, workers: int = None
+                          ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Update the index, yielding the field records for each plan file.
+
+        The records for unchanged files are yielded from the index first,
+            followed by the records for each new or changed file as it is
+            read.
+        Args:
+            parallel (bool, optional): If True, read the plan files using a
+                pool of processes. Default is False.
+            workers (int, optional): The number of worker processes to use
+                when parallel is True.
+        Yields:
+            path (str): The plan file path.
+            fields (List[Dict[str, Any]]): The parameters for each field in
+                the plan.
+        """
+        current, updated_files, removed_files = self.compare_files()
+        self.remove_files(removed_files)
+        updated_paths = {str(plan_file) for plan_file in updated_files}
+        rows = self.connection.execute(
+            'SELECT path, record, coordinates FROM fields '
+            'ORDER BY path, field_number').fetchall()
+        for path, path_rows in groupby(rows, key=itemgetter(0)):
+            if path not in updated_paths:
+                yield path, [decode_field(record, coordinates)
+                             for _, record, coordinates in path_rows]
+        for plan_file, field_df in iter_plan_results(updated_files, parallel,
+                                                     workers):
+            self.add_plan(plan_file, current[str(plan_file)][1], field_df)
+            if field_df is None:
+                yield str(plan_file), list()
+            else:
+                yield str(plan_file), field_df.to_dict(orient='records')
+
+    def iter_fields(self, parallel: bool = False,
+                    workers: int = None) -> Iterator[Dict[str, Any]]:
+        """Update the index, yielding field records as they become available.
+
+        Args:
+            parallel (bool, optional): If True, read the plan files using a
+                pool of processes. Default is False.
+            workers (int, optional): The number of worker processes to use
+                when parallel is True.
+        Yields:
+            field (Dict[str, Any]): The parameters for one field.
+        """
+        for _, fields in self.iter_plan_records(parallel, workers):
+            yield from fields
+
+    def get_plan_data(self) -> pd.DataFrame:
+        """Build the plan table from the indexed field records.
+
+        Returns:
+            plan_df (pd.DataFrame): Field parameters for all fields in all
+                plans, in the same form as load_dicom_e_plan.get_plan_data.
+        """
+        rows = self.connection.execute(
+            'SELECT record, coordinates FROM fields '
+            'ORDER BY path, field_number')
+        fields = [decode_field(record, coordinates)
+                  for record, coordinates in rows]
+        plan_df = FieldTable.from_records(fields).plan_df
+        return plan_df
+
+
+def get_indexed_plan_data(dicom_folder: Path, index_file: Path = None,
+                          parallel: bool = False,
+                          workers: int = None) -> pd.DataFrame:
+    """Load field data for all DICOM plan files in a directory using an index.
+
+    Args:
+        dicom_folder (Path): Full path to a folder containing DICOM Plan files.
+        index_file (Path, optional): Full path to the SQLite index file.
+            Defaults to the file given by default_index_file.
+        parallel (bool, optional): If True, read new plan files using a pool
+            of processes. Default is False.
+        workers (int, optional): The number of worker processes to use when
+            parallel is True.
+    Returns:
+        plan_df (pd.DataFrame): Field parameters for all fields in all plans.
+    """
+    with PlanIndex(dicom_folder, index_file) as plan_index:
+        plan_index.rescan(parallel, workers)
+        plan_df = plan_index.get_plan_data()
+    return plan_df
+
+
+#%% Folder Watching
+class PlanChanges(NamedTuple):
+    """The field records changed by a poll of the plan folder.
+
+    Attributes:
+        removed_fields (List[Dict[str, Any]]): The previous records of the
+            removed and changed plan files.
+        added_fields (List[Dict[str, Any]]): The records of the new and
+            changed plan files.
+    """
+    removed_fields: List[Dict[str, Any]]
+    added_fields: List[Dict[str, Any]]
+
+
+class PlanFolderWatcher():
+    """Track changes to the plan files in a folder by polling.
+
+    New, changed and removed plan files are detected by comparing file sizes
+        and modification times.  A new or changed file is only read once its
+        fingerprint has not changed for at least debounce seconds, so that
+        files still being exported are not read.  Files that still hold the
+        indexed plan are not read again.  Scanning a large or network folder
+        is slow, so poll may be run in a background thread; only one poll
+        may run at a time.
+    Attributes:
+        plan_index (PlanIndex): The index for the folder being watched.
+        plan_fields (Dict[str, List[Dict[str, Any]]]): The field records for
+            each plan file.
+        poll_interval (float): The minimum time in seconds between scans of
+            the folder.
+        debounce (float): The time in seconds that a file must remain
+            unchanged before it is read.
+    """
+
+    def __init__(self, plan_index: PlanIndex,
+                 plan_fields: Dict[str, List[Dict[str, Any]]],
+                 poll_interval: float = 5.0, debounce: float = 2.0):
+        """Start watching the folder.
+
+        Args:
+            plan_index (PlanIndex): The index for the folder to watch.  The
+                index should be up to date with the folder.
+            plan_fields (Dict[str, List[Dict[str, Any]]]): The field records
+                for each plan file, as yielded by
+                PlanIndex.iter_plan_records.
+            poll_interval (float, optional): The minimum time in seconds
+                between scans of the folder. Default is 5.
+            debounce (float, optional): The time in seconds that a file must
+                remain unchanged before it is read. Default is 2.
+        """
+        self.plan_index = plan_index
+        self.plan_fields = plan_fields
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.known_files = plan_index.indexed_files()
+        self.pending_files = dict()
+        self.last_poll = time.monotonic()
+
+    def fields(self) -> List[Dict[str, Any]]:
+        """Get the field records for all plan files.
+
+        Returns:
+            fields (List[Dict[str, Any]]): The parameters for each field.
+        """
+        return [field
+                for plan_fields in self.plan_fields.values()
+                for field in plan_fields]
+
+    def poll_due(self) -> bool:
+        """Check whether poll_interval seconds have passed since the last scan.
+
+        Returns:
+            due (bool): True if the folder should be scanned again.
+        """
+        return time.monotonic() - self.last_poll >= self.poll_interval
+
+    def poll(self) -> Optional[PlanChanges]:
+        """Scan the folder and apply any settled changes.
+
+        The folder is only scanned if poll_interval seconds have passed since
+            the last scan.
+        Returns:
+            changes (PlanChanges): The field records removed and added, or
+                None if the field records have not changed.
+        """
+        if not self.poll_due():
+            return None
+        now = time.monotonic()
+        self.last_poll = now
+        current = self.plan_index.current_files()
+        removed_files = [path for path in self.known_files
+                         if path not in current]
+        ready_files = list()
+        for path, (plan_file, fingerprint) in current.items():
+            if self.known_files.get(path) == fingerprint:
+                self.pending_files.pop(path, None)
+                continue
+            pending_fingerprint, first_seen = self.pending_files.get(
+                path, (None, now))
+            if pending_fingerprint != fingerprint:
+                self.pending_files[path] = (fingerprint, now)
+            elif now - first_seen >= self.debounce:
+                ready_files.append(plan_file)
+        if not (removed_files or ready_files):
+            return None
+        removed_fields = list()
+        added_fields = list()
+        self.plan_index.remove_files(removed_files)
+        for path in removed_files:
+            self.known_files.pop(path)
+            removed_fields.extend(self.plan_fields.pop(path, list()))
+        for plan_file in ready_files:
+            path = str(plan_file)
+            fingerprint, _ = self.pending_files.pop(path)
+            # Files that cannot be read are not retried until they change.
+            self.known_files[path] = fingerprint
+        changed_files = self.plan_index.remove_unchanged(ready_files,
+                                                         current)
+        if not (removed_files or changed_files):
+            return None
+        for plan_file in changed_files:
+            removed_fields.extend(self.plan_fields.pop(str(plan_file),
+                                                       list()))
+        for plan_file, field_df in read_plans(changed_files):
+            path = str(plan_file)
+            self.plan_index.add_plan(plan_file, self.known_files[path],
+                                     field_df)
+            if field_df is not None:
+                self.plan_fields[path] = field_df.to_dict(orient='records')
+                added_fields.extend(self.plan_fields[path])
+        if not (removed_fields or added_fields):
+            return None
+        return PlanChanges(removed_fields, added_fields)
@@ -0,0 +1,251 @@
+"""Cache of the image analysis results for scanned cutout images.
+
+Entries are addressed by a hash of the scan's content and the processing
+parameters, so a renamed or copied scan still hits the cache and a changed
+scan or setting does not.  Each entry is stored as two files in the cache
+folder:
+    <key>.npz  The image size, resolution, insert outline and limits.
+    <key>.npy  The denoised image, opened as a read-only memory map.
+The total size of the cache is bounded by removing the least recently used
+entries.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, NamedTuple, Optional
+import numpy as np
+
+
+#%% Cache Settings
+DEFAULT_CACHE_FOLDER = Path(tempfile.gettempdir()) / 'ElectronCutoutScans'
+DEFAULT_CACHE_SIZE = 1024 ** 3  # 1 GB
+# Increase when the stored results change so that old entries are ignored.
+CACHE_VERSION = 3
+HASH_BLOCK_SIZE = 1024 ** 2  # Read scans 1 MB at a time when hashing.
+
+
+class ScanOutline(NamedTuple):
+    """The results of analyzing a scanned cutout image.
+
+    Attributes:
+        height (float): The height of the image in points.
+        width (float): The width of the image in points.
+        dpi (np.ndarray): The resolution of the image in dots per inch.
+        insert_outline (np.ndarray): x,y coordinates of the insert outline in
+            inches.
+        insert_limits (np.ndarray): The extent of the insert in inches as
+            [x_min, y_min, x_max, y_max].
+        denoised (np.ndarray): The median filtered image.  None if only a
+            band around the outline was filtered.
+    """
+    height: float
+    width: float
+    dpi: np.ndarray
+    insert_outline: np.ndarray
+    insert_limits: np.ndarray
+    denoised: Optional[np.ndarray] = None
+
+
+def content_hash(image_file: Path) -> str:
+    """Calculate the SHA-256 hash of a file's content.
+
+    Args:
+        image_file (Path): Full path to the file.
+    Returns:
+        file_hash (str): The hash as a hexadecimal string.
+    """
+    file_hash = hashlib.sha256()
+    with open(image_file, 'rb') as scan:
+        for block in iter(lambda: scan.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+#%% Scan Cache
+class ScanCache():
+    """A size limited, least recently used cache of scan analysis results.
+
+    Attributes:
+        cache_folder (Path): The directory containing the cache files.
+        max_size (int): The maximum total size of the cache files in bytes.
+    """
+
+    def __init__(self, cache_folder: Path = None,
+                 max_size: int = DEFAULT_CACHE_SIZE):
+        """Open a scan cache, creating the cache folder if required.
+
+        Args:
+            cache_folder (Path, optional): The directory for the cache
+                files. Default is DEFAULT_CACHE_FOLDER.
+            max_size (int, optional): The maximum total size of the cache
+                files in bytes. Default is DEFAULT_CACHE_SIZE.
+        """
+        if cache_folder is None:
+            cache_folder = DEFAULT_CACHE_FOLDER
+        self.cache_folder = Path(cache_folder)
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    def cache_key(self, image_file: Path, **parameters: Any) -> str:
+        """Generate the cache key for a scan and its processing parameters.
+
+        Args:
+            image_file (Path): Full path to the scanned cutout image file.
+            **parameters (Any): The settings that affect the results.  The
+                values must be JSON serializable.
+        Returns:
+            key (str): A hexadecimal string identifying the cache entry.
+        """
+        settings = json.dumps(dict(parameters, version=CACHE_VERSION),
+                              sort_keys=True)
+        key = hashlib.sha256()
+        key.update(content_hash(image_file).encode())
+        key.update(settings.encode())
+        return key.hexdigest()
+
+    def entry_files(self, key: str) -> List[Path]:
+        """The files that store a cache entry.
+
+        Args:
+            key (str): The cache key.
+        Returns:
+            entry_files (List[Path]): The results file and the denoised image
+                file.
+        """
+        return [self.cache_folder / f'{key}.npz',
+                self.cache_folder / f'{key}.npy']
+
+    def get(self, key: str) -> Optional[ScanOutline]:
+        """Look up the analysis results for a cache key.
+
+        The entry is marked as recently used.
+        Args:
+            key (str): The cache key.
+        Returns:
+            scan_outline (ScanOutline): The cached results, with the denoised
+                image as a read-only memory map.  None if the key is not in
+                the cache.
+        """
+        results_file, denoised_file = self.entry_files(key)
+        try:
+            with np.load(results_file) as results:
+                stored = {name: results[name] for name in results.files}
+        except (OSError, ValueError):
+            return None
+        denoised = None
+        if denoised_file.exists():
+            denoised = np.load(denoised_file, mmap_mode='r')
+        for entry_file in (results_file, denoised_file):
+            if entry_file.exists():
+                os.utime(entry_file)
+        return ScanOutline(height=float(stored['height']),
+                           width=float(stored['width']),
+                           dpi=stored['dpi'],
+                           insert_outline=stored['insert_outline'],
+                           insert_limits=stored['insert_limits'],
+                           denoised=denoised)
+
+    def write_file(self, entry_file: Path,
+                   save: Callable[[BinaryIO], None]):
+        """Write a cache file under a unique temporary name and rename it.
+
+        Each writer has its own temporary file, so two writers for the same
+            entry cannot overwrite each other's partial file.
+        Args:
+            entry_file (Path): The cache file to write.
+            save (Callable[[BinaryIO], None]): Writes the file content to an
+                open binary file.
+        Raises:
+            OSError: If the file cannot be written or renamed.
+        """
+        handle, temporary_name = tempfile.mkstemp(
+            dir=self.cache_folder, prefix=f'{entry_file.stem}.',
+            suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temporary_file:
+                save(temporary_file)
+            os.replace(temporary_name, entry_file)
+        except OSError:
+            Path(temporary_name).unlink(missing_ok=True)
+            raise
+
+    def put(self, key: str, scan_outline: ScanOutline):
+        """Store analysis results and evict old entries if needed.
+
+        The files are written under temporary names and then renamed, so an
+            interrupted write does not leave a partial entry.  If the entry
+            cannot be replaced, for example because another thread has it
+            memory mapped on Windows, the results are not stored and the
+            next lookup is a cache miss.
+        Args:
+            key (str): The cache key.
+            scan_outline (ScanOutline): The results to store.
+        """
+        results_file, denoised_file = self.entry_files(key)
+        try:
+            if scan_outline.denoised is not None:
+                self.write_file(denoised_file, lambda file: np.save(
+                    file, np.asarray(scan_outline.denoised)))
+            self.write_file(results_file, lambda file: np.savez(
+                file, height=scan_outline.height, width=scan_outline.width,
+                dpi=scan_outline.dpi,
+                insert_outline=scan_outline.insert_outline,
+                insert_limits=scan_outline.insert_limits))
+        except OSError:
+            return
+        self.evict()
+
+    def entry_usage(self) -> Dict[str, Dict[str, float]]:
+        """The size and last use time of each cache entry.
+
+        Returns:
+            usage (Dict[str, Dict[str, float]]): For each cache key, the
+                total 'size' of its files in bytes and the most recent
+                'mtime'.
+        """
+        usage = dict()
+        for entry in os.scandir(self.cache_folder):
+            key, _, suffix = entry.name.partition('.')
+            if suffix not in ('npz', 'npy'):
+                continue
+            stat = entry.stat()
+            entry_usage = usage.setdefault(key, {'size': 0, 'mtime': 0.0})
+            entry_usage['size'] += stat.st_size
+            entry_usage['mtime'] = max(entry_usage['mtime'], stat.st_mtime)
+        return usage
+
+    def evict(self):
+        """Remove the least recently used entries until within max_size.
+
+        Entries whose files cannot be removed, for example because they are
+            memory mapped on Windows, are skipped.
+        """
+        usage = self.entry_usage()
+        total_size = sum(entry['size'] for entry in usage.values())
+        oldest_first = sorted(usage, key=lambda key: usage[key]['mtime'])
+        for key in oldest_first:
+            if total_size <= self.max_size:
+                break
+            try:
+                for entry_file in self.entry_files(key):
+                    if entry_file.exists():
+                        entry_file.unlink()
+            except OSError:
+                continue
+            total_size -= usage[key]['size']
+
+    def clear(self):
+        """Remove all entries, and any interrupted writes, from the cache."""
+        for key in self.entry_usage():
+            for entry_file in self.entry_files(key):
+                if entry_file.exists():
+                    entry_file.unlink()
+        for temporary_file in self.cache_folder.glob('*.tmp'):
+            temporary_file.unlink(missing_ok=True)
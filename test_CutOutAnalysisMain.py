@@ -0,0 +1,72 @@
+"""Tests for the plan table updates made by the GUI while watching a folder.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import shutil
+from pathlib import Path
+import numpy as np
+from CutOutAnalysisMain import apply_plan_changes, build_plan_tables
+from plan_index import PlanFolderWatcher, PlanIndex
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+PLAN_FILES = sorted(TEST_FILES.glob('RP*.dcm'))
+
+
+def assert_tables_equal(plan_tables, rebuilt_tables):
+    """The updated tables hold the same fields as the rebuilt tables."""
+    block_coords, field_table, field_options = plan_tables
+    rebuilt_coords, rebuilt_table, rebuilt_options = rebuilt_tables
+    assert sorted(field_table.fields.index) == \
+        sorted(rebuilt_table.fields.index)
+    assert sorted(field_options.index) == sorted(rebuilt_options.index)
+    assert set(block_coords.positions) == set(rebuilt_coords.positions)
+    for field in rebuilt_coords.positions:
+        np.testing.assert_array_equal(block_coords[field],
+                                      rebuilt_coords[field])
+
+
+#%% Plan Tables
+def test_empty_plan_tables():
+    """An empty DICOM folder gives empty tables."""
+    block_coords, field_table, field_options = build_plan_tables([])
+    assert len(block_coords) == len(field_table) == len(field_options) == 0
+
+
+def test_watcher_changes_match_rebuild(tmp_path: Path):
+    """Applying each poll's changes gives the same tables as a rebuild."""
+    dicom_folder = tmp_path / 'plans'
+    dicom_folder.mkdir()
+    for plan_file in PLAN_FILES:
+        shutil.copy(plan_file, dicom_folder)
+    with PlanIndex(dicom_folder, tmp_path / 'index.sqlite') as plan_index:
+        watcher = PlanFolderWatcher(
+            plan_index, dict(plan_index.iter_plan_records()),
+            poll_interval=0, debounce=0)
+        plan_tables = build_plan_tables(watcher.fields())
+
+        def poll_and_check():
+            # New files are read on the second poll after they appear.
+            nonlocal plan_tables
+            for _ in range(2):
+                changes = watcher.poll()
+                if changes is not None:
+                    plan_tables = apply_plan_changes(*plan_tables, changes)
+            assert_tables_equal(plan_tables,
+                                build_plan_tables(watcher.fields()))
+
+        (dicom_folder / PLAN_FILES[0].name).unlink()
+        poll_and_check()
+        shutil.copy(PLAN_FILES[0], dicom_folder / 'RP.renamed.dcm')
+        poll_and_check()
+        for plan_file in dicom_folder.glob('RP*.dcm'):
+            plan_file.unlink()
+        poll_and_check()
+        assert len(plan_tables[1]) == 0
+        shutil.copy(PLAN_FILES[1], dicom_folder)
+        poll_and_check()
+        assert len(plan_tables[1]) == 2
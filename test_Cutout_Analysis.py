@@ -0,0 +1,62 @@
+"""Tests for analyzing the scanned cutout images in 'Test Files'.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+from pathlib import Path
+import numpy as np
+import pytest
+from Cutout_Analysis import analyze_scan, check_applicator
+from cutout_image import PYRAMID_TOLERANCE
+from scan_cache import ScanCache
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+SCAN_FILES = [TEST_FILES / 'cutout_low_res.jpg',
+              TEST_FILES / 'Cutout scan.jpg']
+
+
+@pytest.fixture
+def scan_cache(tmp_path: Path) -> ScanCache:
+    """An empty cache, so that each analysis reads the scan."""
+    return ScanCache(tmp_path / 'cache')
+
+
+#%% Outline Search Modes
+@pytest.mark.parametrize('image_file', SCAN_FILES, ids=lambda file: file.stem)
+def test_pyramid_matches_full_search(image_file: Path,
+                                     scan_cache: ScanCache):
+    """The coarse-to-fine search finds the same insert limits."""
+    full = analyze_scan(image_file, pyramid=False, cache=scan_cache)
+    pyramid = analyze_scan(image_file, pyramid=True, cache=scan_cache)
+    np.testing.assert_allclose(pyramid.insert_limits, full.insert_limits,
+                               atol=PYRAMID_TOLERANCE)
+
+
+@pytest.mark.parametrize('image_file', SCAN_FILES, ids=lambda file: file.stem)
+def test_strips_match_full_search(image_file: Path, scan_cache: ScanCache):
+    """Processing the scan in strips of rows finds the same insert limits."""
+    full = analyze_scan(image_file, pyramid=False, cache=scan_cache)
+    # Strip results share the full search cache key, so use a second cache.
+    strips = analyze_scan(image_file, pyramid=False, strips=True,
+                          cache=ScanCache(scan_cache.cache_folder / 'strips'))
+    np.testing.assert_allclose(strips.insert_limits, full.insert_limits,
+                               atol=1e-9)
+
+
+#%% Applicator Check
+@pytest.mark.parametrize('insert_size, matches', [(6, True), (10, False),
+                                                  (20, None),
+                                                  (float('nan'), None)])
+def test_check_applicator(insert_size: float, matches):
+    """Only the measured frame sizes are checked; others are reported."""
+    applicator_check = check_applicator(SCAN_FILES[0], insert_size)
+    assert applicator_check.matches is matches
+    if matches is None:
+        assert applicator_check.frame_match is None
+        assert 'not checked' in applicator_check.message
+    else:
+        assert applicator_check.frame_match.applicator_size == 6
@@ -0,0 +1,139 @@
+"""Tests for comparing the scanned aperture with the planned aperture.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+from pathlib import Path
+import numpy as np
+import pytest
+from aperture_check import (Registration, compare_apertures, face_direction,
+                            plan_to_scan, register_aperture, scan_to_plan,
+                            transform_outline)
+from Cutout_Analysis import analyze_scan, compare_aperture
+from load_dicom_e_plan import get_block_coord, get_field_table
+from scan_cache import ScanCache
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+# Both scans are of the patient face of the CutoutTest3 9 MeV insert.
+SCAN_FILES = [TEST_FILES / 'cutout_low_res.jpg',
+              TEST_FILES / 'Cutout scan.jpg']
+SCAN_FIELD = ('ElectronCutoutTest3 (CutoutTest3)', 'NOSE', 'GA45 9MeV')
+SQUARE = np.array([[-2.0, -2.0], [2.0, -2.0], [2.0, 2.0], [-2.0, 2.0]])
+# An outline without symmetry, so that it has a single registration.
+L_SHAPE = np.array([[-2.0, -3.0], [2.5, -3.0], [2.5, -0.5], [0.0, -0.5],
+                    [0.0, 3.0], [-2.0, 3.0]])
+
+
+@pytest.fixture(scope='module')
+def block_coords():
+    """The apertures for all fields in the test plans."""
+    return get_block_coord(get_field_table(TEST_FILES))
+
+
+@pytest.fixture(scope='module')
+def scan_cache(tmp_path_factory) -> ScanCache:
+    """A cache shared by the tests in this module."""
+    return ScanCache(tmp_path_factory.mktemp('cache'))
+
+
+#%% Coordinate Conversion
+@pytest.mark.parametrize('scan_face', ['source', 'patient'])
+def test_plan_to_scan_inverts_scan_to_plan(scan_face: str):
+    """Converting to plan coordinates and back returns the scan points."""
+    insert_limits = np.array([1.0, 2.0, 5.0, 6.5])
+    outline = np.array([[1.5, 2.5], [4.0, 2.5], [3.0, 6.0]])
+    plan_outline = scan_to_plan(outline, insert_limits, scan_face=scan_face)
+    np.testing.assert_allclose(
+        plan_to_scan(plan_outline, insert_limits, scan_face=scan_face),
+        outline)
+
+
+def test_scan_faces_are_mirrored():
+    """The two faces give opposite plan X for the same scan point."""
+    insert_limits = np.array([0.0, 0.0, 4.0, 4.0])
+    outline = np.array([[1.0, 3.0]])
+    source = scan_to_plan(outline, insert_limits, scan_face='source')
+    patient = scan_to_plan(outline, insert_limits, scan_face='patient')
+    np.testing.assert_allclose(source * [-1, 1], patient)
+    with pytest.raises(ValueError):
+        face_direction('gantry')
+
+
+#%% Outline Comparison
+def test_identical_apertures():
+    """An aperture compared with itself has no differences."""
+    comparison = compare_apertures(SQUARE, [SQUARE])
+    assert comparison.hausdorff == pytest.approx(0)
+    assert comparison.area_difference == pytest.approx(0)
+    assert comparison.plan_area == pytest.approx(16)
+
+
+def test_shifted_aperture():
+    """A shifted aperture differs by the shift."""
+    comparison = compare_apertures(SQUARE + [0.1, 0], [SQUARE])
+    assert comparison.hausdorff == pytest.approx(0.1, abs=0.01)
+    assert comparison.area_difference == pytest.approx(0)
+
+
+#%% Scanned Apertures
+@pytest.mark.parametrize('image_file', SCAN_FILES, ids=lambda file: file.stem)
+def test_scanned_aperture_matches_plan(image_file: Path, block_coords,
+                                       scan_cache: ScanCache):
+    """The scanned aperture is close to the plan without registration."""
+    scan_outline = analyze_scan(image_file, cache=scan_cache)
+    comparison = compare_aperture(image_file, block_coords, SCAN_FIELD,
+                                  scan_outline, scan_face='patient')
+    assert comparison.registration is None
+    assert comparison.hausdorff < 0.5
+    assert abs(comparison.area_difference) < 0.05 * comparison.plan_area
+
+
+#%% Registration
+def moved_outline(outline: np.ndarray, rotation: float,
+                  translation: list) -> np.ndarray:
+    """Rotate and shift an outline."""
+    return transform_outline(outline, Registration(
+        rotation, np.array(translation), 0.0, 0.0, 0, True))
+
+
+def test_registration_recovers_movement():
+    """The rotation and shift of a moved aperture are found."""
+    scan_aperture = moved_outline(L_SHAPE, 2.0, [0.3, -0.2])
+    registration = register_aperture([L_SHAPE], scan_aperture,
+                                     initial_rotation=1.0)
+    assert registration.converged
+    assert registration.initial_rotation == 1.0
+    assert registration.rotation == pytest.approx(2.0, abs=0.05)
+    np.testing.assert_allclose(registration.translation, [0.3, -0.2],
+                               atol=0.01)
+    assert registration.rms_residual < 0.01
+
+
+def test_registration_rotation_limit():
+    """A rotation beyond the limit is held at the limit and flagged."""
+    scan_aperture = moved_outline(L_SHAPE, 8.0, [0.0, 0.0])
+    registration = register_aperture([L_SHAPE], scan_aperture,
+                                     max_rotation=3.0)
+    assert not registration.converged
+    assert registration.rotation == pytest.approx(3.0)
+
+
+@pytest.mark.parametrize('image_file', SCAN_FILES, ids=lambda file: file.stem)
+def test_scanned_aperture_registration(image_file: Path, block_coords,
+                                       scan_cache: ScanCache):
+    """Registering the plan onto the scan converges and closes the gap."""
+    scan_outline = analyze_scan(image_file, cache=scan_cache)
+    unregistered = compare_aperture(image_file, block_coords, SCAN_FIELD,
+                                    scan_outline, scan_face='patient')
+    registered = compare_aperture(image_file, block_coords, SCAN_FIELD,
+                                  scan_outline, register=True,
+                                  scan_face='patient')
+    registration = registered.registration
+    assert registration.converged
+    assert abs(registration.rotation - registration.initial_rotation) <= 3.0
+    assert registered.hausdorff < 0.3
+    assert registered.hausdorff < unregistered.hausdorff
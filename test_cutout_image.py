@@ -0,0 +1,68 @@
+"""Tests for the image processing of the scanned cutout images.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+from pathlib import Path
+import numpy as np
+import pytest
+from scipy import ndimage
+from cutout_image import (MEDIAN_SIZE, denoise_image, denoise_tiled,
+                          deskew_outline, estimate_skew, read_scan)
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+
+
+@pytest.fixture(scope='module')
+def scan_crop() -> np.ndarray:
+    """A corner of a scan that includes the page edge and part of an insert."""
+    return read_scan(TEST_FILES / 'cutout_low_res.jpg')[:300, :300]
+
+
+#%% Denoise Backends
+@pytest.mark.parametrize('backend', ['scipy', 'histogram'])
+def test_exact_backends_match_scipy(backend: str, scan_crop: np.ndarray):
+    """The exact backends give the scipy median filter, pixel for pixel."""
+    np.testing.assert_array_equal(denoise_image(scan_crop, backend),
+                                  ndimage.median_filter(scan_crop,
+                                                        MEDIAN_SIZE))
+
+
+def test_unknown_backend(scan_crop: np.ndarray):
+    """An unknown backend name is rejected."""
+    with pytest.raises(ValueError):
+        denoise_image(scan_crop, 'gaussian')
+
+
+#%% Tiled Denoise
+@pytest.mark.parametrize('tile_rows', [64, 97])
+def test_tiled_denoise_matches_whole_image(tile_rows: int,
+                                           scan_crop: np.ndarray):
+    """Denoising in tiles with a halo gives the same image as one pass."""
+    np.testing.assert_array_equal(
+        denoise_tiled(scan_crop, workers=4, tile_rows=tile_rows),
+        denoise_image(scan_crop))
+
+
+#%% Skew
+@pytest.mark.parametrize('skew', [-5.5, 0.0, 3.0])
+def test_deskew_squares_outline(skew: float):
+    """A skewed rectangle is found and squared, keeping its size and centre."""
+    corners = np.array([[-1.5, -1.0], [1.5, -1.0], [1.5, 1.0], [-1.5, 1.0]])
+    angle = np.radians(skew)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)],
+                         [np.sin(angle), np.cos(angle)]])
+    outline = corners @ rotation.T + [4.0, 3.0]
+    estimated_skew, confidence = estimate_skew(outline)
+    assert estimated_skew == pytest.approx(skew, abs=1e-6)
+    assert confidence == pytest.approx(1.0)
+    square_outline = deskew_outline(outline, estimated_skew)
+    residual_skew, _ = estimate_skew(square_outline)
+    assert residual_skew == pytest.approx(0.0, abs=1e-6)
+    size = np.ptp(square_outline, axis=0)
+    np.testing.assert_allclose(sorted(size), [2.0, 3.0])
+    np.testing.assert_allclose(square_outline.mean(axis=0), [4.0, 3.0])
@@ -0,0 +1,85 @@
+"""Tests for rendering the cutout report overlay.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+from pathlib import Path
+import numpy as np
+import pytest
+from PIL import Image
+from cutout_overlay import (OUTLINE_COLOUR, plan_to_overlay, render_overlay,
+                            save_overlay)
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+# A 1 x 1 inch bright insert on a dark page, scanned at 100 dpi across
+# (x) and 200 dpi down (y).
+SCAN_DPI = np.array([100.0, 200.0])
+INSERT_LIMITS = np.array([0.5, 1.0, 1.5, 2.0])
+
+
+@pytest.fixture
+def scan_image() -> np.ndarray:
+    """A scan with non-square pixels."""
+    cutout_image = np.zeros((400, 300), dtype=np.uint8)
+    cutout_image[100:300, 100:200] = 255
+    return cutout_image
+
+
+#%% Resampling
+def test_overlay_scales_each_axis(scan_image: np.ndarray):
+    """The insert is square in the overlay although the scan pixels are not."""
+    overlay = render_overlay(scan_image, SCAN_DPI, INSERT_LIMITS, 0.0, [],
+                             6, render_dpi=50)
+    assert overlay.size == (100, 100)
+    bright = np.asarray(overlay.convert('L')) > 128
+    # The cross-hair is drawn in colour, so only check off its lines.
+    rows = np.flatnonzero(bright[:, 30])
+    columns = np.flatnonzero(bright[30, :])
+    assert (rows.min(), rows.max()) == pytest.approx((25, 74), abs=1)
+    assert (columns.min(), columns.max()) == pytest.approx((25, 74), abs=1)
+
+
+def test_overlay_rotation_keeps_centre(scan_image: np.ndarray):
+    """Deskewing rotates the insert about the centre of the overlay."""
+    overlay = render_overlay(scan_image, SCAN_DPI, INSERT_LIMITS, 45.0, [],
+                             6, render_dpi=50)
+    gray = np.asarray(overlay.convert('L'))
+    assert gray[30, 50] > 128
+    assert gray[27, 27] < 128
+
+
+#%% Drawing
+def test_scan_faces_mirror_the_plan():
+    """The plan X axis runs the opposite way for the two scanned faces."""
+    outline = np.array([[1.0, 2.0]])
+    (source_x, source_y), = plan_to_overlay(outline, (200, 100), np.zeros(2),
+                                            scan_face='source')
+    (patient_x, patient_y), = plan_to_overlay(outline, (200, 100),
+                                              np.zeros(2),
+                                              scan_face='patient')
+    assert source_x - 100 == pytest.approx(100 - patient_x)
+    assert source_y == patient_y < 50
+
+
+def test_render_scan(tmp_path: Path):
+    """A real scan renders with the plan outline and saves as a PNG."""
+    cutout_image = np.asarray(Image.open(TEST_FILES / 'cutout_low_res.jpg'
+                                         ).convert('L'))
+    dpi = np.array([150.0, 150.0])
+    insert_limits = np.array([2.0, 1.5, 5.5, 5.0])
+    plan_outline = np.array([[-2.0, -2.0], [2.0, -2.0], [2.0, 2.0],
+                             [-2.0, 2.0]])
+    overlay = render_overlay(cutout_image, dpi, insert_limits, 2.0,
+                             [plan_outline], 10)
+    assert overlay.mode == 'RGB'
+    assert overlay.size == (675, 675)
+    pixels = np.asarray(overlay)
+    assert np.all(pixels == OUTLINE_COLOUR, axis=-1).any()
+    overlay_file = save_overlay(overlay, tmp_path / 'overlay.png')
+    with Image.open(overlay_file) as saved:
+        assert saved.size == overlay.size
+        assert saved.info['dpi'] == pytest.approx((150, 150), abs=0.1)
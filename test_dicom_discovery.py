@@ -0,0 +1,47 @@
+"""Tests for finding the DICOM plan files in a folder tree.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import shutil
+from pathlib import Path
+from dicom_discovery import find_dicom_files, is_dicom_file
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+PLAN_FILES = sorted(TEST_FILES.glob('RP*.dcm'))
+
+
+#%% Discovery
+def test_finds_plan_files():
+    """The name pattern selects the plans and skips the scans."""
+    assert find_dicom_files(TEST_FILES) == PLAN_FILES
+
+
+def test_sniff_finds_renamed_plans(tmp_path: Path):
+    """Sniffing finds plans by content, in sub-folders, whatever the name."""
+    sub_folder = tmp_path / 'patient' / 'plans'
+    sub_folder.mkdir(parents=True)
+    shutil.copy(PLAN_FILES[0], sub_folder / 'exported_plan')
+    shutil.copy(TEST_FILES / 'Cutout scan.jpg', sub_folder)
+    assert find_dicom_files(tmp_path) == []
+    assert find_dicom_files(tmp_path, sniff=True) == [
+        sub_folder / 'exported_plan']
+    assert is_dicom_file(sub_folder / 'exported_plan')
+    assert not is_dicom_file(sub_folder / 'Cutout scan.jpg')
+
+
+def test_depth_and_exclusions(tmp_path: Path):
+    """Sub-folders beyond max_depth or matching exclude are skipped."""
+    for folder_name in ('top', 'top/deeper', 'top/Archive'):
+        folder = tmp_path / folder_name
+        folder.mkdir()
+        shutil.copy(PLAN_FILES[0], folder)
+    plan_name = PLAN_FILES[0].name
+    assert find_dicom_files(tmp_path, max_depth=1) == [
+        tmp_path / 'top' / plan_name]
+    assert find_dicom_files(tmp_path, exclude=['Archive']) == [
+        tmp_path / 'top' / plan_name, tmp_path / 'top/deeper' / plan_name]
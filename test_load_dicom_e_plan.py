@@ -0,0 +1,59 @@
+"""Tests for reading the field data from the DICOM plans in 'Test Files'.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from load_dicom_e_plan import (FieldTable, get_block_coord, get_plan_data,
+                               read_dicom_plan)
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+PLAN_FILES = sorted(TEST_FILES.glob('RP*.dcm'))
+
+
+def plan_records(plan_file: Path):
+    """The field records for one plan file."""
+    return read_dicom_plan(plan_file).to_dict(orient='records')
+
+
+#%% Plan Loading
+def test_parallel_plan_data_matches_serial():
+    """Reading the plans with a process pool gives the same plan table."""
+    serial_df = get_plan_data(TEST_FILES)
+    parallel_df = get_plan_data(TEST_FILES, parallel=True, workers=2)
+    pd.testing.assert_frame_equal(serial_df, parallel_df)
+
+
+#%% Field Tables
+def test_empty_field_table():
+    """A folder without plans gives empty tables rather than an error."""
+    field_table = FieldTable.from_records([])
+    assert len(field_table) == 0
+    assert len(get_block_coord(field_table)) == 0
+
+
+def test_update_matches_rebuild():
+    """Removing one plan and adding another equals building from scratch."""
+    kept, removed, added = (plan_records(plan_file)
+                            for plan_file in PLAN_FILES[:3])
+    field_table = FieldTable.from_records(kept + removed)
+    block_coords = get_block_coord(field_table)
+    removed_fields = list(FieldTable.from_records(removed).fields.index)
+    added_table = FieldTable.from_records(added)
+    field_table = field_table.update(removed_fields, added)
+    block_coords = block_coords.update(removed_fields,
+                                       get_block_coord(added_table))
+    rebuilt_table = FieldTable.from_records(kept + added)
+    rebuilt_coords = get_block_coord(rebuilt_table)
+    assert sorted(field_table.fields.index) == \
+        sorted(rebuilt_table.fields.index)
+    assert set(block_coords.positions) == set(rebuilt_coords.positions)
+    for field in rebuilt_coords.positions:
+        np.testing.assert_array_equal(block_coords[field],
+                                      rebuilt_coords[field])
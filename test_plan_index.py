@@ -0,0 +1,120 @@
+"""Tests for the persistent plan index, using the plans in 'Test Files'.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import os
+import shutil
+from pathlib import Path
+import pandas as pd
+import pytest
+from load_dicom_e_plan import get_plan_data
+from plan_index import PlanFolderWatcher, PlanIndex
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+
+
+@pytest.fixture
+def dicom_folder(tmp_path: Path) -> Path:
+    """A copy of the test plans that the tests can change."""
+    plan_folder = tmp_path / 'plans'
+    plan_folder.mkdir()
+    for plan_file in TEST_FILES.glob('RP*.dcm'):
+        shutil.copy2(plan_file, plan_folder)
+    return plan_folder
+
+
+@pytest.fixture
+def plan_index(dicom_folder: Path, tmp_path: Path) -> PlanIndex:
+    """An empty index of the copied plans."""
+    with PlanIndex(dicom_folder, tmp_path / 'index.sqlite') as index:
+        yield index
+
+
+def sorted_table(plan_df: pd.DataFrame) -> pd.DataFrame:
+    """Put the plan table rows and columns in a fixed order for comparison."""
+    return plan_df.sort_index(axis='index').sort_index(axis='columns')
+
+
+#%% Plan Index
+def test_index_matches_direct_read(plan_index: PlanIndex,
+                                   dicom_folder: Path):
+    """The indexed plan table is the same as reading the plans directly."""
+    plan_index.rescan()
+    pd.testing.assert_frame_equal(
+        sorted_table(plan_index.get_plan_data()),
+        sorted_table(get_plan_data(dicom_folder)))
+
+
+def test_rescan_reads_only_new_files(plan_index: PlanIndex,
+                                     dicom_folder: Path):
+    """A second rescan reads nothing; a removed plan is dropped."""
+    updated_files, _ = plan_index.rescan()
+    assert len(updated_files) == 5
+    assert plan_index.rescan() == ([], [])
+    removed_file = next(dicom_folder.glob('RP*.dcm'))
+    removed_file.unlink()
+    assert plan_index.rescan() == ([], [str(removed_file)])
+
+
+def test_touched_file_is_not_read(plan_index: PlanIndex,
+                                  dicom_folder: Path):
+    """A plan whose modification time changed but not its content is kept."""
+    plan_index.rescan()
+    plan_file = next(dicom_folder.glob('RP*.dcm'))
+    stat = plan_file.stat()
+    os.utime(plan_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert plan_index.rescan() == ([], [])
+    assert plan_index.indexed_files()[str(plan_file)][1] == \
+        stat.st_mtime_ns + 10**9
+
+
+def test_reopened_index_is_kept(dicom_folder: Path, tmp_path: Path):
+    """The index persists between sessions."""
+    index_file = tmp_path / 'index.sqlite'
+    with PlanIndex(dicom_folder, index_file) as plan_index:
+        plan_index.rescan()
+    with PlanIndex(dicom_folder, index_file) as plan_index:
+        assert plan_index.rescan() == ([], [])
+        assert not plan_index.get_plan_data().empty
+
+
+#%% Folder Watching
+def make_watcher(plan_index: PlanIndex) -> PlanFolderWatcher:
+    """A watcher that scans on every poll, starting from the current plans."""
+    plan_fields = dict(plan_index.iter_plan_records())
+    return PlanFolderWatcher(plan_index, plan_fields, poll_interval=0,
+                             debounce=0)
+
+
+def test_watcher_reports_removed_fields(plan_index: PlanIndex,
+                                        dicom_folder: Path):
+    """Removing a plan reports only that plan's fields."""
+    watcher = make_watcher(plan_index)
+    assert watcher.poll() is None
+    removed_file = next(dicom_folder.glob('RP*.dcm'))
+    removed_records = watcher.plan_fields[str(removed_file)]
+    removed_file.unlink()
+    changes = watcher.poll()
+    assert changes.removed_fields == removed_records
+    assert changes.added_fields == []
+    assert str(removed_file) not in plan_index.indexed_files()
+
+
+def test_watcher_waits_for_new_file_to_settle(plan_index: PlanIndex,
+                                              dicom_folder: Path):
+    """A new plan is read on the poll after it is first seen."""
+    watcher = make_watcher(plan_index)
+    field_count = len(watcher.fields())
+    new_file = dicom_folder / 'RP.new.dcm'
+    shutil.copy(next(TEST_FILES.glob('RP*.dcm')), new_file)
+    assert watcher.poll() is None
+    changes = watcher.poll()
+    assert changes.removed_fields == []
+    assert changes.added_fields == watcher.plan_fields[str(new_file)]
+    assert len(watcher.fields()) == field_count + len(changes.added_fields)
+    assert watcher.poll() is None
@@ -0,0 +1,97 @@
+"""Tests for the cache of scan analysis results.
+
+Created on Sat Oct 17 2026
+
+@author: Greg
+"""
+#%% Imports
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import pytest
+from scan_cache import ScanCache, ScanOutline
+
+
+#%% Test Data
+TEST_FILES = Path(__file__).parent / 'Test Files'
+SCAN_FILE = TEST_FILES / 'cutout_low_res.jpg'
+
+
+@pytest.fixture
+def scan_cache(tmp_path: Path) -> ScanCache:
+    """An empty cache in a temporary folder."""
+    return ScanCache(tmp_path / 'cache')
+
+
+def make_outline(denoised: bool = True) -> ScanOutline:
+    """Analysis results with known values."""
+    outline = np.array([[1.0, 1.0], [6.0, 1.0], [6.0, 5.0], [1.0, 5.0]])
+    image = np.arange(200 * 300, dtype=np.uint8).reshape(200, 300)
+    return ScanOutline(height=792.0, width=612.0, dpi=np.array([150., 150.]),
+                       insert_outline=outline,
+                       insert_limits=np.array([1.0, 1.0, 6.0, 5.0]),
+                       denoised=image if denoised else None)
+
+
+#%% Cache Keys
+def test_key_follows_content_and_settings(scan_cache: ScanCache,
+                                          tmp_path: Path):
+    """A copied scan shares its key; a changed setting does not."""
+    copied_scan = tmp_path / 'renamed.jpg'
+    copied_scan.write_bytes(SCAN_FILE.read_bytes())
+    key = scan_cache.cache_key(SCAN_FILE, pyramid=True)
+    assert scan_cache.cache_key(copied_scan, pyramid=True) == key
+    assert scan_cache.cache_key(SCAN_FILE, pyramid=False) != key
+
+
+#%% Round Trip
+def test_round_trip(scan_cache: ScanCache):
+    """Stored results are returned, with the image as a memory map."""
+    scan_outline = make_outline()
+    scan_cache.put('entry', scan_outline)
+    cached = scan_cache.get('entry')
+    assert (cached.height, cached.width) == (792.0, 612.0)
+    for name in ('dpi', 'insert_outline', 'insert_limits', 'denoised'):
+        np.testing.assert_array_equal(getattr(cached, name),
+                                      getattr(scan_outline, name))
+    assert isinstance(cached.denoised, np.memmap)
+    assert not cached.denoised.flags.writeable
+    del cached
+
+
+def test_missing_entry(scan_cache: ScanCache):
+    """A key that was never stored is a miss."""
+    assert scan_cache.get('missing') is None
+    scan_cache.put('outline only', make_outline(denoised=False))
+    assert scan_cache.get('outline only').denoised is None
+
+
+def test_concurrent_writers(scan_cache: ScanCache):
+    """Several threads storing the same entry leave one complete entry."""
+    scan_outline = make_outline()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: scan_cache.put('entry', scan_outline),
+                          range(20)))
+    assert not list(scan_cache.cache_folder.glob('*.tmp'))
+    cached = scan_cache.get('entry')
+    np.testing.assert_array_equal(cached.denoised, scan_outline.denoised)
+    del cached
+
+
+#%% Cache Size
+def test_eviction_and_clear(tmp_path: Path):
+    """The least recently used entries are removed to stay within size."""
+    scan_outline = make_outline()
+    scan_cache = ScanCache(tmp_path / 'cache', max_size=0)
+    scan_cache.put('first', scan_outline)
+    assert scan_cache.get('first') is None
+    scan_cache.max_size = 3 * scan_outline.denoised.nbytes // 2
+    scan_cache.put('old', scan_outline)
+    for entry_file in scan_cache.entry_files('old'):
+        os.utime(entry_file, (0, 0))
+    scan_cache.put('new', scan_outline)
+    assert set(scan_cache.entry_usage()) == {'new'}
+    (scan_cache.cache_folder / 'new.tmp').write_bytes(b'partial')
+    scan_cache.clear()
+    assert not list(scan_cache.cache_folder.iterdir())